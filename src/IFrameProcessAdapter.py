@@ -72,6 +72,11 @@ class IFrameProcessAdapter:
     @property
     def height(self) -> int:
         return 0
+    
+    # nominal interval between frames, None if unknown
+    @property
+    def frame_interval_ms(self) -> Optional[int]:
+        return None
 
     # overridden by the input block implementor if needed
     def backend__input__setup(self):
@@ -89,6 +94,11 @@ class IFrameProcessAdapter:
                                    ) -> Tuple[bool, np.ndarray, any]:
         raise NotImplementedError()
 
+    # overridden by the input block implementor if needed
+    # the frame (grabbed with this metadata) is not used anymore
+    def backend__input__release_frame(self, metadata: Any):
+        pass
+
     # overridden by the input block implementor if needed
     def backend__input__is_ready(self, ignore_cache: bool) -> bool:
         return False
@@ -100,3 +110,8 @@ class IFrameProcessAdapter:
     # overridden by the input block implementor if needed
     def backend__input__is_callback_available(self) -> bool:
         return False
+
+    # overridden by the input block implementor if needed
+    # return a file descriptor which becomes readable when a new frame is available
+    def backend__input__sync_fd(self) -> Optional[int]:
+        return None
@@ -17,6 +17,8 @@ import video_backend.rtsp.filterchain as filterchain
 import video_backend.rtsp.rtsp_task as rtsp_task
 import video_backend.rgb_task as rgb_task
 import video_backend.consumer as consumer
+import video_backend.recorder_queue as recorder_queue
+from video_backend.encoder_farm import EncoderFarmSpec
 
 from gui.backend.stages.RGBFilter import RGBFilter
 import event.tunneling as tunneling
@@ -41,6 +43,22 @@ class RecordingStatusUpdate:
         return self.started and not self.finished
 
 
+@dataclass
+class RecorderHealthUpdate:
+    falling_behind: bool
+    stats: recorder_queue.RecorderStatsSnapshot
+
+
+# passthrough mode: the recorder remote started (filepath) or stopped (None)
+#  a recording, the frontend forwards it to the receiver process
+@dataclass
+class PassthroughRecordingRequest:
+    filepath: Optional[str]
+    
+    def __bool__(self) -> bool:
+        return self.filepath is not None
+
+
 class CustomRecorderRemoteBase(rgb_task.RecorderRemoteControlBase):
     def generate_filename(self, change: Any) -> str:
         setattr(self, '__current_change', change)
@@ -100,24 +118,59 @@ class RGBRecorder(signalling.Stage, resource.Frontend):
     recording_basename: str
     notifier_property: str
     start_immediately: bool
+    # None: the recorder encodes in its own process
+    encoder_farm: Optional[EncoderFarmSpec] = None
+    # consumer.RecorderMode value (project config)
+    recording_mode: str = consumer.RecorderMode.DECODED.value
+    # the RTSP receiver of the stream, passthrough mode only
+    receiver_process_id: Any = None
+    receiver_source_id: Any = None
 
     TUNNEL_SOURCE_LOOKUP_CLS = tunneling.TunnelControlBase
     TUNNEL_BASE_CLS = tunneling.TunnelControlBase
     THREADING_RECEIVER_BASE_CLS = net.receiver.ThreadingServerReceiverControlBase
     PATCH_BASE_CLS = patch.StreamerPatchCommand
 
+    @property
+    def passthrough(self) -> bool:
+        return consumer.RecorderMode(self.recording_mode) == consumer.RecorderMode.PASSTHROUGH
+
+    @property
+    def passthrough_recorder_id(self) -> Tuple:
+        return self._build_passthrough_id(self._get_common_id(self.tunnel_id))
+
     def command_sequence(self, *args, start: bool, **kwargs) -> Optional[Iterable[signalling.Command]]:
+        if start and self.passthrough and self.receiver_process_id is None:
+            raise RuntimeError('Passthrough recording needs an RTSP receiver')
+
         if start:
             recorder = rgb_task.Recorder_Create(
                 process_id=self.process_id,
                 input_filter_id=self.filter_id,
                 fps=self.fps,
                 recording_dir=self.recording_dir,
-                recording_basename=self.recording_basename
+                recording_basename=self.recording_basename,
+                encoder_farm=self.encoder_farm,
+                recording_mode=consumer.RecorderMode(self.recording_mode)
             )
             recorder.process_id = self.process_id
             yield recorder
 
+            if self.passthrough:
+                yield rtsp_task.PassthroughRecorder_Create(
+                    self.receiver_process_id,
+                    recorder_id=self.passthrough_recorder_id,
+                    recording_dir=self.recording_dir,
+                    recording_basename=self.recording_basename,
+                    source_id=self.receiver_source_id
+                )
+                # runs the muxer only, see passthrough_command
+                yield rtsp_task.PassthroughRecorder_Start(
+                    self.receiver_process_id,
+                    self.passthrough_recorder_id,
+                    start_recording=False
+                )
+
             receiver_patch = patch.StreamerPatchCommand(
                 RGBRecorder._patch_selector,
                 RGBRecorder._patcher,
@@ -149,10 +202,26 @@ class RGBRecorder(signalling.Stage, resource.Frontend):
                 self.start_immediately
             )
         elif self.process_id is not None and self.filter_id is not None:
+            if self.passthrough:
+                yield rtsp_task.PassthroughRecorder_Stop(self.receiver_process_id, self.passthrough_recorder_id)
+
+                yield rtsp_task.PassthroughRecorder_Delete(self.receiver_process_id, self.passthrough_recorder_id)
+
             yield rgb_task.Recorder_Stop(self.process_id, self.filter_id)
 
             yield rgb_task.Recorder_Delete(self.process_id, self.filter_id)
 
+    # keyframe-aligned start/stop in the receiver process
+    def passthrough_command(self, request: PassthroughRecordingRequest) -> signalling.Command:
+        if request:
+            return rtsp_task.PassthroughRecorder_Start(
+                self.receiver_process_id,
+                self.passthrough_recorder_id,
+                filepath=request.filepath
+            )
+
+        return rtsp_task.PassthroughRecorder_Stop(self.receiver_process_id, self.passthrough_recorder_id)
+
     @functools.cached_property
     def generated(self) -> MutableMapping[str, Any]:
         return {}
@@ -227,6 +296,30 @@ class RGBRecorder(signalling.Stage, resource.Frontend):
 
         command.metadata.activation_channel.subscribe(send_notify)
 
+        # the writer falls behind (or recovers)
+        recorder_control = process.context.get(rgb_task.RecorderControlBase, {}).get(command.input_filter_id)
+
+        def send_health(update: notifier.Update):
+            process.backend_messenger.deferred_reply(
+                patch_control,
+                RecorderHealthUpdate(
+                    update.extract_nested_value(),
+                    recorder_control.snapshot(reset=False)
+                )
+            )
+
+        # passthrough mode: the activations are forwarded instead
+        def send_passthrough_request(update: notifier.Update):
+            process.backend_messenger.deferred_reply(
+                patch_control,
+                PassthroughRecordingRequest(update.value)
+            )
+
+        if isinstance(recorder_control, consumer.PassthroughTriggerControl):
+            recorder_control.request_channel.subscribe(send_passthrough_request)
+        elif recorder_control is not None:
+            recorder_control.health_channel.subscribe(send_health)
+
         return result
 
     @classmethod
@@ -245,6 +338,10 @@ class RGBRecorder(signalling.Stage, resource.Frontend):
     def _build_recorder_id(cls, common_id: Any) -> Tuple:
         return (cls.THREADING_RECEIVER_BASE_CLS, common_id)
 
+    @classmethod
+    def _build_passthrough_id(cls, common_id: Any) -> Tuple:
+        return (rtsp_task.PassthroughRecorderControlBase, common_id)
+
     @classmethod
     def _build_patch_id(cls, common_id: Any) -> Tuple:
         return (cls.PATCH_BASE_CLS, common_id)
@@ -18,6 +18,15 @@ from gui.backend.stages.RTSPFilter import RTSPFilter
 class RTSPDecoder(signalling.Stage, resource.Frontend):
     receiver: RTSPReceiver
     input_filter: Optional[RTSPFilter] = None
+    decoder_threads: int = wx_form.NumberInput.field(default=1, min_value=1, max_value=32, display_name='Decoder threads')
+    decoder_fifo_size: int = wx_form.NumberInput.field(default=20, min_value=2, max_value=1000, display_name='Decoder FIFO size (frames)')
+    decoder_flush_when_full: int = wx_form.NumberInput.field(default=0, min_value=0, max_value=1, display_name='Flush full decoder FIFO (0/1)')
+    # project config only
+    decoder_fifo_setup: int = 20
+    decoder_fifo_signal: int = 20
+    # 'full' or 'keyframes' (monitor profile)
+    decode_mode: str = rtsp_task.DecodeMode.FULL.value
+    keyframe_interval_sec: float = 2.0
     
     KEY_DECODER_ID = 'decoder_id'
     @property
@@ -33,13 +42,21 @@ class RTSPDecoder(signalling.Stage, resource.Frontend):
             decoder = self.generated['decoder'] = rtsp_task.DecoderSpec(
                 f"root{self.receiver.slot_id}_decoder_fork",
                 f"root{self.receiver.slot_id}_decoder",
-                f"root{self.receiver.slot_id}_decoder_avthread"
+                f"root{self.receiver.slot_id}_decoder_avthread",
+                n_threads=self.decoder_threads,
+                fifo_basic=self.decoder_fifo_size,
+                fifo_setup=self.decoder_fifo_setup,
+                fifo_signal=self.decoder_fifo_signal,
+                flush_when_full=bool(self.decoder_flush_when_full),
+                decode_mode=rtsp_task.DecodeMode(self.decode_mode),
+                keyframe_interval_sec=self.keyframe_interval_sec
             )
 
             receiver = rtsp_task.Decoder_Create(
                 self.process_id,
                 decoder,
-                self.input_filter
+                self.input_filter,
+                source_id=self.receiver.source_id
             )
             self.publish_decoder_id(receiver.decoder_id)
             yield receiver
@@ -12,39 +12,76 @@ import gui.resource as resource
 
 import video_backend.rtsp.rtsp_task as rtsp_task
 
+# The receiver process hosting the shared streams (one per application):
+#  the first stream bootstraps it, the others are added to it
+class SharedReceiverProcess:
+    LIVETHREAD_NAME = 'rtsp_shared_thread'
+
+    process_id: Any = None
+
+    @classmethod
+    def create_command(cls, source: rtsp_task.RTSPStreamSpec, source_id: Any) -> signalling.Command:
+        if cls.process_id is None:
+            receiver = rtsp_task.Receiver_Create(source=source, source_id=source_id)
+            cls.process_id = receiver.process_id
+            return receiver
+
+        return rtsp_task.SharedReceiver_Create(cls.process_id, source=source, source_id=source_id)
+
+
 @dataclass
 class RTSPReceiver(signalling.Stage, resource.Frontend):
     rtsp_link: str = wx_form.TextInput.field(value='', display_name='RTSP link')
     #slot_id: int = wx_form.NumberInput.field(default=1, min_value=1, max_value=10000, display_name='Slot ID')
     slot_id: int
     timeout_ms: int = wx_form.NumberInput.field(default=1000, min_value=100, max_value=360000, display_name='Timeout (ms)')
+    # project config only: the stream is received in the shared process
+    #  (one LiveThread for every camera), else in its own process
+    shared_receiver: bool = True
 
     KEY_PROCESS_ID = 'process_id'
     @property
     def process_id(self) -> Any:
         return self.generated.get(self.KEY_PROCESS_ID, None)
 
+    # the source in the receiver process (slot_id is unique per application)
+    @property
+    def source_id(self) -> Any:
+        return self.slot_id if self.shared_receiver else None
+
     def command_sequence(self, *args, start: bool, **kwargs) -> Optional[Iterable[signalling.Command]]:
         
         if start:
-            source = self.generated['source'] = rtsp_task.RTSPStreamSpec(
-                f"root{self.slot_id}_fork",
-                f"rtsp{self.slot_id}_thread",
-                self.slot_id,
-                self.rtsp_link,
-                self.timeout_ms
-            )
-            
-            receiver = rtsp_task.Receiver_Create(source)
+            if self.shared_receiver:
+                # Valkka slot allocated by the shared LiveThread
+                source = self.generated['source'] = rtsp_task.RTSPStreamSpec(
+                    f"root{self.slot_id}_fork",
+                    SharedReceiverProcess.LIVETHREAD_NAME,
+                    None,
+                    self.rtsp_link,
+                    self.timeout_ms,
+                    shared_livethread=True
+                )
+                receiver = SharedReceiverProcess.create_command(source, self.source_id)
+            else:
+                source = self.generated['source'] = rtsp_task.RTSPStreamSpec(
+                    f"root{self.slot_id}_fork",
+                    f"rtsp{self.slot_id}_thread",
+                    self.slot_id,
+                    self.rtsp_link,
+                    self.timeout_ms
+                )
+                receiver = rtsp_task.Receiver_Create(source)
             self.publish_process_id(receiver.process_id)
             
             yield receiver
             
-            yield rtsp_task.Receiver_Start(self.process_id)
+            yield rtsp_task.Receiver_Start(self.process_id, source_id=self.source_id)
         elif self.process_id is not None:
-            yield rtsp_task.Receiver_Stop(self.process_id)
+            # the shared process keeps running for the other streams
+            yield rtsp_task.Receiver_Stop(self.process_id, source_id=self.source_id)
             
-            yield rtsp_task.Receiver_Delete(self.process_id)
+            yield rtsp_task.Receiver_Delete(self.process_id, source_id=self.source_id)
     
     @functools.cached_property
     def generated(self) -> MutableMapping[str, Any]:
@@ -6,10 +6,12 @@ import wx
 import cv2
 import numpy as np
 from operator import xor
+import time
 
 
 
 from IFrameProcessAdapter import IFrameProcessAdapter
+from video_backend.profiling import GlassToGlassLatency
 
 VideoPanelPosition = int
 
@@ -26,6 +28,11 @@ class VideoCapturePanelGrid(wx.GridSizer):
         def adapter(self) -> IFrameProcessAdapter:
             return self._adapter
         
+        # per-stage latency histograms of the shown frames
+        @property
+        def latency(self) -> GlassToGlassLatency:
+            return self._latency
+        
         def __init__(self,
                      adapter: IFrameProcessAdapter,
                      trigger,
@@ -44,6 +51,24 @@ class VideoCapturePanelGrid(wx.GridSizer):
             
             self._started = False
             self._bmp = None # None = no EVT_PAINT binding
+            
+            self._latency = GlassToGlassLatency()
+            # stage timestamps of the frame waiting for paint
+            self._frame_timestamps = None
+            self._show_latency = False
+            # warning line at the bottom (e.g. recorder falling behind), None = hidden
+            self._status_text = None
+            
+            # debug overlay toggle
+            self.Bind(wx.EVT_LEFT_DCLICK, lambda evt: self.show_latency_overlay(not self._show_latency))
+        
+        def show_latency_overlay(self, show: bool = True):
+            self._show_latency = show
+            self.Refresh()
+        
+        def set_status(self, text: Optional[str]):
+            self._status_text = text
+            self.Refresh()
         
         def set_buffer_size(self, buffer_shape: Tuple):
             self._bmp = wx.Bitmap(*buffer_shape)
@@ -64,10 +89,42 @@ class VideoCapturePanelGrid(wx.GridSizer):
             dc = wx.BufferedPaintDC(self)
             
             dc.DrawBitmap(self._bmp, 0, 0)
+            
+            # the first paint of the frame
+            if self._frame_timestamps is not None:
+                self._latency.add((*self._frame_timestamps, time.time()))
+                self._frame_timestamps = None
+            
+            if self._show_latency:
+                self._draw_latency_overlay(dc)
+            
+            if self._status_text is not None:
+                self._draw_status(dc)
+        
+        def _draw_status(self, dc: wx.DC):
+            _, text_height = dc.GetTextExtent(self._status_text)
+            
+            dc.SetBackgroundMode(wx.SOLID)
+            dc.SetTextBackground(wx.BLACK)
+            dc.SetTextForeground(wx.RED)
+            dc.DrawText(self._status_text, 5, self.GetClientSize().height - text_height - 5)
+        
+        def _draw_latency_overlay(self, dc: wx.DC):
+            snapshot = self._latency.snapshot()
+            
+            lines = [f"{stage}: {summary.p50 * 1000:.0f} / {summary.p95 * 1000:.0f} ms"
+                     for stage, summary in snapshot.stages.items()]
+            total = snapshot.glass_to_glass_sec
+            lines.append(f"glass to glass: {total.p50 * 1000:.0f} / {total.p95 * 1000:.0f} ms (p50 / p95)")
+            
+            dc.SetBackgroundMode(wx.SOLID)
+            dc.SetTextBackground(wx.BLACK)
+            dc.SetTextForeground(wx.GREEN)
+            dc.DrawText('\n'.join(lines), 5, 5)
         
         def _prepare_draw_image(self, img: np.ndarray):
             bmp_exists = self._bmp is not None
-            self.set_buffer_size((self._adapter.height, self._adapter.width))
+            self.set_buffer_size((self._adapter.width, self._adapter.height))
             
             if not bmp_exists:
                 self.Bind(wx.EVT_PAINT, self._on_paint)
@@ -76,7 +133,21 @@ class VideoCapturePanelGrid(wx.GridSizer):
             self._trigger.drawing_callback = self._draw_image
         
         def _draw_image(self, img: np.ndarray):
+            # the output was resized in place
+            frame_size = (self._adapter.width, self._adapter.height)
+            if tuple(self._bmp.GetSize()) != frame_size:
+                self.set_buffer_size(frame_size)
+            
             self._bmp.CopyFromBuffer(img)
+            
+            # source and consumer timestamps from the shmem slot header
+            header = getattr(self._adapter, 'frame_header', None)
+            if header is not None:
+                self._frame_timestamps = (header.timestamp,
+                                          header.grab_timestamp,
+                                          header.write_timestamp,
+                                          self._adapter.read_timestamp)
+            
             self.Refresh()
         
         def dispose(self):
@@ -119,6 +190,11 @@ class VideoCapturePanelGrid(wx.GridSizer):
         
         #self._timer.Start(1000./fps)
     
+    def show_latency_overlay(self, show: bool = True):
+        for panel in self._indicator_list:
+            if isinstance(panel, VideoCapturePanelGrid.SinglePanel):
+                panel.show_latency_overlay(show)
+    
     def initiate_video_panel(self,
                         adapter: IFrameProcessAdapter,
                         force_pos: Optional[VideoPanelPosition] = None,
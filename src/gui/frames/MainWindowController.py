@@ -8,6 +8,7 @@ import numpy as np
 import cv2
 from threading import Thread
 import os
+import sys
 import glob
 import operator
 import random
@@ -53,7 +54,8 @@ from net.parser.JSONParser import JSONParser
 from gui.backend.stages.RGBFilterChange import RGBFilterChange
 from gui.backend.stages.RGBFilter import RGBFilter
 from gui.backend.stages.RGBFilterTerminal import RGBFilterTerminal
-from gui.backend.stages.RGBRecorder import RGBRecorder, RecordingStatusUpdate
+from gui.backend.stages.RGBRecorder import RGBRecorder, RecordingStatusUpdate, RecorderHealthUpdate, PassthroughRecordingRequest
+from gui.backend.stages.RTSPReceiver import RTSPReceiver
 from gui.backend.stages.ThreadedEventReceiver import ThreadedEventReceiver
 
 from gui.frames.JSONHandlerConfiguratorController import JSONHandlerConfiguratorController
@@ -175,6 +177,8 @@ class MainWindowController(IWxFrameController):
         self._video_adapters: Dict[IFrameProcessAdapter] = {}
         
         self._panel_handler = {}
+        # {(process_id, filter_id): SinglePanel, ..} of the streamed terminals
+        self._terminal_panels = {}
 
         self._recorders: MutableMapping[str, gui.datamodel.Recorder] = {}
         self._view.on_stream_select(self.start_streaming)
@@ -246,13 +250,17 @@ class MainWindowController(IWxFrameController):
         
         rem_control = event_receiver.RecorderRemoteControl(None, None, None, self.task_context)
         
-        progress.completion_channel.thenPermanent(partial(self.create_recorder, recorder, rem_control))
+        # passthrough recording runs in the stream's receiver process
+        receiver_state = live_controller.stage_state(RTSPReceiver)
+        
+        progress.completion_channel.thenPermanent(partial(self.create_recorder, recorder, rem_control, receiver_state))
         
         progress.go()
 
     def create_recorder(self,
                         recorder: gui.datamodel.Recorder,
                         rem_control: event_receiver.RecorderRemoteControl,
+                        receiver_state: signalling.LinearStageBuilder.StageState,
                         update: notifier.Update):
         terminal: RGBFilterTerminal = update.emitted_by
         
@@ -293,7 +301,8 @@ class MainWindowController(IWxFrameController):
                 self._stage__build_recorder,
                 recorder,
                 rem_control,
-                terminal
+                terminal,
+                receiver_state.latest_instance
             )
         )
 
@@ -317,6 +326,17 @@ class MainWindowController(IWxFrameController):
                     terminal.process_id # TODO: mixing concepts...!
                 )
             )
+        elif isinstance(status, RecorderHealthUpdate):
+            panel = self._terminal_panels.get((terminal.process_id, terminal.filter_id))
+            # not streamed or the panel is already destroyed
+            if not panel:
+                return
+            
+            if status.falling_behind:
+                panel.set_status(f"Recorder falling behind: queue {status.stats.queue_depth},"
+                                 f" dropped {status.stats.dropped_frames}")
+            else:
+                panel.set_status(None)
 
     def display_existing_records(self, basedir: str):
         self.append_records(map(partial(os.path.join, basedir), glob.glob('*.mp4', root_dir=basedir)))
@@ -333,6 +353,7 @@ class MainWindowController(IWxFrameController):
                                recorder: gui.datamodel.Recorder,
                                rem_control: event_receiver.RecorderRemoteControl,
                                terminal: RGBFilterTerminal,
+                               rtsp_receiver: Optional[RTSPReceiver],
                                update: notifier.Update):
         
         assert isinstance(update, notifier.Update)
@@ -359,12 +380,30 @@ class MainWindowController(IWxFrameController):
             'notifier_property': None,
             'start_immediately': False,
             
-            'fps': 15
+            'fps': 15,
+            'encoder_farm': self.wx_process.encoder_farm
         })
         
+        if rtsp_receiver is not None:
+            event_controller.add_parameters({
+                'receiver_process_id': rtsp_receiver.process_id,
+                'receiver_source_id': rtsp_receiver.source_id
+            })
+        
         event_progress = event_controller.set_target(RGBRecorder, start=True)
         
         event_controller.stage_state(patch.StreamerPatchCommand).command_notify.subscribe(partial(self.metadata_received, terminal))
+        event_controller.stage_state(patch.StreamerPatchCommand).command_notify.subscribe(
+            partial(self.passthrough_requested, event_controller.stage_state(RGBRecorder))
+        )
+    
+    def passthrough_requested(self, recorder_state: signalling.LinearStageBuilder.StageState, update: notifier.Update):
+        request = update.extract_nested_value()
+        if not isinstance(request, PassthroughRecordingRequest):
+            return
+        
+        recorder_stage: RGBRecorder = recorder_state.latest_instance
+        self.task_context.send(recorder_stage.passthrough_command(request))
 
     
     def set_filter_obj(self, recorder_name: str, context: signalling.MessagingContext, progress: signalling.LinearBuilderProgress, update: notifier.Update):
@@ -385,6 +424,7 @@ class MainWindowController(IWxFrameController):
         rgb_terminal_stage.shmem_image = shmem_img
         
         adapter, panel = self._view._stream(recorder_name, shmem_img)
+        self._terminal_panels[(rgb_terminal_stage.process_id, rgb_terminal_stage.filter_id)] = panel
         
         self.make_panel_resize_handler(recorder_name, context, resize_filter, adapter, panel, rgb_terminal_stage)
         
@@ -441,6 +481,12 @@ class MainWindowController(IWxFrameController):
         
         set_size_on = lambda obj: setattr(obj, '__old_size', panel_size)
         
+        # the output is resized in place, the panel follows the frame size
+        if adapter.fits(*panel_size):
+            command_context.send(sender(evt))
+            set_size_on(panel)
+            return True
+        
         self._pending_recorders[recorder_name] = False
         
         panel.Unbind(wx.EVT_SIZE, handler=self._panel_handler[panel])
@@ -491,6 +537,7 @@ class MainWindowController(IWxFrameController):
                         channel.unsubscribe(catch)
                         
                         adapter, panel = self._view._stream(recorder_name, v.value)
+                        self._terminal_panels[(rgb_terminal_stage.process_id, rgb_terminal_stage.filter_id)] = panel
                         
                         # TODO: maybe related: make sure panel is created
                         self.make_panel_resize_handler(recorder_name,
@@ -319,7 +319,7 @@ class MainWindowView(MainWindow):
             panel_pos = self.videoCapturePanelGrid.initiate_video_panel(adapter)
             self.Layout()
             self.videoCapturePanelGrid.activate_video_panel(panel_pos)
-            panel_pos.set_buffer_size((self._adapter.height, self._adapter.width))
+            panel_pos.set_buffer_size((self._adapter.width, self._adapter.height))
             self.videoCapturePanelGrid.draw_image(img)
             self.Refresh()
             
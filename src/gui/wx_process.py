@@ -1,6 +1,6 @@
 from functools import partial
 from dataclasses import dataclass
-from typing import Callable, Any, Union
+from typing import Callable, Any, Union, Optional
 from multiprocessing import Process
 from threading import Thread
 import sys
@@ -15,6 +15,7 @@ from gui.WxCommunicationThread import WxCommunicationThread
 #from gui.frames.IWxFrameController import IWxFrameController
 
 from backend_context import ProcessShutdownSequence
+from video_backend.encoder_farm import EncoderFarmSpec
 from ProcessSocket import ProcessSocket
 
 from videorotate_utils import print_exception
@@ -64,6 +65,16 @@ class WxProcess(Process):
         
         self._notifier_topic = notifier_topic
 
+    @property
+    def encoder_farm(self) -> Optional[EncoderFarmSpec]:
+        return getattr(self, '_encoder_farm', None)
+    
+    @encoder_farm.setter
+    def encoder_farm(self, encoder_farm: Optional[EncoderFarmSpec]):
+        assert encoder_farm is None or isinstance(encoder_farm, EncoderFarmSpec)
+        
+        self._encoder_farm = encoder_farm
+
     def process__new_controller(self,
                        new_controller,#: Union[str, IWxFrameController],
                        source_controller):# -> IWxFrameController:
@@ -10,6 +10,9 @@ from multiprocessing import Pipe
 from gui.wx_process import WxProcess
 from orchestrator import ProcessOrchestrator
 from gui.frames.MainWindowController import MainWindowController
+from video_backend.encoder_farm import EncoderFarm
+
+import videorotate_constants
 
 builtins.print(
     f"started,,, {multiprocessing.current_process().name} {__name__} {globals().get('wx_process', None)} {globals().get('process_message', None)}")
@@ -35,6 +38,11 @@ if __name__ == '__main__':
 
     wx_process.first_window_controller = MainWindowController.__name__
 
+    # before the GUI process starts, it passes the address to the recorders
+    encoder_farm = None
+    if videorotate_constants.ENCODER_FARM:
+        encoder_farm = EncoderFarm(videorotate_constants.ENCODER_FARM_WORKERS)
+        wx_process.encoder_farm = encoder_farm.start()
 
     wx_process.start()
 
@@ -48,6 +56,9 @@ if __name__ == '__main__':
         global process_message
         process_message = False
         
+        if encoder_farm is not None:
+            encoder_farm.stop()
+        
         import sys
         print('Global_on_shutdown')
         sys.stdout.flush()
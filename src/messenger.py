@@ -1,4 +1,6 @@
 from dataclasses import dataclass
+import os
+import sys
 from socket import socket
 from enum import Enum
 from collections import UserList, deque
@@ -92,6 +94,32 @@ class SimplePipeSocket(BindableSocket):
 
         return self._con.recv()
 
+# Wraps a (Valkka) eventfd: each message is the counter value accumulated since the last read
+class EventFdSocket(BindableSocket):
+    def __init__(self, fd: int):
+        assert isinstance(fd, int)
+
+        self._fd = fd
+
+    @property
+    def connection(self) -> int:
+        return self._fd
+
+    def send_message(self, message: Any):
+        return os.write(self._fd, int(message).to_bytes(8, sys.byteorder))
+
+    def recv_message_blocking(self, timeout: Optional[float] = None) -> Any:
+        if timeout is not None:
+            is_available = len(multiprocessing.connection.wait([self._fd], timeout))
+
+            if not is_available:
+                return None
+
+        try:
+            return int.from_bytes(os.read(self._fd, 8), sys.byteorder)
+        except BlockingIOError:
+            return None
+
 @dataclass
 class SentMessage:
     msg: Any
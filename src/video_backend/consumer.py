@@ -1,24 +1,38 @@
-from dataclasses import dataclass
-from typing import Any, List, Dict, Tuple, Callable, Optional
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, List, Dict, Tuple, Callable, Optional, Union
 from functools import partial, cache
+import os
 import sys
 import multiprocessing
 from multiprocessing import shared_memory
 import threading
 import queue
+import itertools
+import time
 import cv2
 import numpy as np
 
 import videorotate_constants
 
+import messenger
+import notifier
 from IFrameProcessAdapter import IFrameProcessAdapter
 
 from messaging.topic import TopicMessaging, MessageThreadRegistry, ReplyControl
 
 from video_backend.FilterBlockLogic import FilterBlockLogic
 
-from video_backend.processing.register_bgr_transform import get_bgr_transform
+from video_backend.processing.register_bgr_transform import get_bgr_transform, BatchSpec, BatchPropagation, GATE_CLOSED
 from video_backend.processing.RGBFilterInput import RGBFilterInput
+from video_backend.profiling import ConsumerStats
+from video_backend.load_shedding import LoadShedder, BranchPriority
+from video_backend.duplicate_frames import DuplicateFrameDetector
+from video_backend.recorder_queue import RecorderQueue, QueuePolicy, RecorderStatsSnapshot
+from video_backend.preroll import PreRollBuffer
+from video_backend.encoder_farm import EncoderFarmSpec, EncoderFarmWriter
+from video_backend.shmem_frame import SharedFrameWriter, SharedFrameReader, FrameHeader, segment_nbytes, DEFAULT_SLOT_COUNT
+from video_backend.shmem_frame import SharedPyramidWriter, pyramid_level, pyramid_level_sizes, pyramid_nbytes
 
 from videorotate_utils import print_exception, log_context, run_once_strict
 
@@ -35,6 +49,27 @@ class RGBSharedMemoryImage:
     buffer_nsize: int = None
     ndarray_dtype: any = None
     ndarray_shape: any = None
+    # frame slots after the header (see shmem_frame)
+    slot_count: int = DEFAULT_SLOT_COUNT
+    # capacity of a slot, frames up to this size are resized in place
+    slot_nbytes: int = None
+    # level of a pyramid output, the level's frames are found by the level table
+    pyramid_level: Optional[int] = None
+
+    pending: bool = True
+
+
+# Output with every level in one segment,
+#  consumers open the level they need (RGBSharedMemoryAdapter(pyramid.levels[i]))
+@dataclass
+class RGBSharedMemoryPyramid:
+    filter_id: str
+    # relative to the filter's output, in decreasing order
+    scales: List[float]
+
+    buffer_name: str = None
+    buffer_nsize: int = None
+    levels: List[RGBSharedMemoryImage] = field(default_factory=list)
 
     pending: bool = True
 
@@ -51,6 +86,10 @@ class RGBSharedMemoryAdapter(IFrameProcessAdapter):
     def height(self) -> int:
         return self._height
 
+    @property
+    def frame_interval_ms(self) -> Optional[int]:
+        return self._shmem_image.frame_interval_ms
+
     def __init__(self, shmem_image: RGBSharedMemoryImage) -> None:
         assert isinstance(shmem_image, RGBSharedMemoryImage)
 
@@ -58,6 +97,9 @@ class RGBSharedMemoryAdapter(IFrameProcessAdapter):
 
         self._width, self._height = 0, 0
 
+        self._frame_header = None
+        self._read_timestamp = None
+
     # overridden by the input block implementor if needed
     def backend__input__setup(self):
         if videorotate_constants.DEBUG:
@@ -69,11 +111,17 @@ class RGBSharedMemoryAdapter(IFrameProcessAdapter):
             create=False,
             size=self._shmem_image.buffer_nsize
         )
-        self._ndarray = np.ndarray(
-            self._shmem_image.ndarray_shape,
-            dtype=self._shmem_image.ndarray_dtype,
-            buffer=self._shmem.buf
-        ).reshape(self._shmem_image.ndarray_shape)
+        self._buffer = self._shmem.buf
+        if self._shmem_image.pyramid_level is not None:
+            self._buffer, _, _ = pyramid_level(self._shmem.buf, self._shmem_image.pyramid_level)
+
+        self._reader = SharedFrameReader(
+            self._buffer,
+            self._shmem_image.slot_nbytes,
+            self._shmem_image.ndarray_dtype,
+            self._shmem_image.ndarray_shape[2:],
+            self._shmem_image.slot_count
+        )
         
         if videorotate_constants.DEBUG:
             print('SHMEM SETUP DONE')
@@ -81,8 +129,40 @@ class RGBSharedMemoryAdapter(IFrameProcessAdapter):
 
     # overridden by the input block implementor if needed
     def backend__input__cleanup(self):
+        self._reader.release()
+        if self._buffer is not self._shmem.buf:
+            self._buffer.release()
         self._shmem.close()
 
+    # frames written by the consumer but never read
+    @property
+    def dropped_frames(self) -> int:
+        return self._reader.dropped_frames
+
+    # grabs without a new frame
+    @property
+    def duplicate_reads(self) -> int:
+        return self._reader.duplicate_reads
+
+    # increased when the output is resized in place
+    @property
+    def generation(self) -> int:
+        return self._reader.generation
+
+    # slot header of the last grabbed frame (source and consumer timestamps)
+    @property
+    def frame_header(self) -> Optional[FrameHeader]:
+        return self._frame_header
+
+    # when the last frame was copied out of the segment (wall clock)
+    @property
+    def read_timestamp(self) -> Optional[float]:
+        return self._read_timestamp
+
+    # can the output be resized in place (without a new segment)?
+    def fits(self, width: int, height: int) -> bool:
+        return self._reader.fits(width, height)
+
     # overridden by the input block implementor if needed
     def backend__input__grab_frame(self,
                                    ignore_cache: bool = False,
@@ -90,9 +170,16 @@ class RGBSharedMemoryAdapter(IFrameProcessAdapter):
                                    cache_new_frame_descriptor: bool = False
                                    ) -> Tuple[bool, np.ndarray, any]:
 
-        self._width, self._height, _ = self._shmem_image.ndarray_shape
+        frame = self._reader.read()
+        if frame is None:
+            return False, None, None
 
-        return True, self._ndarray, object()
+        img, header = frame
+        self._width, self._height = header.width, header.height
+        self._frame_header = header
+        self._read_timestamp = time.time()
+
+        return True, img, header
 
     # overridden by the input block implementor if needed
     def backend__input__is_ready(self, ignore_cache: bool) -> bool:
@@ -106,7 +193,34 @@ class RGBSharedMemoryAdapter(IFrameProcessAdapter):
     def backend__input__is_callback_available(self) -> bool:
         return False
 
+# writer thread markers
+# start a file (a new recording or the next segment)
+@dataclass
+class _RecordingStart:
+    filepath: str
+    width: int
+    height: int
+
+# open the next segment's writer in advance
+@dataclass
+class _SegmentPrepare(_RecordingStart):
+    pass
+
+_WRITER_EXIT = object()
+
+
+# The writer thread owns the VideoWriter: it is opened on the first frame
+#  after activate(), the pre-roll frames are written ahead of the live ones.
+# Without recording the frames go into the pre-roll buffer (if enabled),
+#  deactivate() keeps recording for the post-roll frames.
+# Long recordings are split into segments by duration and/or size: the next
+#  segment is opened at SEGMENT_PREPARE_AT of the limit, the finished ones
+#  are released (finalized) on a background thread.
+# With an encoder farm the writer thread only copies the frames into the
+#  farm's shared memory slots, a farm worker process encodes them.
 class RecorderControl:
+    SEGMENT_PREPARE_AT = 0.8
+
     # fixed file
     @property
     def filename_extension(self) -> str:
@@ -116,74 +230,475 @@ class RecorderControl:
     def active(self) -> bool:
         return self._active
     
-    def __init__(self, fps: int, set_filepath: Optional[str] = None) -> None:
+    @property
+    def falling_behind(self) -> bool:
+        return self._input_queue.falling_behind
+    
+    def __init__(self,
+                 fps: int,
+                 set_filepath: Optional[str] = None,
+                 queue_size: int = RecorderQueue.DEFAULT_MAXSIZE,
+                 queue_policy: QueuePolicy = QueuePolicy.DROP_OLDEST,
+                 drop_spacing: int = 5,
+                 preroll_sec: float = 0.0,
+                 postroll_sec: float = 0.0,
+                 preroll_budget: int = PreRollBuffer.DEFAULT_MEMORY_BUDGET,
+                 segment_duration_sec: float = 0.0,
+                 segment_max_bytes: int = 0,
+                 encoder_farm: Optional[EncoderFarmSpec] = None,
+                 stream_id: Any = None) -> None:
         self._fourcc = cv2.VideoWriter_fourcc(*'mp4v')
         
         self._filepath = set_filepath
         self._active = False
-        self._writer = None
         self._fps = fps
         
-        self._input_queue = queue.Queue()
+        self._input_queue = RecorderQueue(queue_size, queue_policy, drop_spacing)
         self._writer_thread = None
+        # the start marker is sent for the current recording
+        self._file_open = False
+        
+        self._preroll = None
+        if preroll_sec > 0:
+            self._preroll = PreRollBuffer(max(int(preroll_sec * fps), 1), preroll_budget)
+        
+        self._postroll_frames = int(postroll_sec * fps)
+        # frames until stopping, None if not stopping
+        self._postroll_left = None
+        
+        # 0 = no limit
+        self._segment_max_frames = int(segment_duration_sec * fps)
+        self._segment_max_bytes = segment_max_bytes
+        self._segment_frames = 0
+        self._segment_bytes = 0
+        self._segment_filepath = None
+        # segment files of the current recording, for the written bytes
+        self._recording_segments: List[str] = []
+        # prepared next segment
+        self._next_segment_filepath = None
+        self._next_filepath_builder = None
+        
+        self._finalizer_queue = queue.Queue()
+        self._finalizer_thread = None
+        
+        self._encoder_farm = encoder_farm
+        # the farm's per-camera stats are keyed by this
+        self.stream_id = stream_id if stream_id is not None else id(self)
+        
+        # Update(key=RecorderControl, value=falling_behind) on every change
+        self.health_channel = notifier.UpdateChannel()
     
     
     # TODO: optimize this (e.g. replace function before-after activating)
-    def handle_recording(self, input: RGBFilterInput) -> bool:
-        img = input.get_as_immutable_input(RGBFilterInput.ColorSpace.BGR)
+    # the frame is converted into a recycled buffer, the input passes through
+    def handle_recording(self, input: RGBFilterInput) -> None:
+        if self._active and self._postroll_left is not None:
+            if self._postroll_left <= 0:
+                self._stop_recording()
+            else:
+                self._postroll_left -= 1
         
-        if self._active:
-            if not self._writer:
-                self._new_writer(input.width, input.height)
+        if not self._active and self._preroll is None:
+            return None
+        
+        self._ensure_writer_thread()
+        
+        if self._active and not self._file_open:
+            self._input_queue.put_final(_RecordingStart(self._filepath, input.width, input.height))
+            self._file_open = True
             
-            if videorotate_constants.DEBUG:
-                import sys
-                print('WRITTEN_WABA', input.width, input.height, self._filepath, self._input_queue.qsize())
-                sys.stdout.flush()
-            self._input_queue.put_nowait(img)
+            self._segment_filepath = self._filepath
+            self._recording_segments = [self._filepath]
+            # the pre-roll is written into the first segment
+            self._segment_frames = self._preroll.frame_count if self._preroll is not None else 0
+            self._segment_bytes = 0
+        elif self._active and (self._segment_max_frames or self._segment_max_bytes):
+            self._rotate_segment(input.width, input.height)
+        
+        if self._active:
+            self._segment_frames += 1
+        
+        if videorotate_constants.DEBUG:
+            import sys
+            print('WRITTEN_WABA', input.width, input.height, self._filepath, self._input_queue.qsize())
+            sys.stdout.flush()
         
-        return img
+        buffer = self._input_queue.acquire((input.height, input.width, 3))
+        if buffer is not None:
+            input.convert_into(RGBFilterInput.ColorSpace.BGR, buffer)
+            self._input_queue.put(buffer)
+        
+        if self._input_queue.update_health():
+            self.health_channel.send(notifier.Update(
+                key=RecorderControl,
+                value=self._input_queue.falling_behind
+            ))
+        
+        return None
     
-    def activate(self, set_filepath: Optional[str] = None):
+    # next_filepath: builds the filepaths of the following segments,
+    #  '<filepath>.1.mp4', '<filepath>.2.mp4', .. by default
+    def activate(self,
+                 set_filepath: Optional[str] = None,
+                 next_filepath: Optional[Callable[[], str]] = None):
         if self._filepath is None and set_filepath is None:
             raise RuntimeError('Filepath not set')
         
-        self.deactivate()
-        
-        self._writer_thread = threading.Thread(target=self._write_image)
-        self._writer_thread.daemon = True
-        self._writer_thread.start()
+        # a trigger during the post-roll starts a new file
+        self._stop_recording()
+        self._ensure_writer_thread()
         
         self._filepath = set_filepath or self._filepath
+        self._next_filepath_builder = next_filepath or self._default_segment_names(self._filepath)
         self._active = True
     
     def deactivate(self, set_filepath: Optional[str] = None):
+        if self._active and self._postroll_frames:
+            if self._postroll_left is None:
+                self._postroll_left = self._postroll_frames
+            return
+        
+        self._stop_recording()
+    
+    # stop the writer thread, the control is not usable afterwards
+    def close(self):
+        self._stop_recording()
+        
+        if self._writer_thread is not None and self._writer_thread.is_alive():
+            self._input_queue.put_final(_WRITER_EXIT)
+        else:
+            self._finalizer_queue.put((None, None))
+    
+    def snapshot(self, reset: bool = True) -> RecorderStatsSnapshot:
+        bytes_written = sum(os.path.getsize(filepath) for filepath in self._recording_segments
+                            if os.path.exists(filepath))
+        
+        snapshot = self._input_queue.snapshot(bytes_written, reset)
+        if self._preroll is not None:
+            snapshot.preroll_frames = self._preroll.frame_count
+            snapshot.preroll_bytes = self._preroll.nbytes
+        return snapshot
+    
+    def _stop_recording(self):
         self._active = False
+        self._postroll_left = None
         
+        if self._file_open:
+            self._input_queue.put_final(None)
+            self._file_open = False
+            self._next_segment_filepath = None
+    
+    def _rotate_segment(self, width: int, height: int):
+        progress = 0.0
+        if self._segment_max_frames:
+            progress = self._segment_frames / self._segment_max_frames
+        if self._segment_max_bytes:
+            # stat once per second
+            if self._segment_frames % max(int(self._fps), 1) == 0 and os.path.exists(self._segment_filepath):
+                self._segment_bytes = os.path.getsize(self._segment_filepath)
+            progress = max(progress, self._segment_bytes / self._segment_max_bytes)
+        
+        if progress >= self.SEGMENT_PREPARE_AT and self._next_segment_filepath is None:
+            self._next_segment_filepath = self._next_filepath_builder()
+            self._input_queue.put_final(_SegmentPrepare(self._next_segment_filepath, width, height))
+        
+        if progress >= 1.0:
+            self._input_queue.put_final(_RecordingStart(self._next_segment_filepath, width, height))
+            
+            self._segment_filepath = self._next_segment_filepath
+            self._recording_segments.append(self._segment_filepath)
+            self._next_segment_filepath = None
+            self._segment_frames = 0
+            self._segment_bytes = 0
+    
+    @staticmethod
+    def _default_segment_names(filepath: str) -> Callable[[], str]:
+        root, ext = os.path.splitext(filepath)
+        counter = itertools.count(1)
+        return lambda: f"{root}.{next(counter)}{ext}"
+    
+    def _finalize(self, writer: cv2.VideoWriter, remove_filepath: Optional[str] = None):
+        if self._finalizer_thread is None or not self._finalizer_thread.is_alive():
+            self._finalizer_thread = threading.Thread(target=self._finalize_writers)
+            self._finalizer_thread.daemon = True
+            self._finalizer_thread.start()
+        
+        self._finalizer_queue.put((writer, remove_filepath))
+    
+    # VideoWriter.release() writes the index, it takes time for long files
+    @print_exception
+    def _finalize_writers(self):
+        while True:
+            writer, remove_filepath = self._finalizer_queue.get()
+            if writer is None:
+                return
+            
+            if writer.isOpened():
+                writer.release()
+            
+            # prepared but not used segment
+            if remove_filepath is not None and os.path.exists(remove_filepath):
+                os.remove(remove_filepath)
+    
+    def _ensure_writer_thread(self):
         if self._writer_thread is not None and self._writer_thread.is_alive():
-            self._input_queue.put(None)
-
-    def _new_writer(self, width: int, height: int):
-        self._writer = cv2.VideoWriter(
-                self._filepath,
+            return
+        
+        self._writer_thread = threading.Thread(target=self._write_image)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+    
+    def _new_writer(self, filepath: str, width: int, height: int) -> cv2.VideoWriter:
+        if self._encoder_farm is not None:
+            return EncoderFarmWriter(
+                self._encoder_farm,
+                self.stream_id,
+                filepath,
+                self._fourcc,
+                self._fps,
+                (width, height)
+            )
+        
+        return cv2.VideoWriter(
+                filepath,
                 self._fourcc,
                 self._fps,
                 (width, height),
                 isColor=True
             )
     
+    def _write(self, writer: cv2.VideoWriter, img: np.ndarray):
+        start = time.perf_counter()
+        writer.write(img)
+        self._input_queue.write_sec.add(time.perf_counter() - start)
+        self._input_queue.written_frames += 1
+    
+    # The live frames arriving meanwhile are queued in extra buffers (up to
+    #  the queue size), when they run out the rest of the pre-roll is
+    #  dropped, never the frames after the trigger
+    def _write_preroll(self, writer: cv2.VideoWriter, size: Tuple[int, int]):
+        input_queue = self._input_queue
+        input_queue.set_headroom(min(self._preroll.frame_count, input_queue.maxsize))
+        
+        try:
+            for img in self._preroll.drain(size):
+                self._write(writer, img)
+                
+                if input_queue.spare_buffers() <= 1:
+                    break
+            
+            input_queue.dropped_frames += self._preroll.frame_count
+            self._preroll.clear()
+        finally:
+            input_queue.set_headroom(0)
+    
     @print_exception
     def _write_image(self):
+        writer = None
+        # (filepath, writer) of the next segment
+        prepared = None
+        
         while True:
-            img = self._input_queue.get()
+            item = self._input_queue.get()
             
-            if img is None:
-                if self._writer is not None and self._writer.isOpened():
-                    self._writer.release()
-                self._writer = None
-                return
-            self._writer.write(img)
+            if item is _WRITER_EXIT or item is None:
+                if writer is not None:
+                    self._finalize(writer)
+                if prepared is not None:
+                    self._finalize(prepared[1], prepared[0])
+                writer = prepared = None
+                
+                if item is _WRITER_EXIT:
+                    self._finalizer_queue.put((None, None))
+                    return
+                continue
+            
+            if isinstance(item, _SegmentPrepare):
+                if prepared is not None:
+                    self._finalize(prepared[1], prepared[0])
+                prepared = (item.filepath, self._new_writer(item.filepath, item.width, item.height))
+                continue
+            
+            if isinstance(item, _RecordingStart):
+                if writer is not None:
+                    self._finalize(writer)
+                
+                size = (item.width, item.height)
+                if prepared is not None and prepared[0] == item.filepath:
+                    writer = prepared[1]
+                    prepared = None
+                else:
+                    writer = self._new_writer(item.filepath, *size)
+                
+                if self._preroll is not None:
+                    self._write_preroll(writer, size)
+                continue
+            
+            if writer is not None:
+                self._write(writer, item)
+            elif self._preroll is not None:
+                self._preroll.push(item)
+            
+            self._input_queue.release(item)
     
+
+class RecorderMode(Enum):
+    # the consumer encodes the decoded frames (RecorderControl)
+    DECODED = 'decoded'
+    # the receiver process records the compressed stream (PassthroughRecorder),
+    #  the consumer only decides when
+    PASSTHROUGH = 'passthrough'
+
+
+# Stands in for RecorderControl in passthrough mode: the recorder remote
+#  drives it the same way, activations are published on request_channel
+#  (filepath to start, None to stop) for the receiver process
+class PassthroughTriggerControl:
+    # PassthroughRecorderControl's file
+    @property
+    def filename_extension(self) -> str:
+        return 'mp4'
+    
+    @property
+    def active(self) -> bool:
+        return self._active
+    
+    def __init__(self, recording_dir: Optional[str] = None, recording_basename: str = 'video') -> None:
+        self.recording_dir = recording_dir
+        self.recording_basename = recording_basename
+        
+        self.request_channel = notifier.UpdateChannel()
+        self._active = False
+    
+    # segments are not split in passthrough mode
+    def activate(self,
+                 set_filepath: Optional[str] = None,
+                 next_filepath: Optional[Callable[[], str]] = None):
+        if set_filepath is None:
+            raise RuntimeError('Filepath not set')
+        
+        self._active = True
+        self.request_channel.send(notifier.Update(key=PassthroughTriggerControl, value=set_filepath))
+    
+    def deactivate(self, set_filepath: Optional[str] = None):
+        if not self._active:
+            return
+        
+        self._active = False
+        self.request_channel.send(notifier.Update(key=PassthroughTriggerControl, value=None))
+    
+    def close(self):
+        self.deactivate()
+
+
+# Keeps the recent frames of a batch filter
+# Overlapping batches (stride < batch_size) are written twice (mirrored ring),
+#  so the last batch_size frames are always a contiguous slice
+class RGBFrameRing:
+    def __init__(self, batch_size: int, stride: int) -> None:
+        assert 1 <= stride <= batch_size
+
+        self._batch_size = batch_size
+        self._stride = stride
+        self._mirrored = stride < batch_size
+
+        self._ring = None
+        self._count = 0
+
+    def reset(self):
+        self._ring = None
+        self._count = 0
+
+    # return the batch view when a batch is completed, None otherwise
+    def push(self, img: np.ndarray) -> Optional[np.ndarray]:
+        size = self._batch_size
+
+        if self._ring is None or self._ring.shape[1:] != img.shape:
+            ring_len = 2 * size if self._mirrored else size
+            self._ring = np.empty((ring_len, *img.shape), dtype=img.dtype)
+            self._count = 0
+
+        i = self._count % size
+        self._ring[i] = img
+        if self._mirrored:
+            self._ring[i + size] = img
+
+        self._count += 1
+
+        if self._count < size or (self._count - size) % self._stride:
+            return None
+
+        start = i + 1 if self._mirrored else 0
+
+        batch = self._ring[start:start + size]
+        batch.flags.writeable = False
+        return batch
+
+
+# Filter result which is propagated to the children item-by-item
+class BatchOutput(tuple):
+    pass
+
+
+class BatchFilter:
+    def __init__(self, transform: Callable, spec: BatchSpec) -> None:
+        self._transform = transform
+        self._spec = spec
+
+        self._ring = RGBFrameRing(spec.batch_size, spec.stride)
+
+    def __call__(self, input: RGBFilterInput, **kwargs) -> BatchOutput:
+        batch = self._ring.push(input.get_as_immutable_input())
+
+        if batch is None:
+            # children are not called until the batch is completed
+            return BatchOutput()
+
+        result = self._transform(input, batch, **kwargs)
+
+        if self._spec.propagation == BatchPropagation.FRAME:
+            return BatchOutput(result)
+        return BatchOutput((result,))
+
+
+# Identical sibling filters (same shareable filter and parameters) are
+#  evaluated once while the Consumer runs them as a group, the others get
+#  the first evaluated member's result
+class SharedFilterResults:
+    # evaluate() outside of a group
+    _NOT_GROUPED = object()
+    # in a group, no member evaluated yet
+    _NO_RESULT = object()
+
+    def __init__(self) -> None:
+        self._result = self._NOT_GROUPED
+
+    def begin(self):
+        self._result = self._NO_RESULT
+
+    def end(self):
+        self._result = self._NOT_GROUPED
+
+    def evaluate(self, transform: Callable, input: RGBFilterInput, kwargs: Dict) -> Any:
+        if self._result is self._NOT_GROUPED:
+            return transform(input, **kwargs)
+
+        # None (pass-through) is a result too
+        if self._result is self._NO_RESULT:
+            self._result = transform(input, **kwargs)
+
+        return self._result
+
+
+class SharedResultFilter:
+    def __init__(self, transform: Callable, shared_results: SharedFilterResults) -> None:
+        self._transform = transform
+        self._shared_results = shared_results
+
+    def __call__(self, input: RGBFilterInput, **kwargs) -> Any:
+        return self._shared_results.evaluate(self._transform, input, kwargs)
+
+
 # Consumer -> ExtendedBackendProcess+Consumer change
 # TODO: make this fixed thing flexible, not wired in
 class Consumer(TaskProcess, ExtendedBackendProcess):
@@ -201,6 +716,22 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
     def backend__filter_tree(self) -> FilterBlockLogic:
         return self.__filter_tree
     
+    @property
+    def backend__stats(self) -> ConsumerStats:
+        return self.__stats
+    
+    @property
+    def backend__shared_results(self) -> 'SharedFilterResults':
+        return self.__shared_results
+    
+    @property
+    def backend__load_shedder(self) -> LoadShedder:
+        return self.__load_shedder
+    
+    @property
+    def backend__duplicate_detector(self) -> DuplicateFrameDetector:
+        return self.__duplicate_detector
+    
     # @property
     # @cache
     # def notifier(self) -> PropertyChangeNotifier:
@@ -209,45 +740,130 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
     def backend__start_processing(self):
         self.adapter.backend__input__setup()
         
-        self.messenger_timeout_sec = 0.0
-        self.backend__process_loop = self.backend__process_loop_extended
+        frame_interval_ms = self.adapter.frame_interval_ms
+        self.__load_shedder = LoadShedder(
+            frame_interval_ms / 1000.0 if frame_interval_ms else None)
+        
+        sync_fd = self.adapter.backend__input__sync_fd()
+        
+        if sync_fd is None:
+            # No wakeup source, poll the input
+            self.messenger_timeout_sec = 0.0
+            self.backend__process_loop = self.backend__process_loop_extended
+        else:
+            # Sleep until a frame or a message arrives
+            self.messaging_scheduler.add_source(
+                messenger.EventFdSocket(sync_fd),
+                self.backend__frames_available
+            )
+    
+    # signal_count: number of frames written since the last wakeup
+    def backend__frames_available(self, signal_count: Optional[int]):
+        for _ in range(signal_count or 1):
+            if not self.backend__process_next_frame():
+                break
     
     # TODO: optimize instance creation
+    # duplicate: repeated frame, only the branches needing a tick run
     def backend__process_image(self,
                                filter_input: RGBFilterInput,
                                metadata: any,
-                               filters: List[Dict] = None):
-
-        single_child = len(filters) == 1
-
-        # Assume we can modify
-        filter_input.configure(is_mutable=single_child)
+                               filters: List[Dict] = None,
+                               duplicate: bool = False):
 
+        # identical siblings (same filter and parameters) form one group
+        groups = {}
         for filter_dict in filters:
             got_filter_dict = filter_dict['object']
 
-            assert isinstance(got_filter_dict['filter_parameters'], dict)
-
-            filter_cb = got_filter_dict['filter_obj']
-            img_res = filter_cb(
-                filter_input, **got_filter_dict['filter_parameters'])
+            groups.setdefault(
+                self._backend__shared_group_key(got_filter_dict), []
+            ).append(got_filter_dict)
 
-            children = self.backend__filter_tree.get_children_filters(
-                got_filter_dict['filter_id'])
+        single_child = len(groups) == 1
 
-            children_filter_input = filter_input
-            # check if image's object (location) changed
-            if img_res is not None and not filter_input.is_same_images(img_res):
-                children_filter_input = RGBFilterInput.clone(filter_input)
-
-                children_filter_input.configure(input=img_res)
+        # Assume we can modify
+        filter_input.configure(is_mutable=single_child)
 
-            self.backend__process_image(
-                children_filter_input, metadata, children)
+        shedder = self.__load_shedder
+
+        for group in groups.values():
+            is_shared = len(group) > 1
+            if is_shared:
+                self.__shared_results.begin()
+
+            # [(result, children), ..], members with the same result are merged
+            outputs = []
+            for got_filter_dict in group:
+                assert isinstance(got_filter_dict['filter_parameters'], dict)
+
+                if duplicate and not self._backend__needs_tick(got_filter_dict):
+                    continue
+
+                # skip or decimate the low priority branches under overload
+                if shedder.active and not shedder.should_run(
+                        self._backend__branch_priority(got_filter_dict), self.__frame_number):
+                    continue
+
+                filter_cb = got_filter_dict['filter_obj']
+                
+                stats = self.__stats
+                copy_sec_before = stats.frame_copy_sec
+                wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                
+                img_res = filter_cb(
+                    filter_input, **got_filter_dict['filter_parameters'])
+                
+                # shmem output copy is accounted per frame, not per filter
+                copy_sec = stats.frame_copy_sec - copy_sec_before
+                stats.filter(got_filter_dict['filter_id']).add(
+                    time.perf_counter() - wall_start - copy_sec,
+                    time.thread_time() - cpu_start - copy_sec,
+                    img_res,
+                    img_res is not None and img_res is not GATE_CLOSED
+                    and not filter_input.is_same_images(img_res)
+                )
+
+                # gated edge, e.g. no motion
+                if img_res is GATE_CLOSED:
+                    continue
+
+                member_children = self.backend__filter_tree.get_children_filters(
+                    got_filter_dict['filter_id'])
+
+                if outputs and outputs[-1][0] is img_res:
+                    outputs[-1][1].extend(member_children)
+                else:
+                    outputs.append((img_res, list(member_children)))
+
+            if is_shared:
+                self.__shared_results.end()
+
+            # every member is evaluated before the children run,
+            #  so the merged children see the result as a single node's output
+            for group_res, children in outputs:
+                if not children:
+                    continue
+
+                img_res_list = group_res if isinstance(group_res, BatchOutput) else (group_res,)
+
+                for img_res in img_res_list:
+                    children_filter_input = filter_input
+                    # check if image's object (location) changed
+                    if img_res is not None and not filter_input.is_same_images(img_res):
+                        children_filter_input = RGBFilterInput.clone(filter_input)
+
+                        # the result buffer may be the filter's own (reused on the
+                        #  next frame), the children set the flags of a view only
+                        children_filter_input.configure(input=img_res.view())
+
+                    self.backend__process_image(
+                        children_filter_input, metadata, children, duplicate)
 
     # return shmem object
     # assuming filter returns numpy array with the same size in the lifetime of output
-    def backend__request_filter_output(self, filter_id) -> None:
+    # pyramid_scales: output every scale into one segment (RGBSharedMemoryPyramid)
+    def backend__request_filter_output(self, filter_id, pyramid_scales: Optional[List[float]] = None) -> None:
         assert filter_id not in self.__shmem_output, 'one shmem output allowed per filter'
 
         if videorotate_constants.DEBUG:
@@ -263,7 +879,8 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
         # Embed the setup code
         filter_obj['filter_shmem_output'] = {
             'filter_original': filter_obj['filter_obj'],
-            'request': RGBSharedMemoryImage(filter_id, 0, 0)
+            'request': (RGBSharedMemoryImage(filter_id, 0, 0) if pyramid_scales is None
+                        else RGBSharedMemoryPyramid(filter_id, list(pyramid_scales)))
         }
         
         if videorotate_constants.DEBUG:
@@ -271,8 +888,9 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
             sys.stdout.flush()
 
         # Setup function to acquire 'static' image metadata on first run
+        #  (first frame with an image to show, the result is passed on unchanged)
         def setup_filter_output(*args, **kwargs):
-            img = filter_obj['filter_shmem_output']['filter_original'](
+            result = filter_obj['filter_shmem_output']['filter_original'](
                 *args, **kwargs)
 
             if videorotate_constants.DEBUG:
@@ -281,20 +899,42 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
 
             shmem_data = filter_obj['filter_shmem_output']['request']
 
-            if not isinstance(img, np.ndarray):
-                self.backend__revoke_filter_output(shmem_data)
-                return
-
-            shmem_data.buffer_nsize = img.nbytes
-            shmem_data.height = img.shape[0]
-            shmem_data.width = img.shape[1]
-            shmem_data.ndarray_dtype = img.dtype
-            shmem_data.ndarray_shape = img.shape
+            img = self._backend__output_image(result, args[0])
+            if img is None:
+                # incomplete batch, try again on the next frame
+                return result
+
+            pixel_nbytes = img.nbytes // (img.shape[0] * img.shape[1])
+
+            if isinstance(shmem_data, RGBSharedMemoryPyramid):
+                level_sizes = pyramid_level_sizes(img.shape[1], img.shape[0], shmem_data.scales)
+                shmem_data.buffer_nsize = pyramid_nbytes(level_sizes, pixel_nbytes)
+
+                shmem_data.levels = [
+                    RGBSharedMemoryImage(
+                        filter_id, w, h,
+                        buffer_nsize=shmem_data.buffer_nsize,
+                        ndarray_dtype=img.dtype,
+                        ndarray_shape=(h, w, *img.shape[2:]),
+                        slot_nbytes=w * h * pixel_nbytes,
+                        pyramid_level=i,
+                        pending=False
+                    ) for i, (w, h) in enumerate(level_sizes)
+                ]
+            else:
+                # headroom: any size up to the consumer's input resolution fits in place
+                input_h, input_w = self.__input_shape[:2]
+                shmem_data.slot_nbytes = max(img.nbytes, input_w * input_h * pixel_nbytes)
+                shmem_data.buffer_nsize = segment_nbytes(shmem_data.slot_nbytes, shmem_data.slot_count)
+                shmem_data.height = img.shape[0]
+                shmem_data.width = img.shape[1]
+                shmem_data.ndarray_dtype = img.dtype
+                shmem_data.ndarray_shape = img.shape
 
             if videorotate_constants.DEBUG:
                 print('1')
                 print()
-                print(shmem_data.width, shmem_data.height)
+                print(shmem_data)
                 print()
                 print('-1-')
                 sys.stdout.flush()
@@ -303,8 +943,12 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
             shmem = self._backend__create_filter_output(shmem_data)
 
             shmem_data.buffer_name = shmem.name
+            for level in getattr(shmem_data, 'levels', ()):
+                level.buffer_name = shmem.name
 
-            return img
+            self._backend__write_filter_output(self.__shmem_output[filter_id], img, args[0])
+
+            return result
 
         filter_obj['filter_obj'] = setup_filter_output
 
@@ -350,7 +994,7 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
         # control.reply_to_message = False
 
     # receive
-    def backend__get_stream_output(self, filter_id) -> RGBSharedMemoryImage:
+    def backend__get_stream_output(self, filter_id) -> Union[RGBSharedMemoryImage, RGBSharedMemoryPyramid]:
         shmem_image = None
 
         if filter_id in self.__shmem_output:
@@ -366,9 +1010,9 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
 
     # Allowed to call multiple times under filter's lifecycle
     def backend__revoke_filter_output(self,
-                                      shmem_image: RGBSharedMemoryImage,
+                                      shmem_image: Union[RGBSharedMemoryImage, RGBSharedMemoryPyramid],
                                       destroy_shmem: bool = True):
-        assert isinstance(shmem_image, RGBSharedMemoryImage)
+        assert isinstance(shmem_image, (RGBSharedMemoryImage, RGBSharedMemoryPyramid))
 
         filter_search = self.backend__filter_tree.get_filter_by_id(
             shmem_image.filter_id)
@@ -403,6 +1047,7 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
 
         if is_shmem_allocated:
             if allocation['open']:
+                allocation['writer'].release()
                 allocation['shmem'].close()
                 allocation['open'] = False
 
@@ -441,7 +1086,10 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
                 'filter': output_filter,
                 'filter_obj': record_controller.handle_recording,
                 'record_controller': record_controller,
-                'filter_parameters': { }
+                'filter_parameters': { },
+                'priority': BranchPriority.RECORDING,
+                # fixed fps output, repeated frames are written too
+                'tick_on_duplicate': True
             }
         )
         
@@ -453,22 +1101,58 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
     def backend__process_loop_extended(self):
         super().backend__process_loop()
         
+        self.backend__process_next_frame()
+    
+    def backend__process_next_frame(self) -> bool:
+        grab_start = time.perf_counter()
         is_ready, img, metadata = self.adapter.backend__input__grab_frame()
+        tree_start = time.perf_counter()
+        
         if is_ready:
             if videorotate_constants.DEBUG:
                 print(img.shape)
                 sys.stdout.flush()
-
-            self.backend__process_image(
-                RGBFilterInput(img, False, RGBFilterInput.ColorSpace.RGB),
-                metadata,
-                self.backend__filter_tree.list_matching_filters(max_level=0))
+            
+            self.__input_shape = img.shape
+
+            received = getattr(metadata, 'received_timestamp', None)
+            if received and metadata.mstimestamp:
+                self.__stats.source_latency.add(max(received - metadata.timestamp_sec, 0.0))
+
+            duplicate = self.__duplicate_detector.is_duplicate(img)
+            if duplicate:
+                self.__stats.duplicate_frames += 1
+
+            try:
+                self.backend__process_image(
+                    RGBFilterInput(img, False, RGBFilterInput.ColorSpace.RGB, metadata),
+                    metadata,
+                    self.backend__filter_tree.list_matching_filters(max_level=0),
+                    duplicate)
+            finally:
+                # the tree is done with the (zero-copy) frame
+                self.adapter.backend__input__release_frame(metadata)
+            
+            tree_end = time.perf_counter()
+            self.__stats.add_frame(tree_start - grab_start,
+                                   tree_end - tree_start,
+                                   tree_end - grab_start)
+            
+            self.__load_shedder.frame_done(grab_start, tree_end - grab_start)
+            self.__frame_number += 1
+        
+        return is_ready
     
     def backend__setup(self):
         super().backend__setup()
         self.__filter_tree = FilterBlockLogic()
+        self.__stats = ConsumerStats()
+        self.__load_shedder = LoadShedder()
+        self.__shared_results = SharedFilterResults()
+        self.__frame_number = 0
+        self.__duplicate_detector = DuplicateFrameDetector()
         
-        # {filter_id: {'shmem': SharedMemory, 'open': bool}, ..}
+        # {filter_id: {'shmem': SharedMemory, 'writer': SharedFrameWriter, 'open': bool}, ..}
         self.__shmem_output = {}
     
     def backend__exit(self):
@@ -527,7 +1211,36 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
 
     
 
-    def _backend__create_filter_output(self, shmem_image: RGBSharedMemoryImage):
+    # unshareable filters (stateful or unhashable parameters) get their own group
+    def _backend__shared_group_key(self, filter_obj: Dict) -> Any:
+        if filter_obj.get('filter_shareable'):
+            try:
+                return (filter_obj['filter'],
+                        frozenset(filter_obj['filter_parameters'].items()))
+            except TypeError:
+                pass
+
+        return (None, filter_obj['filter_id'])
+
+    # a branch keeps the highest priority of its subtree
+    #  so a recorder is not starved by its low priority parent
+    # the filter or one of its descendants runs on repeated frames too
+    def _backend__needs_tick(self, filter_obj: Dict) -> bool:
+        if filter_obj.get('tick_on_duplicate', False):
+            return True
+
+        return any(self._backend__needs_tick(child['object'])
+                   for child in self.backend__filter_tree.get_children_filters(filter_obj['filter_id']))
+
+    def _backend__branch_priority(self, filter_obj: Dict) -> BranchPriority:
+        priority = filter_obj.get('priority', BranchPriority.PREVIEW)
+
+        for child in self.backend__filter_tree.get_children_filters(filter_obj['filter_id']):
+            priority = max(priority, self._backend__branch_priority(child['object']))
+
+        return priority
+
+    def _backend__create_filter_output(self, shmem_image: Union[RGBSharedMemoryImage, RGBSharedMemoryPyramid]):
         filter_search = self.backend__filter_tree.get_filter_by_id(
             shmem_image.filter_id)
 
@@ -538,28 +1251,70 @@ class Consumer(TaskProcess, ExtendedBackendProcess):
         shmem = shared_memory.SharedMemory(
             create=True, size=shmem_image.buffer_nsize)
 
-        ndarray_shape = shmem_image.ndarray_shape
-
         self.__shmem_output[shmem_image.filter_id] = {
             'shmem_image': shmem_image,
             'shmem': shmem,
-            'shmem_ndarray': np.ndarray(ndarray_shape, dtype=shmem_image.ndarray_dtype, buffer=shmem.buf),
+            'writer': self._backend__create_output_writer(shmem_image, shmem),
             'open': True
         }
         filter_entry = self.__shmem_output[shmem_image.filter_id]
 
         def img_copy_proxy(*args, **kwargs):
-            img = filter_obj['filter_shmem_output']['filter_original'](
+            result = filter_obj['filter_shmem_output']['filter_original'](
                 *args, **kwargs)
 
-            np.copyto(filter_entry['shmem_ndarray'], img)
-            return img
+            img = self._backend__output_image(result, args[0])
+            if img is not None:
+                self._backend__write_filter_output(filter_entry, img, args[0])
+
+            return result
 
         filter_obj['filter_obj'] = img_copy_proxy
         shmem_image.pending = False
 
         return shmem
 
+    # image shown by the filter's shmem output
+    #  pass-through and gated filters show their input, None = incomplete batch
+    def _backend__output_image(self, result: Any, filter_input: RGBFilterInput) -> Optional[np.ndarray]:
+        if isinstance(result, BatchOutput):
+            if not result:
+                return None
+            result = result[-1]
+
+        if isinstance(result, np.ndarray):
+            return result
+        return filter_input.get_as_immutable_input()
+
+    def _backend__write_filter_output(self, filter_entry: Dict, img: np.ndarray, filter_input: RGBFilterInput):
+        # source capture and read time into the slot header
+        metadata = filter_input.metadata
+        timestamp = getattr(metadata, 'timestamp_sec', None)
+        grab_timestamp = getattr(metadata, 'received_timestamp', None)
+
+        copy_start = time.perf_counter()
+        if not filter_entry['writer'].write(img, timestamp, grab_timestamp) and videorotate_constants.DEBUG:
+            print('Filter output does not fit', filter_entry['shmem_image'].filter_id, img.shape)
+            sys.stdout.flush()
+        self.__stats.frame_copy_sec += time.perf_counter() - copy_start
+
+    def _backend__create_output_writer(self,
+                                       shmem_image: Union[RGBSharedMemoryImage, RGBSharedMemoryPyramid],
+                                       shmem: shared_memory.SharedMemory):
+        if isinstance(shmem_image, RGBSharedMemoryPyramid):
+            top = shmem_image.levels[0]
+            return SharedPyramidWriter(
+                shmem.buf,
+                [(level.width, level.height) for level in shmem_image.levels],
+                top.slot_nbytes // (top.width * top.height)
+            )
+
+        return SharedFrameWriter(
+            shmem.buf,
+            shmem_image.slot_nbytes,
+            shmem_image.slot_count
+        )
+
 
 if __name__ == '__main__':
     class ABCUG(IFrameProcessAdapter):
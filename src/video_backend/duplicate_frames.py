@@ -0,0 +1,57 @@
+from typing import Optional
+
+import numpy as np
+
+# Cheap repeated-frame check at the consumer's ingress: a strided
+#  subsample (about GRID x GRID pixels) is compared with the previous
+#  frame's one. Stalled cameras and streams slower than the configured
+#  frame interval deliver the same image again.
+# Off by default: in static scenes the unchanged macroblocks are identical,
+#  a small object moving between the sample points is not seen.
+
+
+class DuplicateFrameDetector:
+    GRID = 64
+
+    def __init__(self, tolerance: float = 0.0, enabled: bool = False) -> None:
+        # max mean absolute difference of a duplicate (0 = identical samples)
+        self.tolerance = tolerance
+        self.enabled = enabled
+
+        self._sample: Optional[np.ndarray] = None
+        self._previous: Optional[np.ndarray] = None
+        self._diff: Optional[np.ndarray] = None
+
+    def reset(self):
+        self._previous = None
+
+    def is_duplicate(self, img: np.ndarray) -> bool:
+        if not self.enabled:
+            return False
+
+        step_y = max(img.shape[0] // self.GRID, 1)
+        step_x = max(img.shape[1] // self.GRID, 1)
+        view = img[::step_y, ::step_x]
+
+        if self._sample is None or self._sample.shape != view.shape:
+            self._sample = np.empty_like(view)
+            self._previous = None
+
+        np.copyto(self._sample, view)
+
+        duplicate = False
+        if self._previous is not None:
+            if self.tolerance <= 0:
+                duplicate = np.array_equal(self._sample, self._previous)
+            else:
+                if self._diff is None or self._diff.shape != view.shape:
+                    self._diff = np.empty(view.shape, np.int16)
+                np.subtract(self._sample, self._previous, out=self._diff, dtype=np.int16)
+                duplicate = np.abs(self._diff).mean() <= self.tolerance
+
+        # keep the buffers, swap roles
+        if self._previous is None:
+            self._previous = np.empty_like(view)
+        self._sample, self._previous = self._previous, self._sample
+
+        return bool(duplicate)
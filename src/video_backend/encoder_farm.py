@@ -0,0 +1,406 @@
+from dataclasses import dataclass
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client, Connection, wait
+from typing import Any, Dict, List, Optional, Tuple
+import multiprocessing
+import queue
+import secrets
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from videorotate_utils import print_exception
+from video_backend.profiling import TimingSummary, TimingWindow
+
+# Encoder worker processes shared by the recorders of every consumer:
+#  the recorder side (EncoderFarmWriter) asks the farm for a worker, creates
+#  a shared memory ring of frame slots and sends open/write/close commands to
+#  the worker over a multiprocessing connection, the worker acks the slots
+#  it is done with.
+# The farm assigns the new streams to the least loaded worker (pixel rate),
+#  every worker serves its streams round-robin: one frame per stream per round.
+
+
+# picklable, passed to the recorders
+@dataclass
+class EncoderFarmSpec:
+    address: Any
+    authkey: bytes
+
+
+@dataclass
+class StreamStatsSnapshot:
+    stream_id: Any
+    worker: int
+    frames: int
+    bytes_in: int
+    encode_sec: TimingSummary
+    fps: float
+
+
+# worker: the one with more frames
+# percentiles: weighted by the sample counts (approximation)
+def _merge_stream_stats(a: StreamStatsSnapshot, b: StreamStatsSnapshot) -> StreamStatsSnapshot:
+    count = a.encode_sec.count + b.encode_sec.count
+    weighted = lambda attr: ((getattr(a.encode_sec, attr) * a.encode_sec.count
+                              + getattr(b.encode_sec, attr) * b.encode_sec.count) / count
+                             if count else 0.0)
+
+    return StreamStatsSnapshot(
+        a.stream_id,
+        a.worker if a.frames >= b.frames else b.worker,
+        a.frames + b.frames,
+        a.bytes_in + b.bytes_in,
+        TimingSummary(count, weighted('p50'), weighted('p95'), max(a.encode_sec.max, b.encode_sec.max)),
+        a.fps + b.fps
+    )
+
+
+class _StreamStats:
+    def __init__(self, stream_id: Any) -> None:
+        self.stream_id = stream_id
+        self.open_count = 0
+
+        self.encode_sec = TimingWindow()
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.bytes_in = 0
+        self.window_start = time.perf_counter()
+        self.encode_sec.reset()
+
+    def snapshot(self, worker: int, reset: bool) -> StreamStatsSnapshot:
+        window_sec = time.perf_counter() - self.window_start
+        snapshot = StreamStatsSnapshot(
+            self.stream_id,
+            worker,
+            self.frames,
+            self.bytes_in,
+            self.encode_sec.summary(),
+            self.frames / window_sec if window_sec > 0 else 0.0
+        )
+
+        if reset:
+            self.reset()
+
+        return snapshot
+
+
+# one file of a stream (the next segment may be open at the same time)
+class _WorkerStream:
+    def __init__(self,
+                 stats: _StreamStats,
+                 shmem_name: str,
+                 slot_count: int,
+                 shape: Tuple[int, ...],
+                 filepath: str,
+                 fourcc: int,
+                 fps: float) -> None:
+        self.stats = stats
+        self.stats.open_count += 1
+
+        self.shmem = shared_memory.SharedMemory(shmem_name)
+        # the recorder side unlinks it, the tracker would do it again at exit
+        resource_tracker.unregister(self.shmem._name, 'shared_memory')
+
+        slot_nbytes = int(np.prod(shape))
+        self.slots = [
+            np.ndarray(shape, np.uint8, buffer=self.shmem.buf, offset=i * slot_nbytes)
+            for i in range(slot_count)
+        ]
+
+        height, width = shape[:2]
+        self.writer = cv2.VideoWriter(filepath, fourcc, fps, (width, height), isColor=True)
+
+    def write(self, slot: int):
+        start = time.perf_counter()
+        self.writer.write(self.slots[slot])
+        self.stats.encode_sec.add(time.perf_counter() - start)
+
+        self.stats.frames += 1
+        self.stats.bytes_in += self.slots[slot].nbytes
+
+    def close(self):
+        self.stats.open_count -= 1
+
+        if self.writer.isOpened():
+            self.writer.release()
+
+        self.slots = []
+        self.shmem.close()
+
+
+@print_exception
+def _encoder_worker(worker_index: int, authkey: bytes, address_pipe: Connection):
+    listener = Listener(authkey=authkey)
+    address_pipe.send(listener.address)
+    address_pipe.close()
+
+    connections: List[Connection] = []
+    streams: Dict[Connection, _WorkerStream] = {}
+    # opening/closing on the lifecycle thread, not polled meanwhile
+    busy = set()
+    lock = threading.Lock()
+
+    def accept():
+        while True:
+            conn = listener.accept()
+            with lock:
+                connections.append(conn)
+
+    accept_thread = threading.Thread(target=accept)
+    accept_thread.daemon = True
+    accept_thread.start()
+
+    # Opening a file and finalizing a segment (VideoWriter.release) take
+    #  time, the other streams of the worker are encoded meanwhile
+    lifecycle_queue = queue.Queue()
+
+    @print_exception
+    def run_lifecycle():
+        while True:
+            conn, action, args = lifecycle_queue.get()
+
+            try:
+                if action == 'open':
+                    stream = _WorkerStream(*args)
+                    with lock:
+                        streams[conn] = stream
+                elif action == 'close':
+                    args.close()
+                    conn.send(('closed',))
+                elif action == 'drop':
+                    args.close()
+            finally:
+                with lock:
+                    busy.discard(conn)
+
+    lifecycle_thread = threading.Thread(target=run_lifecycle)
+    lifecycle_thread.daemon = True
+    lifecycle_thread.start()
+
+    # by stream_id, kept after close until reported
+    stream_stats: Dict[Any, _StreamStats] = {}
+
+    while True:
+        with lock:
+            polled = [conn for conn in connections if conn not in busy]
+
+        # one message per connection per round
+        for conn in wait(polled, timeout=0.1):
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                # the recorder side is gone
+                with lock:
+                    stream = streams.pop(conn, None)
+                    connections.remove(conn)
+                if stream is not None:
+                    lifecycle_queue.put((None, 'drop', stream))
+                conn.close()
+                continue
+
+            command = msg[0]
+
+            if command == 'open':
+                _, stream_id, *open_args = msg
+                stats = stream_stats.setdefault(stream_id, _StreamStats(stream_id))
+                with lock:
+                    busy.add(conn)
+                lifecycle_queue.put((conn, 'open', (stats, *open_args)))
+            elif command == 'write':
+                streams[conn].write(msg[1])
+                conn.send(('ack', msg[1]))
+            elif command == 'close':
+                with lock:
+                    stream = streams.pop(conn)
+                    busy.add(conn)
+                lifecycle_queue.put((conn, 'close', stream))
+            elif command == 'stats':
+                reset = msg[1]
+                conn.send({stream_id: stats.snapshot(worker_index, reset)
+                           for stream_id, stats in stream_stats.items()})
+
+                # closed streams are reported once
+                if reset:
+                    for stream_id, stats in list(stream_stats.items()):
+                        if not stats.open_count:
+                            del stream_stats[stream_id]
+            elif command == 'exit':
+                with lock:
+                    open_streams = list(streams.values())
+                for stream in open_streams:
+                    stream.close()
+                return
+
+
+class EncoderFarm:
+    def __init__(self, worker_count: Optional[int] = None) -> None:
+        self.worker_count = worker_count or max(multiprocessing.cpu_count() // 2, 1)
+
+        self._authkey = secrets.token_bytes(16)
+        self._workers: List[multiprocessing.Process] = []
+        self._worker_addresses = []
+        self._control_connections: List[Connection] = []
+
+        # assigned pixel rate by worker
+        self._load: List[float] = []
+        self._assigned: Dict[Any, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+        self._listener = None
+        self._spec = None
+
+    @property
+    def spec(self) -> EncoderFarmSpec:
+        return self._spec
+
+    def start(self) -> EncoderFarmSpec:
+        for i in range(self.worker_count):
+            address_recv, address_send = multiprocessing.Pipe(False)
+
+            worker = multiprocessing.Process(
+                target=_encoder_worker,
+                args=(i, self._authkey, address_send),
+                name=f"EncoderWorker-{i}",
+                daemon=True
+            )
+            worker.start()
+
+            address = address_recv.recv()
+            self._workers.append(worker)
+            self._worker_addresses.append(address)
+            self._control_connections.append(Client(address, authkey=self._authkey))
+            self._load.append(0.0)
+
+        self._listener = Listener(authkey=self._authkey)
+        self._spec = EncoderFarmSpec(self._listener.address, self._authkey)
+
+        assign_thread = threading.Thread(target=self._serve_assignments)
+        assign_thread.daemon = True
+        assign_thread.start()
+
+        return self._spec
+
+    def stop(self):
+        for conn in self._control_connections:
+            conn.send(('exit',))
+            conn.close()
+        for worker in self._workers:
+            worker.join(timeout=5.0)
+
+        self._workers = []
+        self._control_connections = []
+
+    # per-camera throughput, by stream id
+    # a camera's next segment may be encoded by another worker, the
+    #  snapshots of the workers are summed
+    def stats(self, reset: bool = True) -> Dict[Any, StreamStatsSnapshot]:
+        stats = {}
+        with self._lock:
+            for conn in self._control_connections:
+                conn.send(('stats', reset))
+                for stream_id, snapshot in conn.recv().items():
+                    merged = stats.get(stream_id)
+                    stats[stream_id] = snapshot if merged is None else _merge_stream_stats(merged, snapshot)
+        return stats
+
+    def _serve_assignments(self):
+        while True:
+            conn = self._listener.accept()
+
+            with conn:
+                command, assignment_id, *args = conn.recv()
+
+                with self._lock:
+                    if command == 'assign':
+                        pixel_rate = args[0]
+                        worker = min(range(self.worker_count), key=self._load.__getitem__)
+
+                        self._load[worker] += pixel_rate
+                        self._assigned[assignment_id] = (worker, pixel_rate)
+                        conn.send(self._worker_addresses[worker])
+                    elif command == 'release':
+                        worker, pixel_rate = self._assigned.pop(assignment_id, (None, 0.0))
+                        if worker is not None:
+                            self._load[worker] -= pixel_rate
+
+
+# cv2.VideoWriter replacement (write/release/isOpened), encodes in a farm worker
+class EncoderFarmWriter:
+    DEFAULT_SLOT_COUNT = 4
+
+    def __init__(self,
+                 spec: EncoderFarmSpec,
+                 stream_id: Any,
+                 filepath: str,
+                 fourcc: int,
+                 fps: float,
+                 size: Tuple[int, int],
+                 slot_count: int = DEFAULT_SLOT_COUNT) -> None:
+        self._spec = spec
+        self._stream_id = stream_id
+
+        width, height = size
+        self._shape = (height, width, 3)
+
+        # one assignment per file
+        self._assignment_id = (stream_id, secrets.token_hex(8))
+        with Client(spec.address, authkey=spec.authkey) as farm:
+            farm.send(('assign', self._assignment_id, width * height * fps))
+            worker_address = farm.recv()
+
+        slot_nbytes = int(np.prod(self._shape))
+        self._shmem = shared_memory.SharedMemory(create=True, size=slot_nbytes * slot_count)
+        self._slots = [
+            np.ndarray(self._shape, np.uint8, buffer=self._shmem.buf, offset=i * slot_nbytes)
+            for i in range(slot_count)
+        ]
+        self._free_slots = list(range(slot_count))
+
+        self._conn = Client(worker_address, authkey=spec.authkey)
+        self._conn.send(('open', stream_id, self._shmem.name, slot_count,
+                         self._shape, filepath, fourcc, fps))
+        self._opened = True
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    # blocks while every slot is at the worker
+    def write(self, img: np.ndarray):
+        if img.shape != self._shape:
+            return
+
+        while self._conn.poll() or not self._free_slots:
+            self._receive()
+
+        slot = self._free_slots.pop()
+        np.copyto(self._slots[slot], img)
+        self._conn.send(('write', slot))
+
+    # waits until the worker finalized the file
+    def release(self):
+        if not self._opened:
+            return
+        self._opened = False
+
+        self._conn.send(('close',))
+        while self._receive() != 'closed':
+            pass
+        self._conn.close()
+
+        self._slots = []
+        self._shmem.close()
+        self._shmem.unlink()
+
+        with Client(self._spec.address, authkey=self._spec.authkey) as farm:
+            farm.send(('release', self._assignment_id))
+
+    def _receive(self) -> str:
+        msg = self._conn.recv()
+        if msg[0] == 'ack':
+            self._free_slots.append(msg[1])
+        return msg[0]
@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Dict, Optional, Tuple
+
+
+class BranchPriority(IntEnum):
+    PREVIEW = 0
+    ANALYTICS = 1
+    RECORDING = 2
+
+
+@dataclass
+class LoadShedSnapshot:
+    # processing time / frame interval
+    load: float
+    level: int
+    # current decimation by priority: 1 = every frame, n = every n-th, 0 = skipped
+    decimation: Dict[BranchPriority, int]
+    # skipped branch runs by priority since the last reset
+    shed_counts: Dict[BranchPriority, int]
+
+
+# Measures the processing time against the frame interval and sheds
+#  the lowest priority branches first when the filter tree falls behind:
+#  decimate (every 2nd, 4th frame), then skip, then go to the next priority
+class LoadShedder:
+    HIGH_LOAD = 0.9
+    LOW_LOAD = 0.6
+    # frames between two level changes
+    ADJUST_INTERVAL = 15
+    EWMA_ALPHA = 0.1
+
+    DECIMATION_STEPS = (2, 4, 0)
+
+    def __init__(self,
+                 frame_interval_sec: Optional[float] = None,
+                 protected_priority: BranchPriority = BranchPriority.RECORDING) -> None:
+        self._nominal_interval = frame_interval_sec
+
+        self._levels: Tuple[Tuple[BranchPriority, int], ...] = tuple(
+            (priority, step)
+            for priority in sorted(BranchPriority)
+            if priority < protected_priority
+            for step in self.DECIMATION_STEPS
+        )
+        self._level = 0
+
+        self._processing_sec = None
+        self._interval_sec = None
+        self._last_arrival = None
+        self._frames_since_adjust = 0
+
+        self._decimation = {priority: 1 for priority in BranchPriority}
+        self.reset_counts()
+
+    @property
+    def active(self) -> bool:
+        return self._level > 0
+
+    @property
+    def load(self) -> float:
+        interval = self._nominal_interval or self._interval_sec
+        if not interval or self._processing_sec is None:
+            return 0.0
+        return self._processing_sec / interval
+
+    def reset_counts(self):
+        self._shed_counts = {priority: 0 for priority in BranchPriority}
+
+    def frame_done(self, arrival_sec: float, processing_sec: float):
+        alpha = self.EWMA_ALPHA
+
+        if self._last_arrival is not None:
+            interval = arrival_sec - self._last_arrival
+            self._interval_sec = interval if self._interval_sec is None else (
+                (1 - alpha) * self._interval_sec + alpha * interval)
+        self._last_arrival = arrival_sec
+
+        self._processing_sec = processing_sec if self._processing_sec is None else (
+            (1 - alpha) * self._processing_sec + alpha * processing_sec)
+
+        self._frames_since_adjust += 1
+        if self._frames_since_adjust < self.ADJUST_INTERVAL:
+            return
+
+        load = self.load
+        if load > self.HIGH_LOAD and self._level < len(self._levels):
+            self._set_level(self._level + 1)
+        elif load < self.LOW_LOAD and self._level > 0:
+            self._set_level(self._level - 1)
+
+    def should_run(self, priority: BranchPriority, frame_number: int) -> bool:
+        factor = self._decimation.get(priority, 1)
+
+        run = factor == 1 or (factor > 1 and frame_number % factor == 0)
+        if not run:
+            self._shed_counts[priority] += 1
+        return run
+
+    def snapshot(self, reset: bool = True) -> LoadShedSnapshot:
+        snapshot = LoadShedSnapshot(
+            self.load,
+            self._level,
+            dict(self._decimation),
+            dict(self._shed_counts)
+        )
+
+        if reset:
+            self.reset_counts()
+
+        return snapshot
+
+    def _set_level(self, level: int):
+        self._level = level
+        self._frames_since_adjust = 0
+
+        self._decimation = {priority: 1 for priority in BranchPriority}
+        for priority, step in self._levels[:level]:
+            self._decimation[priority] = step
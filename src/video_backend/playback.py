@@ -0,0 +1,188 @@
+from enum import Enum
+from typing import List, Optional, Tuple
+import os
+import time
+
+import cv2
+import numpy as np
+
+from IFrameProcessAdapter import IFrameProcessAdapter
+from video_backend.processing.RGBFilterInput import FrameMetadata
+
+# Recorded footage as a frame source: replaying field incidents, running the
+#  app without cameras and measuring the pipeline's throughput.
+# A path is a single video file or a directory (its video files in name order).
+
+
+class PlaybackMode(Enum):
+    # at the recorded frame rate, stops at the end
+    REALTIME = 'realtime'
+    # at the recorded frame rate, starts over at the end
+    LOOP = 'loop'
+    # as fast as the consumer takes the frames, starts over at the end
+    MAX_SPEED = 'max_speed'
+
+
+VIDEO_FILE_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov')
+
+
+def list_playback_files(path: str, extensions: Tuple[str, ...] = VIDEO_FILE_EXTENSIONS) -> List[str]:
+    if not os.path.isdir(path):
+        return [path]
+
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.lower().endswith(extensions)]
+
+
+# Consumer input decoding the files with OpenCV (rgb_task.Receiver_Create(VideoFileAdapter, {...}))
+class VideoFileAdapter(IFrameProcessAdapter):
+    # the consumer polls this adapter, the wait for the next frame is bounded
+    #  so the messages are still served
+    MAX_WAIT_SEC = 0.05
+    DEFAULT_FPS = 25.0
+
+    # access when input is available
+    @property
+    def width(self) -> int:
+        return self._width
+
+    # access when input is available
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def frame_interval_ms(self) -> Optional[int]:
+        if self._mode is PlaybackMode.MAX_SPEED:
+            return None
+        return int(1000 / self._fps)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    # size: (width, height) of the output, None = the files' size
+    def __init__(self,
+                 path: str,
+                 mode: PlaybackMode = PlaybackMode.REALTIME,
+                 size: Optional[Tuple[int, int]] = None) -> None:
+        self._files = list_playback_files(path)
+        if not self._files:
+            raise ValueError(f"No video file in {path}")
+
+        self._mode = PlaybackMode(mode)
+        self._size = size
+
+        self._capture = None
+        self._file_index = -1
+        self._fps = self.DEFAULT_FPS
+        self._width, self._height = size or (0, 0)
+
+        self._bgr = None
+        self._rgb = None
+        self._pending = False
+        self._due = 0.0
+        self._finished = False
+
+        self.frames = 0
+        self.loops = 0
+
+    # implemented by the input block
+    def backend__input__setup(self):
+        self._open_next_file()
+        self._due = time.monotonic()
+
+    # implemented by the input block
+    def backend__input__cleanup(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    # implemented by the input block
+    def backend__input__grab_frame(self,
+                                   ignore_cache: bool = False,
+                                   invalidate_cache: bool = False,
+                                   cache_new_frame_descriptor: bool = False
+                                   ) -> Tuple[bool, np.ndarray, any]:
+        if not self._pending and not self._read_frame():
+            # the consumer polls without timeout, no busy loop after the end
+            time.sleep(self.MAX_WAIT_SEC)
+            return False, None, None
+        self._pending = True
+
+        if self._mode is not PlaybackMode.MAX_SPEED:
+            wait_sec = self._due - time.monotonic()
+            if wait_sec > self.MAX_WAIT_SEC:
+                time.sleep(self.MAX_WAIT_SEC)
+                return False, None, None
+            if wait_sec > 0:
+                time.sleep(wait_sec)
+
+            # a stalled consumer does not make the playback rush
+            self._due = max(self._due + 1.0 / self._fps, time.monotonic() - 1.0)
+
+        self._pending = False
+        self.frames += 1
+
+        now = time.time()
+        metadata = FrameMetadata(
+            mstimestamp=int(now * 1000),
+            width=self._width,
+            height=self._height,
+            received_timestamp=now
+        )
+        return True, self._convert(), metadata
+
+    # implemented by the input block
+    def backend__input__is_ready(self, ignore_cache: bool) -> bool:
+        return not self._finished
+
+    def _read_frame(self) -> bool:
+        while not self._finished:
+            if self._capture is not None:
+                ok, self._bgr = self._capture.read(self._bgr)
+                if ok:
+                    return True
+
+            self._open_next_file()
+
+        return False
+
+    def _open_next_file(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+        self._file_index += 1
+        if self._file_index == len(self._files):
+            if self._mode is PlaybackMode.REALTIME:
+                self._finished = True
+                return
+
+            self._file_index = 0
+            self.loops += 1
+
+        capture = cv2.VideoCapture(self._files[self._file_index])
+        if not capture.isOpened():
+            # not tried again in the next round
+            del self._files[self._file_index]
+            self._file_index -= 1
+            self._finished = not self._files
+            return
+
+        self._capture = capture
+        self._fps = capture.get(cv2.CAP_PROP_FPS) or self.DEFAULT_FPS
+        # the next read fills a new buffer if the size changed
+        self._bgr = None
+
+    def _convert(self) -> np.ndarray:
+        img = self._bgr
+        if self._size is not None and (img.shape[1], img.shape[0]) != self._size:
+            img = cv2.resize(img, self._size, interpolation=cv2.INTER_AREA)
+
+        if self._rgb is None or self._rgb.shape != img.shape:
+            self._rgb = np.empty_like(img)
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self._rgb)
+
+        self._height, self._width = self._rgb.shape[:2]
+        return self._rgb
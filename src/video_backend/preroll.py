@@ -0,0 +1,68 @@
+from collections import deque
+from typing import Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Keeps the last frames before a recording trigger as JPEG,
+#  a 1080p frame is ~150-300 kB instead of 6 MB raw.
+# Bounded by frame count (pre-roll duration * fps) and by a memory budget,
+#  the oldest frames are dropped first.
+
+
+class PreRollBuffer:
+    DEFAULT_JPEG_QUALITY = 85
+    # per camera
+    DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+    @property
+    def frame_count(self) -> int:
+        return len(self._frames)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __init__(self,
+                 max_frames: int,
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 jpeg_quality: int = DEFAULT_JPEG_QUALITY) -> None:
+        assert max_frames > 0 and memory_budget > 0
+
+        self.max_frames = max_frames
+        self.memory_budget = memory_budget
+        self._encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+
+        self._frames = deque()
+        self._nbytes = 0
+
+        self.evicted_frames = 0
+
+    def push(self, img: np.ndarray):
+        ok, encoded = cv2.imencode('.jpg', img, self._encode_params)
+        if not ok:
+            return
+
+        self._frames.append(encoded)
+        self._nbytes += encoded.nbytes
+
+        while len(self._frames) > self.max_frames or self._nbytes > self.memory_budget:
+            self._nbytes -= self._frames.popleft().nbytes
+            self.evicted_frames += 1
+
+    # decode and empty the buffer, oldest first
+    #  size: (width, height) of the output, frames of other size are resized
+    def drain(self, size: Optional[Tuple[int, int]] = None) -> Iterator[np.ndarray]:
+        while self._frames:
+            encoded = self._frames.popleft()
+            self._nbytes -= encoded.nbytes
+
+            img = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            if size is not None and (img.shape[1], img.shape[0]) != size:
+                img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+            yield img
+
+    def clear(self):
+        self._frames.clear()
+        self._nbytes = 0
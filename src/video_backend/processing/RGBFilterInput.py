@@ -1,16 +1,38 @@
+from dataclasses import dataclass
 from enum import Enum
 from functools import cache, partial
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import cv2
 import numpy as np
 
-# Current implementation is limited with two ColorSpace types
+# Converted and resized views are cached per frame, keyed by (colorspace, size)
+#  and shared with the clones working on the same image
+
+
+# Source frame's descriptor, travels with the input to every filter
+@dataclass
+class FrameMetadata:
+    # capture time (ms since epoch)
+    mstimestamp: int
+    width: int
+    height: int
+    # shmem ring slot of the frame and its size (bytes)
+    slot: Optional[int] = None
+    size: Optional[int] = None
+    # when the frame was found in the ring (wall clock)
+    received_timestamp: Optional[float] = None
+
+    @property
+    def timestamp_sec(self) -> float:
+        return self.mstimestamp / 1000.0
 
 
 class RGBFilterInput:
     class ColorSpace(Enum):
         RGB: int = 0
         BGR: int = 1
+        GRAY: int = 2
+        YUV: int = 3
 
         @classmethod
         @cache
@@ -18,18 +40,37 @@ class RGBFilterInput:
             # {input: {output: cv2.COLOR_..., ..}, ..}
             conv_lookup_tbl = {
                 self.RGB: {
-                    self.BGR: cv2.COLOR_RGB2BGR
+                    self.BGR: cv2.COLOR_RGB2BGR,
+                    self.GRAY: cv2.COLOR_RGB2GRAY,
+                    self.YUV: cv2.COLOR_RGB2YUV
                 },
                 self.BGR: {
-                    self.RGB: cv2.COLOR_BGR2RGB
+                    self.RGB: cv2.COLOR_BGR2RGB,
+                    self.GRAY: cv2.COLOR_BGR2GRAY,
+                    self.YUV: cv2.COLOR_BGR2YUV
+                },
+                self.GRAY: {
+                    self.RGB: cv2.COLOR_GRAY2RGB,
+                    self.BGR: cv2.COLOR_GRAY2BGR
+                },
+                self.YUV: {
+                    self.RGB: cv2.COLOR_YUV2RGB,
+                    self.BGR: cv2.COLOR_YUV2BGR
                 }
             }
 
             if output_colorspace == input_colorspace:
                 raise ValueError('Color-spaces are identical')
 
+            if output_colorspace not in conv_lookup_tbl[input_colorspace]:
+                raise ValueError(f"No conversion from {input_colorspace} to {output_colorspace}")
+
             return conv_lookup_tbl[input_colorspace][output_colorspace]
 
+        @classmethod
+        def is_channel_swap(self, input_colorspace, output_colorspace) -> bool:
+            return {input_colorspace, output_colorspace} == {self.RGB, self.BGR}
+
     @property
     def width(self) -> int:
         return self._width
@@ -42,15 +83,15 @@ class RGBFilterInput:
     def __init__(self,
                  input: np.ndarray,
                  is_mutable: bool,
-                 input_color_space: ColorSpace = None) -> None:
+                 input_color_space: ColorSpace = None,
+                 metadata: Optional[FrameMetadata] = None) -> None:
         # No check for perf. reasons
         self._input_color_space = RGBFilterInput.ColorSpace.RGB
+        self.metadata = metadata
         
         self.configure(input, is_mutable, input_color_space)
         
         self._last_operation_immutable = None
-        self._width = input.shape[1]
-        self._height = input.shape[0]
 
     @property
     def is_mutable(self) -> bool:
@@ -66,33 +107,92 @@ class RGBFilterInput:
                     input_color_space: ColorSpace = None) -> None:
         sget = lambda prop_name: getattr(self, prop_name, None)
         
+        views = sget('_views')
+        
         if input is not None:
+            # views of the previous image are stale
+            if input is not sget('_input'):
+                views = None
             self._input = input
         else:
             self._input = sget('_input')
         
+        if input_color_space is not None and input_color_space != sget('_input_color_space'):
+            views = None
+        
         self._is_mutable = is_mutable or sget('_is_mutable')
         self._input_color_space = input_color_space or sget('_input_color_space')
         
-        self._input_converted = None or sget('_input_converted')
+        # {(color_space, size): ndarray, ..}
+        self._views: Dict[Tuple, np.ndarray] = {} if views is None else views
+        
+        self._width = self._input.shape[1]
+        self._height = self._input.shape[0]
         
         self._input.flags.writeable = not is_mutable
 
     # Current consumer will modify the content
-    def get_as_mutable_input(self, target_color_space: ColorSpace = None):
+    def get_as_mutable_input(self,
+                             target_color_space: ColorSpace = None,
+                             size: Optional[Tuple[int, int]] = None):
         out_color_space = target_color_space or self._input_color_space
 
         self._last_operation_immutable = False
 
-        return self._output_image(out_color_space, not self.is_mutable)
+        if (out_color_space, size) == (self._input_color_space, None):
+            if not self.is_mutable:
+                return np.copy(self._input)
+            return self._input
+
+        if not self.is_mutable:
+            return np.copy(self._view(out_color_space, size))
+
+        # the consumer owns the view from now, others will convert again
+        img = self._view(out_color_space, size)
+        del self._views[(out_color_space, size)]
+
+        img.flags.writeable = True
+        return img
 
     # Current consumer MUST NOT modify the content
-    def get_as_immutable_input(self, target_color_space: ColorSpace = None):
+    # allow_strided: the consumer accepts non-contiguous arrays,
+    #  RGB<->BGR is returned as a reversed-channel view without copying
+    def get_as_immutable_input(self,
+                               target_color_space: ColorSpace = None,
+                               size: Optional[Tuple[int, int]] = None,
+                               allow_strided: bool = False):
         out_color_space = target_color_space or self._input_color_space
 
         self._last_operation_immutable = True
 
-        return self._output_image(out_color_space, False)
+        if (out_color_space, size) == (self._input_color_space, None):
+            return self._input
+
+        if (allow_strided and size is None
+                and RGBFilterInput.ColorSpace.is_channel_swap(self._input_color_space, out_color_space)):
+            view = self._input[..., ::-1]
+            view.flags.writeable = False
+            return view
+
+        return self._view(out_color_space, size)
+
+    # write the converted image into dst (shape/dtype must match),
+    #  copies the cached view if another consumer converted already
+    def convert_into(self, target_color_space: ColorSpace, dst: np.ndarray) -> np.ndarray:
+        view = self._views.get((target_color_space, None))
+
+        if view is not None:
+            np.copyto(dst, view)
+        elif target_color_space == self._input_color_space:
+            np.copyto(dst, self._input)
+        else:
+            conversion = RGBFilterInput.ColorSpace.get_conversion_param(
+                self._input_color_space,
+                target_color_space
+            )
+            cv2.cvtColor(self._input, conversion, dst=dst)
+
+        return dst
 
     def is_same_images(self,
                            input_img: np.ndarray = None,
@@ -100,7 +200,9 @@ class RGBFilterInput:
         img_color_space = input_img_color_space or self._input_color_space
         
         if self._input_color_space != img_color_space:
-            return self._input_converted is input_img
+            return any(view is input_img
+                       for (color_space, _), view in self._views.items()
+                       if color_space == img_color_space)
         
         return self._input is input_img
 
@@ -110,38 +212,45 @@ class RGBFilterInput:
     def was_last_operation_mutable(self):
         return self._last_operation_immutable
 
-    def _output_image(self, out_color_space: ColorSpace, copy_img: bool):
-        if self._input_color_space != out_color_space:
-            # input & output color-space is different
-            
-            if self._input_converted is None:
-                self._create_conversion(out_color_space)
+    # size: (width, height), None is the input's size
+    def _view(self, out_color_space: ColorSpace, size: Optional[Tuple[int, int]]) -> np.ndarray:
+        key = (out_color_space, size)
 
-            if copy_img:
-                return np.copy(self._input_converted)
-            return self._input_converted
+        view = self._views.get(key)
+        if view is not None:
+            return view
 
-        # the two color-spaces are identical
-        
-        if copy_img:
-            return np.copy(self._input)
-
-        return self._input
-
-    def _create_conversion(self, out_color_space: ColorSpace):
-        conversion = RGBFilterInput.ColorSpace.get_conversion_param(
+        if size is None:
+            conversion = RGBFilterInput.ColorSpace.get_conversion_param(
                 self._input_color_space,
                 out_color_space
             )
+            view = cv2.cvtColor(self._input, conversion)
+        else:
+            source = self.get_as_immutable_input(out_color_space)
 
-        self._input_converted = cv2.cvtColor(self._input, conversion)
+            width, height = size
+            interpolation = (cv2.INTER_AREA
+                             if width < self._width and height < self._height
+                             else cv2.INTER_LINEAR)
+            view = cv2.resize(source, (width, height), interpolation=interpolation)
+
+        view.flags.writeable = False
+        self._views[key] = view
+
+        return view
 
     @classmethod
     def clone(self, filter_input):
         assert isinstance(filter_input, RGBFilterInput)
 
-        return RGBFilterInput(
+        cloned = RGBFilterInput(
             filter_input._input,
             filter_input._is_mutable,
-            filter_input._input_color_space
+            filter_input._input_color_space,
+            filter_input.metadata
         )
+        # same image, same views
+        cloned._views = filter_input._views
+
+        return cloned
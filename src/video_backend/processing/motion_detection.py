@@ -0,0 +1,75 @@
+from typing import Callable, Optional
+
+import numpy as np
+
+from .register_bgr_transform import bgr_stateful_transform, GATE_CLOSED
+
+from .RGBFilterInput import RGBFilterInput
+
+# Compares a small grayscale copy of the frame with a running background
+#  (exponential average), motion_score is the changed pixels' ratio.
+# The children run only while there is motion (gate=True), the gate is
+#  held open for hold_frames after the motion stopped.
+
+
+@bgr_stateful_transform
+class MotionDetection:
+    # runs on repeated frames too, the hold and the background follow the time
+    tick_on_duplicate = True
+
+    def __init__(self) -> None:
+        self._background = None
+        self._diff = None
+        self._hold = 0
+
+        self.motion_score = 0.0
+        self.motion = False
+
+        # motion_changed(motion, motion_score) on every change
+        self.motion_changed: Optional[Callable[[bool, float], None]] = None
+
+    # downscale: 1/downscale of the input in both dimensions
+    # threshold: gray level difference of a changed pixel
+    # min_score: changed pixels' ratio of motion
+    # learning_rate: background update weight of the current frame
+    def __call__(self,
+                 input: RGBFilterInput,
+                 downscale: int = 8,
+                 threshold: float = 25.0,
+                 min_score: float = 0.005,
+                 learning_rate: float = 0.05,
+                 hold_frames: int = 25,
+                 gate: bool = True):
+        size = (max(input.width // downscale, 1), max(input.height // downscale, 1))
+        small = input.get_as_immutable_input(RGBFilterInput.ColorSpace.GRAY, size)
+
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small.astype(np.float32)
+            self._diff = np.empty_like(self._background)
+
+        background, diff = self._background, self._diff
+
+        np.subtract(small, background, out=diff)
+        np.abs(diff, out=diff)
+        self.motion_score = float(np.count_nonzero(diff > threshold)) / diff.size
+
+        # background += learning_rate * (small - background)
+        np.subtract(small, background, out=diff)
+        diff *= learning_rate
+        background += diff
+
+        if self.motion_score >= min_score:
+            self._hold = hold_frames
+        elif self._hold > 0:
+            self._hold -= 1
+
+        motion = self.motion_score >= min_score or self._hold > 0
+        if motion != self.motion:
+            self.motion = motion
+            if self.motion_changed is not None:
+                self.motion_changed(motion, self.motion_score)
+
+        if gate and not motion:
+            return GATE_CLOSED
+        # pass-through
+        return None
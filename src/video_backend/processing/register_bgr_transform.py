@@ -1,4 +1,6 @@
-from typing import Callable, Sequence, Any
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Sequence, Any, Optional
 
 _registered_bgr_transforms = {}
 def register_bgr_transform(transform: Callable) -> None:
@@ -27,5 +29,65 @@ def bgr_transform(transform: Callable):
     return inner
 
 
+# decorator
+# the class is instantiated once per filter, so the instance can keep
+#  buffers between frames; called as instance(input, **filter_parameters)
+# shareable: the state is a cache only (the output depends on the input and
+#  the parameters), identical siblings may use one instance's result
+def bgr_stateful_transform(transform_class: Optional[type] = None, shareable: bool = False):
+    def decorator(transform_class: type):
+        transform_class.stateful = True
+        transform_class.shareable = shareable
+        register_bgr_transform(transform_class)
+        return transform_class
+
+    if transform_class is None:
+        return decorator
+    return decorator(transform_class)
+
+def is_stateful_transform(transform: Callable) -> bool:
+    return getattr(transform, 'stateful', False)
+
+# the result of one filter can be given to an identical sibling
+def is_shareable_transform(transform: Callable) -> bool:
+    return not is_stateful_transform(transform) or getattr(transform, 'shareable', False)
+
+
+# returned by a transform: the children are not called with this frame
+GATE_CLOSED = object()
+
+
 def list_bgr_transforms() -> Sequence[Any]:
     return _registered_bgr_transforms.keys()
+
+
+class BatchPropagation(Enum):
+    # returned batch is split, children run once per frame
+    FRAME = 0
+    # children run once per batch with the returned image
+    BATCH = 1
+
+@dataclass
+class BatchSpec:
+    batch_size: int
+    # new frames between two calls; batch_size -> non-overlapping batches
+    stride: int
+    propagation: BatchPropagation
+
+# decorator
+# transform is called as transform(input, batch, **filter_parameters)
+#  where batch is a read-only (batch_size, H, W, 3) array of the recent frames
+def bgr_batch_transform(batch_size: int,
+                        stride: Optional[int] = None,
+                        propagation: BatchPropagation = BatchPropagation.BATCH):
+    stride = batch_size if stride is None else stride
+    assert 1 <= stride <= batch_size
+
+    def decorator(transform: Callable):
+        transform.batch_spec = BatchSpec(batch_size, stride, propagation)
+        register_bgr_transform(transform)
+        return transform
+    return decorator
+
+def get_batch_spec(transform: Callable) -> Optional[BatchSpec]:
+    return getattr(transform, 'batch_spec', None)
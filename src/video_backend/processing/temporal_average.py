@@ -0,0 +1,9 @@
+import numpy as np
+
+from .register_bgr_transform import bgr_batch_transform
+
+from .RGBFilterInput import RGBFilterInput
+
+@bgr_batch_transform(batch_size=4)
+def temporal_average(input: RGBFilterInput, batch: np.ndarray):
+    return batch.mean(axis=0, dtype=np.float32).astype(batch.dtype)
@@ -0,0 +1,288 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Sequence, Tuple
+import time
+
+import numpy as np
+
+# Cheap enough to stay enabled: recording a sample is an index increment
+#  and an array store, percentiles are computed on snapshot only
+
+@dataclass
+class TimingSummary:
+    count: int
+    p50: float
+    p95: float
+    max: float
+
+    @classmethod
+    def empty(cls) -> 'TimingSummary':
+        return cls(0, 0.0, 0.0, 0.0)
+
+
+class TimingWindow:
+    DEFAULT_SIZE = 512
+
+    def __init__(self, size: int = DEFAULT_SIZE) -> None:
+        self._samples = np.zeros(size, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self._count = 0
+
+    def add(self, value: float):
+        self._samples[self._count % len(self._samples)] = value
+        self._count += 1
+
+    # count is the number of samples since the last reset,
+    #  the percentiles are taken over the last (at most) window-size samples
+    def summary(self) -> TimingSummary:
+        if not self._count:
+            return TimingSummary.empty()
+
+        samples = self._samples[:min(self._count, len(self._samples))]
+        p50, p95 = np.percentile(samples, (50, 95))
+
+        return TimingSummary(self._count, float(p50), float(p95), float(samples.max()))
+
+
+# Fixed log-spaced bins: constant memory for any number of samples,
+#  the percentiles are the bins' upper edges
+class LatencyHistogram:
+    # 1 ms .. 10 s, ~26% wide bins
+    BIN_EDGES_SEC = np.geomspace(0.001, 10.0, 41)
+
+    def __init__(self) -> None:
+        # below the first edge, between the edges, above the last one
+        self._counts = np.zeros(len(self.BIN_EDGES_SEC) + 1, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self._counts[:] = 0
+        self._count = 0
+        self._max = 0.0
+
+    def add(self, value: float):
+        self._counts[np.searchsorted(self.BIN_EDGES_SEC, value, 'right')] += 1
+        self._count += 1
+        self._max = max(self._max, float(value))
+
+    def percentile(self, q: float) -> float:
+        if not self._count:
+            return 0.0
+
+        bin_i = int(np.searchsorted(np.cumsum(self._counts), q / 100.0 * self._count))
+        if bin_i >= len(self.BIN_EDGES_SEC):
+            return self._max
+        return min(float(self.BIN_EDGES_SEC[bin_i]), self._max)
+
+    def summary(self) -> TimingSummary:
+        if not self._count:
+            return TimingSummary.empty()
+
+        return TimingSummary(self._count, self.percentile(50), self.percentile(95), self._max)
+
+
+@dataclass
+class LatencySnapshot:
+    # by stage (GlassToGlassLatency.STAGES)
+    stages: Dict[str, TimingSummary]
+    glass_to_glass_sec: TimingSummary
+
+
+# Age of a frame along the video path, per camera. Every frame gives its
+#  wall clock timestamps at the stage boundaries (see STAGES), 0 or None
+#  if unknown; the processes share the host's clock.
+class GlassToGlassLatency:
+    STAGES = (
+        # decoded (Valkka timestamp) -> read from the shmem ring by the consumer
+        'decode_to_shmem',
+        # -> filter output written
+        'shmem_to_filter',
+        # -> copied by the GUI
+        'filter_to_gui',
+        # -> painted
+        'gui_to_paint',
+    )
+
+    def __init__(self) -> None:
+        self.stages = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.glass_to_glass = LatencyHistogram()
+
+    def reset(self):
+        for histogram in (*self.stages.values(), self.glass_to_glass):
+            histogram.reset()
+
+    # timestamps: len(STAGES) + 1 stage boundaries
+    def add(self, timestamps: Sequence[Optional[float]]):
+        assert len(timestamps) == len(self.STAGES) + 1
+
+        for stage, start, end in zip(self.STAGES, timestamps, timestamps[1:]):
+            if start and end:
+                # clock jitter between the processes
+                self.stages[stage].add(max(end - start, 0.0))
+
+        if timestamps[0] and timestamps[-1]:
+            self.glass_to_glass.add(max(timestamps[-1] - timestamps[0], 0.0))
+
+    def snapshot(self, reset: bool = False) -> LatencySnapshot:
+        snapshot = LatencySnapshot(
+            {stage: histogram.summary() for stage, histogram in self.stages.items()},
+            self.glass_to_glass.summary()
+        )
+
+        if reset:
+            self.reset()
+
+        return snapshot
+
+
+@dataclass
+class FilterStatsSnapshot:
+    filter_id: Any
+    calls: int
+    wall_sec: TimingSummary
+    cpu_sec: TimingSummary
+    output_shape: Optional[Tuple[int, ...]]
+    # bytes of newly allocated output images
+    allocated_bytes: int
+
+
+@dataclass
+class FrameStatsSnapshot:
+    frames: int
+    grab_sec: TimingSummary
+    tree_sec: TimingSummary
+    shmem_copy_sec: TimingSummary
+    end_to_end_sec: TimingSummary
+    # repeated frames, only the ticking branches processed them
+    duplicate_frames: int = 0
+    # decoded -> read by the consumer (source timestamp known)
+    source_latency_sec: TimingSummary = field(default_factory=TimingSummary.empty)
+    # input frames overwritten before the consumer read them
+    skipped_frames: int = 0
+    # the producer overwrote the frame held by the consumer (torn frame)
+    lease_overruns: int = 0
+
+
+@dataclass
+class ConsumerStatsSnapshot:
+    window_sec: float
+    frame: FrameStatsSnapshot
+    filters: Dict[Any, FilterStatsSnapshot]
+    # other components' counters (by name)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class FilterStats:
+    def __init__(self, filter_id: Any) -> None:
+        self.filter_id = filter_id
+
+        self.wall = TimingWindow()
+        self.cpu = TimingWindow()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.output_shape = None
+        self.allocated_bytes = 0
+
+        self.wall.reset()
+        self.cpu.reset()
+
+    def add(self, wall_sec: float, cpu_sec: float, output: Any, allocated: bool):
+        self.calls += 1
+        self.wall.add(wall_sec)
+        self.cpu.add(cpu_sec)
+
+        if isinstance(output, np.ndarray):
+            self.output_shape = output.shape
+
+            if allocated:
+                self.allocated_bytes += output.nbytes
+
+    def snapshot(self) -> FilterStatsSnapshot:
+        return FilterStatsSnapshot(
+            self.filter_id,
+            self.calls,
+            self.wall.summary(),
+            self.cpu.summary(),
+            self.output_shape,
+            self.allocated_bytes
+        )
+
+
+class ConsumerStats:
+    def __init__(self) -> None:
+        self._filters: Dict[Any, FilterStats] = {}
+
+        self.grab = TimingWindow()
+        self.tree = TimingWindow()
+        self.shmem_copy = TimingWindow()
+        self.end_to_end = TimingWindow()
+        self.source_latency = LatencyHistogram()
+
+        # shmem copy time accumulated in the current frame
+        self.frame_copy_sec = 0.0
+        # input's (skipped_frames, lease_overruns) totals at the window start
+        self._input_counters = (0, 0)
+
+        self.reset()
+
+    def reset(self):
+        self._window_start = time.perf_counter()
+        self.frames = 0
+        self.duplicate_frames = 0
+
+        for window in (self.grab, self.tree, self.shmem_copy, self.end_to_end, self.source_latency):
+            window.reset()
+
+        for filter_stats in self._filters.values():
+            filter_stats.reset()
+
+    def filter(self, filter_id: Any) -> FilterStats:
+        filter_stats = self._filters.get(filter_id)
+
+        if filter_stats is None:
+            filter_stats = self._filters[filter_id] = FilterStats(filter_id)
+
+        return filter_stats
+
+    def drop_filter(self, filter_id: Any):
+        self._filters.pop(filter_id, None)
+
+    def add_frame(self, grab_sec: float, tree_sec: float, end_to_end_sec: float):
+        self.frames += 1
+
+        self.grab.add(grab_sec)
+        self.tree.add(tree_sec)
+        self.shmem_copy.add(self.frame_copy_sec)
+        self.end_to_end.add(end_to_end_sec)
+
+        self.frame_copy_sec = 0.0
+
+    # input_counters: input's (skipped_frames, lease_overruns) totals
+    def snapshot(self, reset: bool = True, input_counters: Tuple[int, int] = (0, 0)) -> ConsumerStatsSnapshot:
+        skipped_frames, lease_overruns = (now - start for now, start in zip(input_counters, self._input_counters))
+
+        snapshot = ConsumerStatsSnapshot(
+            window_sec=time.perf_counter() - self._window_start,
+            frame=FrameStatsSnapshot(
+                self.frames,
+                self.grab.summary(),
+                self.tree.summary(),
+                self.shmem_copy.summary(),
+                self.end_to_end.summary(),
+                self.duplicate_frames,
+                self.source_latency.summary(),
+                skipped_frames,
+                lease_overruns
+            ),
+            filters={filter_id: filter_stats.snapshot()
+                     for filter_id, filter_stats in self._filters.items()}
+        )
+
+        if reset:
+            self.reset()
+            self._input_counters = tuple(input_counters)
+
+        return snapshot
@@ -0,0 +1,208 @@
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Optional, Tuple
+import threading
+
+import numpy as np
+
+from video_backend.profiling import TimingSummary, TimingWindow
+
+
+class QueuePolicy(Enum):
+    # the filter branch waits for the writer
+    BLOCK = 'block'
+    # the writer always gets the most recent frames
+    DROP_OLDEST = 'drop_oldest'
+    # the queued frames are kept, the new ones are dropped except every n-th
+    DROP_NEWEST = 'drop_newest'
+
+
+@dataclass
+class RecorderStatsSnapshot:
+    queue_depth: int
+    max_queue_depth: int
+    write_sec: TimingSummary
+    written_frames: int
+    dropped_frames: int
+    bytes_written: int
+    falling_behind: bool
+    preroll_frames: int = 0
+    preroll_bytes: int = 0
+
+
+# Bounded frame queue between the filter tree and the writer thread
+# The frames are converted into recycled buffers (maxsize of them):
+#  acquire() a free buffer, fill it and put() it, the writer get()s the
+#  buffer and release()s it after writing.
+# No buffer is allocated above maxsize (+ headroom while the writer is
+#  busy with the pre-roll), the policy decides what to do instead.
+class RecorderQueue:
+    # ~100 MB of 1080p BGR frames
+    DEFAULT_MAXSIZE = 16
+    # falling behind above HIGH_WATERMARK * maxsize (or when dropping),
+    #  recovered below LOW_WATERMARK * maxsize
+    HIGH_WATERMARK = 0.75
+    LOW_WATERMARK = 0.25
+    # BLOCK drops anyway when the writer is stuck
+    BLOCK_TIMEOUT_SEC = 1.0
+
+    def __init__(self,
+                 maxsize: int = DEFAULT_MAXSIZE,
+                 policy: QueuePolicy = QueuePolicy.DROP_OLDEST,
+                 drop_spacing: int = 5) -> None:
+        assert maxsize > 0 and drop_spacing > 0
+
+        self.maxsize = maxsize
+        self.policy = policy
+        # DROP_NEWEST: one of drop_spacing frames replaces the newest queued one
+        #  when full, so the recording does not freeze for seconds
+        self.drop_spacing = drop_spacing
+
+        self._queue = deque()
+        self._free = []
+        self._buffer_spec = None
+        # buffers of the current spec, free or in use
+        self._allocated = 0
+        # extra buffers allowed above maxsize
+        self._headroom = 0
+        self._condition = threading.Condition()
+        self._dropped_run = 0
+        self._dropped_since_check = False
+
+        self.falling_behind = False
+        self.write_sec = TimingWindow()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.max_queue_depth = len(self._queue)
+        self.written_frames = 0
+        self.dropped_frames = 0
+        self.write_sec.reset()
+
+    def qsize(self) -> int:
+        return len(self._queue)
+
+    # return a writable buffer, None when the frame has to be dropped
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8) -> Optional[np.ndarray]:
+        spec = (tuple(shape), np.dtype(dtype))
+
+        with self._condition:
+            if spec != self._buffer_spec:
+                # the buffers in use are dropped on release
+                self._buffer_spec = spec
+                self._free = []
+                self._allocated = 0
+
+            if self._free:
+                return self._free.pop()
+
+            if self._allocated < self.maxsize + self._headroom:
+                self._allocated += 1
+                return np.empty(*spec)
+
+            if self.policy is QueuePolicy.BLOCK:
+                has_free = self._condition.wait_for(lambda: self._free, self.BLOCK_TIMEOUT_SEC)
+                if has_free:
+                    return self._free.pop()
+                return self._drop()
+
+            if self.policy is QueuePolicy.DROP_NEWEST:
+                self._dropped_run += 1
+                if self._dropped_run < self.drop_spacing:
+                    return self._drop()
+
+            # reuse a queued frame's buffer (markers are kept)
+            frame_indices = [i for i, item in enumerate(self._queue) if isinstance(item, np.ndarray)]
+            if not frame_indices:
+                # every buffer is at the writer
+                return self._drop()
+
+            self.dropped_frames += 1
+            self._dropped_since_check = True
+
+            steal_i = frame_indices[0] if self.policy is QueuePolicy.DROP_OLDEST else frame_indices[-1]
+            stolen = self._queue[steal_i]
+            del self._queue[steal_i]
+
+            if (stolen.shape, stolen.dtype) != spec:
+                return np.empty(*spec)
+            return stolen
+
+    def put(self, buffer: np.ndarray):
+        with self._condition:
+            self._dropped_run = 0
+            self._queue.append(buffer)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+
+            self._condition.notify_all()
+
+    def release(self, buffer: np.ndarray):
+        with self._condition:
+            if (buffer.shape, buffer.dtype) != self._buffer_spec:
+                return
+
+            # the headroom buffers are freed after use
+            if self._allocated > self.maxsize + self._headroom:
+                self._allocated -= 1
+                return
+
+            self._free.append(buffer)
+            self._condition.notify_all()
+
+    # the writer is busy with other work (pre-roll), the new frames are kept
+    #  in up to headroom extra buffers meanwhile
+    def set_headroom(self, headroom: int):
+        with self._condition:
+            self._headroom = headroom
+
+    # buffers available without dropping a frame
+    def spare_buffers(self) -> int:
+        with self._condition:
+            return len(self._free) + max(self.maxsize + self._headroom - self._allocated, 0)
+
+    # markers for the writer (not frames), never dropped
+    def put_final(self, item: Any):
+        with self._condition:
+            self._queue.append(item)
+            self._condition.notify_all()
+
+    def get(self) -> Any:
+        with self._condition:
+            self._condition.wait_for(lambda: self._queue)
+            return self._queue.popleft()
+
+    def _drop(self) -> None:
+        self.dropped_frames += 1
+        self._dropped_since_check = True
+        return None
+
+    # return True when the state changed
+    def update_health(self) -> bool:
+        depth = len(self._queue)
+
+        if not self.falling_behind:
+            behind = depth >= self.HIGH_WATERMARK * self.maxsize or self._dropped_since_check
+        else:
+            behind = depth > self.LOW_WATERMARK * self.maxsize
+        self._dropped_since_check = False
+
+        changed = behind != self.falling_behind
+        self.falling_behind = behind
+        return changed
+
+    def snapshot(self, bytes_written: int, reset: bool = True) -> RecorderStatsSnapshot:
+        snapshot = RecorderStatsSnapshot(
+            len(self._queue),
+            self.max_queue_depth,
+            self.write_sec.summary(),
+            self.written_frames,
+            self.dropped_frames,
+            bytes_written,
+            self.falling_behind
+        )
+
+        if reset:
+            self.reset_stats()
+
+        return snapshot
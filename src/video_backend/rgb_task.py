@@ -20,9 +20,14 @@ from backend_context import ProcessBoundTask, BackendProcessContext, BackendProc
 
 from IFrameProcessAdapter import IFrameProcessAdapter
 
-from video_backend.consumer import Consumer, RGBSharedMemoryImage, RecorderControl
+from video_backend.consumer import Consumer, RGBSharedMemoryImage, RGBSharedMemoryPyramid, RecorderControl, BatchFilter, SharedResultFilter, RecorderMode, PassthroughTriggerControl
 
-from video_backend.processing.register_bgr_transform import get_bgr_transform, list_bgr_transforms
+from video_backend.processing.register_bgr_transform import get_bgr_transform, list_bgr_transforms, get_batch_spec, is_stateful_transform, is_shareable_transform
+from video_backend.profiling import ConsumerStatsSnapshot
+from video_backend.load_shedding import BranchPriority
+from video_backend.recorder_queue import RecorderQueue, QueuePolicy
+from video_backend.preroll import PreRollBuffer
+from video_backend.encoder_farm import EncoderFarmSpec
 
 from backend_context import PropertyObserverTask
 
@@ -38,6 +43,8 @@ CommandType = signalling.Command.ParameterType
 
 # Patch
 import video_backend.processing.preview
+import video_backend.processing.temporal_average
+from video_backend.processing.motion_detection import MotionDetection
 
 @dataclass
 class Filename:
@@ -168,6 +175,19 @@ class FilterControlBase(generic_resource.ControlTask):
         #     '.'.join([self.IMPORTED_MODULE_BASE, self.module_name]))
 
         filter_cb = get_bgr_transform(self.filter)
+        
+        if is_stateful_transform(filter_cb):
+            filter_cb = filter_cb()
+        filter_instance = filter_cb
+        
+        batch_spec = get_batch_spec(filter_cb)
+        if batch_spec is not None:
+            # every filter instance collects its own frames
+            filter_cb = BatchFilter(filter_cb, batch_spec)
+        else:
+            # identical siblings share the result
+            filter_cb = SharedResultFilter(filter_cb, process.backend__shared_results)
+        
         filter_search = process.backend__filter_tree.get_filter_by_id(
             self.filter_id)
 
@@ -182,7 +202,12 @@ class FilterControlBase(generic_resource.ControlTask):
                 {
                     'filter': self.filter,
                     'filter_obj': filter_cb,
-                    'filter_parameters': self.filter_run_parameters or {}
+                    # the transform (instance) without the wrappers
+                    'filter_instance': filter_instance,
+                    'filter_parameters': self.filter_run_parameters or {},
+                    'filter_shareable': batch_spec is None and is_shareable_transform(filter_instance),
+                    'priority': self.priority,
+                    'tick_on_duplicate': self.tick_on_duplicate or getattr(filter_instance, 'tick_on_duplicate', False)
                 }
             )
 
@@ -203,6 +228,7 @@ class FilterControlBase(generic_resource.ControlTask):
 
         if filter_search:
             process.backend__filter_tree.delete_filter(self.filter_id)
+            process.backend__stats.drop_filter(self.filter_id)
             return True
         return False
 
@@ -220,6 +246,10 @@ class Filter_Create(CreateCommand, FilterControlBase, ReceiverDerivativeControl)
     module_name: str = CommandField(CommandType.REQUIRED)
     filter_run_parameters: Optional[Dict[str, Any]
                                     ] = CommandField(CommandType.REQUIRED, default=None)
+    # the branch is shed by this priority when the consumer is overloaded
+    priority: BranchPriority = CommandField(CommandType.OPTIONAL, default=BranchPriority.PREVIEW)
+    # run on repeated input frames too (e.g. fixed fps output), a transform can require it
+    tick_on_duplicate: bool = CommandField(CommandType.OPTIONAL, default=False)
     
     @classmethod
     def available_filters(cls) -> Sequence[Any]:
@@ -328,9 +358,52 @@ class FilterTerminal_Delete(DeleteCommand, FilterTerminalControlBase, ReceiverDe
 
 
 
+# Filter output in several resolutions, computed once per frame
+#  into one segment; the Start reply is an RGBSharedMemoryPyramid
+class PyramidTerminalControlBase(FilterTerminalControlBase):
+    def allocate(self, context: BackendProcessContext) -> ResultVector:
+        process: Consumer = self.backend__process
+        process.backend__request_filter_output(self.filter_id, self.pyramid_scales)
+
+        return True
+
+
+@dataclass
+class PyramidTerminal_Create(CreateCommand, PyramidTerminalControlBase, ReceiverDerivativeControl):
+    filter_id: Any = CommandField(CommandType.REQUIRED)
+    # relative to the filter's output, in decreasing order, e.g. [1.0, 0.5, 0.25]
+    pyramid_scales: List[float] = CommandField(CommandType.REQUIRED)
+
+
+@dataclass
+class PyramidTerminal_Start(StartCommand, PyramidTerminalControlBase, ReceiverDerivativeControl):
+    filter_id: Any = CommandField(CommandType.INHERITED)
+    
+    def task_completed(self, reply, reply_history: List[Any]) -> bool:
+        if not len(reply_history):
+            return False
+
+        basic_check = (isinstance(reply_history[0], (Result, DelayedResult))
+                       and reply_history[0].status == generic_resource.Status.OK)
+        has_pyramid = isinstance(reply, RGBSharedMemoryPyramid)
+        return basic_check and has_pyramid
+
+
+@dataclass
+class PyramidTerminal_Stop(StopCommand, PyramidTerminalControlBase, ReceiverDerivativeControl):
+    filter_id: Any = CommandField(CommandType.INHERITED)
+    shmem_image: RGBSharedMemoryPyramid = CommandField(CommandType.REQUIRED)
+
+
+@dataclass
+class PyramidTerminal_Delete(DeleteCommand, PyramidTerminalControlBase, ReceiverDerivativeControl):
+    filter_id: Any = CommandField(CommandType.INHERITED)
+    shmem_image: RGBSharedMemoryPyramid = CommandField(CommandType.INHERITED)
+
+
 class RecorderControlBase(generic_resource.ControlTask):
     @property
-    def control(self) -> RecorderControl:
+    def control(self) -> Union[RecorderControl, PassthroughTriggerControl]:
         context = self.backend__process.context
         return context[RecorderControlBase][self.input_filter_id]
 
@@ -338,8 +411,29 @@ class RecorderControlBase(generic_resource.ControlTask):
         self.backend__process: Consumer
         context.setdefault(RecorderControlBase, {})
 
+        # no frames needed, the receiver process records
+        if self.recording_mode == RecorderMode.PASSTHROUGH:
+            context[RecorderControlBase][self.input_filter_id] = PassthroughTriggerControl(
+                self.recording_dir,
+                self.recording_basename
+            )
+            return True
+
         print('TEMPP')
-        recorder = RecorderControl(self.fps, self.recording_dir)
+        recorder = RecorderControl(
+            self.fps,
+            self.recording_dir,
+            queue_size=self.queue_size,
+            queue_policy=self.queue_policy,
+            drop_spacing=self.drop_spacing,
+            preroll_sec=self.preroll_sec,
+            postroll_sec=self.postroll_sec,
+            preroll_budget=self.preroll_budget,
+            segment_duration_sec=self.segment_duration_sec,
+            segment_max_bytes=self.segment_max_bytes,
+            encoder_farm=self.encoder_farm,
+            stream_id=(os.getpid(), self.input_filter_id)
+        )
         recorder.recording_dir = self.recording_dir
         recorder.recording_basename = self.recording_basename
 
@@ -358,6 +452,7 @@ class RecorderControlBase(generic_resource.ControlTask):
         return True
 
     def delete(self, context: BackendProcessContext) -> ResultVector:
+        self.control.close()
         del context[RecorderControlBase][self.input_filter_id]
         return True
 
@@ -372,6 +467,22 @@ class Recorder_Create(CreateCommand, RecorderControlBase, ReceiverDerivativeCont
     fps: int = CommandField(CommandType.REQUIRED)
     recording_dir: Optional[str] = CommandField(CommandType.REQUIRED)
     recording_basename: str = CommandField(CommandType.REQUIRED, default='video')
+    # frames waiting for the writer, see RecorderQueue
+    queue_size: int = CommandField(CommandType.OPTIONAL, default=RecorderQueue.DEFAULT_MAXSIZE)
+    queue_policy: QueuePolicy = CommandField(CommandType.OPTIONAL, default=QueuePolicy.DROP_OLDEST)
+    drop_spacing: int = CommandField(CommandType.OPTIONAL, default=5)
+    # kept before the trigger (JPEG compressed, within preroll_budget bytes)
+    #  and recorded after the stop
+    preroll_sec: float = CommandField(CommandType.OPTIONAL, default=0.0)
+    postroll_sec: float = CommandField(CommandType.OPTIONAL, default=0.0)
+    preroll_budget: int = CommandField(CommandType.OPTIONAL, default=PreRollBuffer.DEFAULT_MEMORY_BUDGET)
+    # split long recordings (0 = no limit)
+    segment_duration_sec: float = CommandField(CommandType.OPTIONAL, default=0.0)
+    segment_max_bytes: int = CommandField(CommandType.OPTIONAL, default=0)
+    # encode in the farm's worker processes instead of the consumer
+    encoder_farm: Optional[EncoderFarmSpec] = CommandField(CommandType.OPTIONAL, default=None)
+    # PASSTHROUGH: the options above are not used, see PassthroughTriggerControl
+    recording_mode: RecorderMode = CommandField(CommandType.OPTIONAL, default=RecorderMode.DECODED)
 
 
 @dataclass
@@ -401,7 +512,7 @@ class RecorderRemoteControlBase(generic_resource.ControlTask):
         return base[self.input_filter_id].recording_status
     
     @property
-    def recorder_control(self) -> RecorderControl:
+    def recorder_control(self) -> Union[RecorderControl, PassthroughTriggerControl]:
         context = self.backend__process.context
         return context[RecorderControlBase][self.input_filter_id]
     
@@ -465,16 +576,23 @@ class RecorderRemoteControlBase(generic_resource.ControlTask):
             record.finished = False
 
             
-            record.filepath = os.path.join(
-                str(self.recorder_control.recording_dir),
-                str(self.generate_filename(change))
+            record.filepath = self.backend__recording_filepath(change)
+            # the segments of a long recording are named the same way
+            self.recorder_control.activate(
+                record.filepath,
+                functools.partial(self.backend__recording_filepath, change)
             )
-            self.recorder_control.activate(record.filepath)
         else:
             self.recorder_control.deactivate()
 
             record.finished = True
 
+    def backend__recording_filepath(self, change: Any) -> str:
+        return os.path.join(
+            str(self.recorder_control.recording_dir),
+            str(self.generate_filename(change))
+        )
+
     @property
     def property_id(self) -> Any:
         return self.backend__current_recording.property_id
@@ -542,6 +660,80 @@ class RecorderRemote_Delete(DeleteCommand, RecorderRemoteControlBase, ReceiverDe
     input_filter_id: Any = CommandField(CommandType.INHERITED)
 
 
+# Drives a RecorderRemote from a MotionDetection filter, like an external event
+class MotionTriggerControlBase(generic_resource.ControlTask):
+    @property
+    def backend__detector(self) -> MotionDetection:
+        process: Consumer = self.backend__process
+        filter_search = process.backend__filter_tree.get_filter_by_id(self.filter_id)
+
+        if not filter_search:
+            raise LookupError(f"Filter {self.filter_id} not found")
+        return filter_search['filter_obj']['filter_instance']
+
+    def allocate(self, context: BackendProcessContext) -> ResultVector:
+        if not isinstance(self.backend__detector, MotionDetection):
+            raise TypeError(f"Filter {self.filter_id} is not a motion detection")
+
+        context.setdefault(MotionTriggerControlBase, {})[self.filter_id] = self.recorder_input_filter_id
+        return True
+
+    def start(self, context: BackendProcessContext) -> ResultVector:
+        recorder_input_filter_id = context[MotionTriggerControlBase][self.filter_id]
+        channel: notifier.UpdateChannel = context[RecorderRemoteControlBase][recorder_input_filter_id].activation_channel
+
+        def motion_changed(motion: bool, motion_score: float):
+            channel.send(notifier.Update(
+                key=MotionTriggerControlBase,
+                value=motion
+            ))
+
+        detector = self.backend__detector
+        detector.motion_changed = motion_changed
+        if detector.motion:
+            motion_changed(True, detector.motion_score)
+        return True
+
+    def stop(self, context: BackendProcessContext) -> ResultVector:
+        detector = self.backend__detector
+
+        if detector.motion_changed is not None and detector.motion:
+            detector.motion_changed(False, detector.motion_score)
+        detector.motion_changed = None
+        return True
+
+    def delete(self, context: BackendProcessContext) -> ResultVector:
+        del context[MotionTriggerControlBase][self.filter_id]
+        return True
+
+    @property
+    def backend__resource_id(self) -> Any:
+        return tuple([MotionTriggerControlBase, self.filter_id])
+
+
+@dataclass
+class MotionTrigger_Create(CreateCommand, MotionTriggerControlBase, ReceiverDerivativeControl):
+    # MotionDetection filter
+    filter_id: Any = CommandField(CommandType.REQUIRED)
+    # RecorderRemote's input_filter_id
+    recorder_input_filter_id: Any = CommandField(CommandType.REQUIRED)
+
+
+@dataclass
+class MotionTrigger_Start(StartCommand, MotionTriggerControlBase, ReceiverDerivativeControl):
+    filter_id: Any = CommandField(CommandType.INHERITED)
+
+
+@dataclass
+class MotionTrigger_Stop(StopCommand, MotionTriggerControlBase, ReceiverDerivativeControl):
+    filter_id: Any = CommandField(CommandType.INHERITED)
+
+
+@dataclass
+class MotionTrigger_Delete(DeleteCommand, MotionTriggerControlBase, ReceiverDerivativeControl):
+    filter_id: Any = CommandField(CommandType.INHERITED)
+
+
 @dataclass
 class FilterParameterChangeCommand(backend_context.BackendTask, signalling.Command):
     filter_id: Any = CommandField(CommandType.REQUIRED)
@@ -575,3 +767,70 @@ class FilterParameterChangeCommand(backend_context.BackendTask, signalling.Comma
     def create_process(self) -> Consumer:
         raise RuntimeError
     
+
+
+# Repeated input frames skip the filter tree except the ticking branches
+@dataclass
+class DuplicateFrameSettingsCommand(backend_context.BackendTask, signalling.Command):
+    target_resource_id: Any = CommandField(CommandType.REQUIRED)
+    enabled: bool = CommandField(CommandType.OPTIONAL, default=True)
+    # max mean absolute difference of the subsampled frames, 0 = identical
+    tolerance: float = CommandField(CommandType.OPTIONAL, default=0.0)
+
+    def command(self) -> signalling.Tag:
+        return signalling.Tag('process', 'duplicate_frame_settings')
+
+    def task_completed(self, reply, reply_history: List[Any]) -> bool:
+        return reply
+
+    def run(self, control: backend_context.ReplyControl, process: Consumer) -> Any:
+        assert isinstance(process, Consumer)
+
+        detector = process.backend__duplicate_detector
+        detector.enabled = self.enabled
+        detector.tolerance = self.tolerance
+        detector.reset()
+
+        control.reply_to_message = True
+        return True
+
+    def create_process(self) -> Consumer:
+        raise RuntimeError
+
+
+# Returns the Consumer's profiling counters and starts a new window
+@dataclass
+class ConsumerStatsCommand(backend_context.BackendTask, signalling.Command):
+    target_resource_id: Any = CommandField(CommandType.REQUIRED)
+    reset_window: bool = CommandField(CommandType.OPTIONAL, default=True)
+    
+    def command(self) -> signalling.Tag:
+        return signalling.Tag('process', 'consumer_stats')
+
+    def task_completed(self, reply, reply_history: List[Any]) -> bool:
+        return isinstance(reply, ConsumerStatsSnapshot)
+
+    def run(self, control: backend_context.ReplyControl, process: Consumer) -> Any:
+        assert isinstance(process, Consumer)
+        
+        control.reply_to_message = True
+        
+        # RGBAdapter counts the frames lost in the shmem ring
+        input_counters = (getattr(process.adapter, 'skipped_frames', 0),
+                          getattr(process.adapter, 'lease_overruns', 0))
+        snapshot = process.backend__stats.snapshot(self.reset_window, input_counters)
+        snapshot.extra['load_shedding'] = process.backend__load_shedder.snapshot(self.reset_window)
+        snapshot.extra['motion_scores'] = {
+            match['object']['filter_id']: match['object']['filter_instance'].motion_score
+            for match in process.backend__filter_tree.list_matching_filters()
+            if isinstance(match['object'].get('filter_instance'), MotionDetection)
+        }
+        snapshot.extra['recorders'] = {
+            input_filter_id: recorder.snapshot(self.reset_window)
+            for input_filter_id, recorder in process.context.get(RecorderControlBase, {}).items()
+            if isinstance(recorder, RecorderControl)
+        }
+        return snapshot
+    
+    def create_process(self) -> Consumer:
+        raise RuntimeError
@@ -0,0 +1,83 @@
+import resource
+import sys
+import time
+
+from video_backend.profiling import LatencyHistogram
+from video_backend.rtsp.filterchain import DecoderSpec, RTSPStreamSpec, RGBDecodingTerminal, RGBDecodingTerminalComponents, RGBAdapter
+
+# Decoder settings compared on the same (local) stream: CPU time of the
+#  process (LiveThread + AVThread + swscale) and the decoded frames' age
+#  when they are read from the shmem ring.
+#
+# python -m video_backend.rtsp.decoder_benchmark <rtsp url> [seconds per setting] [width height]
+
+SETTINGS = [
+    dict(n_threads=1, fifo_basic=20),
+    dict(n_threads=2, fifo_basic=20),
+    dict(n_threads=4, fifo_basic=20),
+    dict(n_threads=1, fifo_basic=5),
+    dict(n_threads=1, fifo_basic=5, flush_when_full=True),
+    dict(n_threads=4, fifo_basic=5, flush_when_full=True),
+]
+
+
+def _cpu_sec() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_setting(index: int, stream_url: str, duration_sec: float, width: int, height: int, **decoder_options):
+    name = f"bench{index}"
+
+    source = RTSPStreamSpec(f"{name}_fork", f"{name}_livethread", index + 1, stream_url, 1000).create()
+    decoder = DecoderSpec(f"{name}_decoder_fork", f"{name}_decoder", f"{name}_avthread", **decoder_options).create()
+    source.root_fork.connect(f"{name}_decoder_input", decoder.input_framefilter)
+
+    terminal = RGBDecodingTerminal(RGBDecodingTerminalComponents(
+        f"{name}_terminal", f"{name}_shmem", 10, width, height, 1000, decoder.output_fork
+    ))
+    adapter = RGBAdapter(terminal.add_output('bench'))
+
+    decoder.start_decoder_thread(True)
+    source.start()
+    adapter.backend__input__setup()
+
+    latency = LatencyHistogram()
+    frames = 0
+
+    # skip the stream setup
+    deadline = time.monotonic() + 2.0
+    while time.monotonic() < deadline:
+        adapter.backend__input__grab_frame()
+
+    cpu_start, start = _cpu_sec(), time.monotonic()
+    while time.monotonic() - start < duration_sec:
+        ok, _, metadata = adapter.backend__input__grab_frame()
+        if not ok:
+            continue
+
+        frames += 1
+        if metadata.mstimestamp:
+            latency.add(max(metadata.received_timestamp - metadata.timestamp_sec, 0.0))
+        adapter.backend__input__release_frame(metadata)
+    cpu_sec, wall_sec = _cpu_sec() - cpu_start, time.monotonic() - start
+
+    adapter.backend__input__cleanup()
+    source.stop()
+    decoder.kill_decoder()
+
+    summary = latency.summary()
+    print(f"{str(decoder_options):60} {frames / wall_sec:6.1f} fps"
+          f" {100 * cpu_sec / wall_sec:6.1f} % CPU"
+          f" latency p50 {summary.p50 * 1000:6.1f} ms p95 {summary.p95 * 1000:6.1f} ms"
+          f" skipped {adapter.skipped_frames}")
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    stream_url = sys.argv[1]
+    duration_sec = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    width, height = map(int, sys.argv[3:5]) if len(sys.argv) > 4 else (1920, 1080)
+
+    for i, options in enumerate(SETTINGS):
+        run_setting(i, stream_url, duration_sec, width, height, **options)
@@ -5,23 +5,32 @@ from typing import List, Tuple, Optional
 from functools import cache, partial
 import numpy as np
 from dataclasses import dataclass
-from multiprocessing import Process
+from multiprocessing import Process, current_process, reduction
+from multiprocessing.connection import Listener, Client
+import os
 import socket
+import threading
 import time
 
 from valkka.core import ForkFrameFilterN, LiveConnectionContext
 from valkka.core import LiveConnectionContext, LiveConnectionType_rtsp
 from valkka.core import LiveOutboundContext, LiveConnectionType_sdp
 from valkka.core import LiveThread, AVThread
-from valkka.core import FrameFilter
+from valkka.core import FrameFilter, EventFd
 from valkka.core import RGBShmemFrameFilter, SwScaleFrameFilter, TimeIntervalFrameFilter, setLiveOutPacketBuffermaxSize
+from valkka.core import FragMP4MuxFrameFilter, FragMP4ShmemFrameFilter
 
-from valkka.api2 import ShmemRGBClient
+from valkka.api2 import ShmemRGBClient, FragMP4ShmemClient
 from valkka.core import ValkkaFSWriterThread, FrameFifoContext
+from valkka.core import FileThread, FileContext, FileState_error
 from valkka.fs import ValkkaSingleFS, ValkkaFSLoadError
 
+import messenger
 from IFrameProcessAdapter import IFrameProcessAdapter
+from video_backend.processing.RGBFilterInput import FrameMetadata
 from video_backend.rtsp.pipeline.Middleware import Middleware
+from video_backend.rtsp.passthrough import PassthroughRecorderControl
+from video_backend.playback import PlaybackMode, list_playback_files
 
 from valkka.fs import ValkkaSingleFS, ValkkaFSLoadError
 from valkka.api2 import ValkkaFSManager
@@ -32,12 +41,36 @@ run_once = cache
 # WARNING: every Valkka object has to be linked somewhere else the GC will free up
 # TODO: deregister context?
 
+class DecodeMode(Enum):
+    # every frame
+    FULL = 'full'
+    # monitor profile: the decoder is switched on once per interval until
+    #  its first decoded frame (a keyframe), the compressed frames in
+    #  between are dropped at its input
+    KEYFRAMES = 'keyframes'
+
+
 @dataclass
 class DecoderSpec:
     child_fork_name: str
     decoder_name: str
     avthread_name: str
     #slot_id: int
+    # libavcodec threads, more for 4K streams
+    n_threads: int = 1
+    # input FIFO of the decoder thread (FrameFifoContext):
+    #  compressed frames, stream setup frames and signals
+    fifo_basic: int = 20
+    fifo_setup: int = 20
+    fifo_signal: int = 20
+    # a full FIFO is flushed (else the incoming frames are dropped)
+    flush_when_full: bool = False
+    decode_mode: DecodeMode = DecodeMode.FULL
+    # KEYFRAMES: a decoded frame per interval, the decoder is switched off
+    #  after it or after keyframe_window_ms without a frame (longer than the
+    #  camera's GOP, the first keyframe is waited for)
+    keyframe_interval_sec: float = 2.0
+    keyframe_window_ms: int = 5000
     
     def create(self): # -> FilterchainDecoder
         return FilterchainDecoder(self)
@@ -58,8 +91,46 @@ class RGBProcessLink:
     height: int
     frame_interval_ms: int
     con_timeout_ms: int
-    # sync_fd: any
-# ENHANCEMENT: use sync_fd instead of time.sleep
+    # where the shmem filter's eventfd can be fetched from (see SyncFdPublisher)
+    sync_fd_address: Optional[str] = None
+
+
+# File descriptors are not picklable, so the eventfd of the shmem filter
+#  is handed over to the consumer process through an AF_UNIX socket (SCM_RIGHTS)
+class SyncFdPublisher:
+    def __init__(self, sync_fd: EventFd) -> None:
+        self._sync_fd = sync_fd
+
+        self._listener = Listener(family='AF_UNIX',
+                                  authkey=current_process().authkey)
+
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def address(self) -> str:
+        return self._listener.address
+
+    def close(self):
+        self._listener.close()
+
+    # return a new file descriptor owned by the caller
+    @staticmethod
+    def fetch(address: str) -> int:
+        with Client(address, family='AF_UNIX', authkey=current_process().authkey) as con:
+            return reduction.recv_handle(con)
+
+    def _serve(self):
+        while True:
+            try:
+                con = self._listener.accept()
+            except OSError:
+                # listener closed
+                return
+
+            with con:
+                reduction.send_handle(con, self._sync_fd.getFd(), None)
 
 @dataclass
 class _RGBDecodingTerminalNeccessaryOptions:
@@ -87,7 +158,11 @@ class RGBDecodingTerminalComponents(_RGBDecodingTerminalNeccessaryOptions):
     sync_fd = None
     middleware: Middleware = None
 
+# Frames are leased zero-copy from the Valkka ring: the slot is held until
+#  the consumer's filter tree releases it. The producer does not wait for
+#  the consumer, the ring has LEASED_SLOTS extra cells for the held frame.
 class RGBAdapter(IFrameProcessAdapter):
+    LEASED_SLOTS = 1
 
     @property
     def link(self):
@@ -103,15 +178,27 @@ class RGBAdapter(IFrameProcessAdapter):
     def height(self) -> int:
         return self._height
 
+    @property
+    def frame_interval_ms(self) -> Optional[int]:
+        return self._link.frame_interval_ms
+
     def __init__(self, link) -> None:
         assert isinstance(
             link, RGBProcessLink)
 
         self._link = link
         self._initialized = False
+        self._sync_fd = None
 
         self._width, self._height = 0, 0
 
+        self._lease: Optional[FrameMetadata] = None
+        self._last_slot = None
+        # frames the consumer did not get (the producer went round)
+        self.skipped_frames = 0
+        # the leased slot was probably overwritten while in use
+        self.lease_overruns = 0
+
     # implemented by the input block
     def backend__input__setup(self):
         if self._initialized:
@@ -132,6 +219,9 @@ class RGBAdapter(IFrameProcessAdapter):
         self._cached_indices = deque([], ringbuffer_size)
         self._cache_is_empty = True
 
+        if lattr('sync_fd_address') is not None:
+            self._sync_fd = SyncFdPublisher.fetch(lattr('sync_fd_address'))
+
         self._initialized = True
 
     # implemented by the input block
@@ -141,12 +231,11 @@ class RGBAdapter(IFrameProcessAdapter):
 
         del self._client
 
-        self._initialized = False
+        if self._sync_fd is not None:
+            os.close(self._sync_fd)
+            self._sync_fd = None
 
-    def backend__wait_one_frame_interval(self):
-        # time.sleep(self._link.frame_interval_ms / 1000.0)
-        # wait_frame = not self.backend__input__is_ready(False)
-        pass
+        self._initialized = False
 
     # implemented by the input block
     # WARNING: no check on '_initialized' for performance reasons
@@ -166,7 +255,7 @@ class RGBAdapter(IFrameProcessAdapter):
 
         shmem_index, metadata = None, None
         if not new_frame_required:
-            shmem_index, metadata = self._cached_indices.popleft()
+            shmem_index, metadata, received = self._cached_indices.popleft()
             self._cache_is_empty = not len(self._cached_indices)
 
         if invalidate_cache:
@@ -174,21 +263,17 @@ class RGBAdapter(IFrameProcessAdapter):
             self._cache_is_empty = True
 
         if new_frame_required:
+            # pullFrame waits up to con_timeout_ms
             shmem_index, metadata = self._client.pullFrame()
+            received = time.time()
 
             if shmem_index is None:
-                # Image not yet available
-                # Waiting..
-                self.backend__wait_one_frame_interval()
+                return False, None, None
 
-                shmem_index, metadata = self._client.pullFrame()
-
-                # Last chance
-                if shmem_index is None:
-                    return False, None, None
+            self._count_skipped(shmem_index)
 
             if cache_new_frame_descriptor:
-                self._cached_indices.append((shmem_index, metadata))
+                self._cached_indices.append((shmem_index, metadata, received))
                 self._cache_is_empty = False
 
         img_data = self._client.shmem_list[shmem_index][0:metadata.size]
@@ -198,7 +283,34 @@ class RGBAdapter(IFrameProcessAdapter):
         # set params
         self._width, self._height = metadata.width, metadata.height
 
-        return True, img, metadata
+        # a frame not released is given up
+        self._lease = FrameMetadata(
+            mstimestamp=metadata.mstimestamp,
+            width=metadata.width,
+            height=metadata.height,
+            slot=shmem_index,
+            size=metadata.size,
+            received_timestamp=received
+        )
+
+        return True, img, self._lease
+
+    def backend__input__release_frame(self, metadata: FrameMetadata):
+        if metadata is self._lease:
+            self._lease = None
+
+    def _count_skipped(self, slot: int):
+        ring_size = self._link.shmem_buffer_size
+
+        if self._last_slot is not None:
+            skipped = (slot - self._last_slot - 1) % ring_size
+            self.skipped_frames += skipped
+
+            # the producer got to the slot we held
+            if skipped >= ring_size - self.LEASED_SLOTS:
+                self.lease_overruns += 1
+
+        self._last_slot = slot
 
     # implemented by the input block
     def backend__input__is_ready(self, ignore_cache: bool) -> bool:
@@ -209,14 +321,28 @@ class RGBAdapter(IFrameProcessAdapter):
 
         return is_ready
 
+    # implemented by the input block
+    def backend__input__sync_fd(self) -> Optional[int]:
+        return self._sync_fd
+
 
+# One output of a decoder: scaling (and rate limiting) into a shmem ring,
+#  a decoder may feed several terminals (different sizes/rates) from its fork
 class RGBDecodingTerminal:
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
     def __init__(self, terminal_data: RGBDecodingTerminalComponents) -> None:
         data = self._terminal_data = terminal_data
 
         self.middleware = None
         self.__middleware_framefilter_storage = []
 
+        self._output_tag = None
+        self._decoding_chain_input = None
+        self._connected = False
+
         # assert isinstance(fixed_fps, int) or sync_fd is not None
         
         swscale_filter_name = data.avthread_fork_filter_basename + '_swscale'
@@ -256,18 +382,26 @@ class RGBDecodingTerminal:
 
         output_reference_name = data.shmem_filter_name + '_' + output_suffix
 
+        # room for the frame leased by the consumer
+        ring_size = data.shmem_buffer_size + RGBAdapter.LEASED_SLOTS
+
         shmem_filter = self.__add_middleware_framefilter(
             RGBShmemFrameFilter(output_reference_name,
-                                data.shmem_buffer_size,
+                                ring_size,
                                 data.width,
                                 data.height,
                                 data.con_timeout_ms
                                 )
         )
 
+        sync_fd_address = None
         if sync_fd is not None:
             shmem_filter.useFd(sync_fd)
 
+            # keep reference
+            self._sync_fd_publisher = SyncFdPublisher(sync_fd)
+            sync_fd_address = self._sync_fd_publisher.address
+
         decoding_chain_input = None
         if self.middleware is None:
             # swScale is required
@@ -278,18 +412,36 @@ class RGBDecodingTerminal:
 
         self._shmem_filter_link = RGBProcessLink(
             shmem_segment_name=output_reference_name,
-            shmem_buffer_size=data.shmem_buffer_size,
+            shmem_buffer_size=ring_size,
             width=data.width,
             height=data.height,
             frame_interval_ms=data.frame_interval_ms,
-            con_timeout_ms=data.con_timeout_ms
+            con_timeout_ms=data.con_timeout_ms,
+            sync_fd_address=sync_fd_address
         )
 
-        data.avthread_filter_fork.connect(data.avthread_fork_filter_basename + '_' + output_suffix,
-                                           decoding_chain_input)
+        self._output_tag = data.avthread_fork_filter_basename + '_' + output_suffix
+        self._decoding_chain_input = decoding_chain_input
+        self.connect()
 
         return self._shmem_filter_link
 
+    # (re)start receiving the decoded frames
+    def connect(self):
+        if self._connected or self._output_tag is None:
+            return
+
+        self._terminal_data.avthread_filter_fork.connect(self._output_tag, self._decoding_chain_input)
+        self._connected = True
+
+    # the filters must not be freed while connected
+    def disconnect(self):
+        if not self._connected:
+            return
+
+        self._terminal_data.avthread_filter_fork.disconnect(self._output_tag)
+        self._connected = False
+
     def __add_middleware_framefilter(self, framefilter):
         self.__middleware_framefilter_storage.append(framefilter)
         return framefilter
@@ -311,11 +463,15 @@ class IFilterchainSource(ABC):
     def stop(self):
         pass
 
+    # release the threads/slots, the source is not used anymore
+    def delete(self):
+        self.stop()
+
 @dataclass
 class SourceSpec(ABC):
     root_fork_name: str
     source_livethread_name: str
-    source_slot_id: int
+    source_slot_id: Optional[int] # None = allocated by the LiveThread owner
     
     @abstractmethod
     def create(self) -> IFilterchainSource:
@@ -325,6 +481,9 @@ class SourceSpec(ABC):
 class RTSPStreamSpec(SourceSpec):
     stream_url: str
     source_timeout_ms: int
+    # the sources with the same source_livethread_name share one LiveThread
+    #  in the process (many cameras per receiver process)
+    shared_livethread: bool = False
     
     # lot of options missing?
     def create(self) -> IFilterchainSource:
@@ -332,9 +491,83 @@ class RTSPStreamSpec(SourceSpec):
 
 @dataclass
 class RecordDirSpec(SourceSpec):
+    # a recorded file or a directory of them (played in name order)
     input_dir_path: str
+    # REALTIME or LOOP, the FileThread plays at the recorded rate
+    #  (MAX_SPEED: playback.VideoFileAdapter as the consumer's input)
+    playback_mode: PlaybackMode = PlaybackMode.REALTIME
     
-    # lot of options missing?
+    def create(self) -> IFilterchainSource:
+        return FilterchainPlaybackSource(self)
+
+
+# One LiveThread with many connection slots, by name per process:
+#  started with the first registered connection, stopped after the last one
+#  is deregistered. The slot numbers are allocated here (lowest free one).
+class SharedLiveThread:
+    FIRST_SLOT = 1
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name: str) -> 'SharedLiveThread':
+        with cls._instances_lock:
+            if name not in cls._instances:
+                cls._instances[name] = cls(name)
+            return cls._instances[name]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.livethread = LiveThread(name)
+
+        self._slots = set()
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._slots)
+
+    # requested_slot: fixed slot number, ValueError if taken
+    def allocate_slot(self, requested_slot: Optional[int] = None) -> int:
+        with self._lock:
+            slot = requested_slot
+            if slot is None:
+                slot = self.FIRST_SLOT
+                while slot in self._slots:
+                    slot += 1
+            elif slot in self._slots:
+                raise ValueError(f"Slot {slot} of {self.name} is in use")
+
+            self._slots.add(slot)
+            return slot
+
+    def register(self, con_ctx: LiveConnectionContext):
+        with self._lock:
+            if not self._running:
+                self.livethread.startCall()
+                self._running = True
+
+            self.livethread.registerStreamCall(con_ctx)
+
+    # the other connections keep streaming
+    def deregister(self, con_ctx: LiveConnectionContext, slot: int):
+        with self._lock:
+            self.livethread.deregisterStreamCall(con_ctx)
+            self._slots.discard(slot)
+
+            if self._slots:
+                return
+
+            if self._running:
+                self.livethread.stopCall()
+                self._running = False
+
+        with self._instances_lock:
+            if self._instances.get(self.name) is self:
+                del self._instances[self.name]
+
 
 class FilterchainNetworkSource(IFilterchainSource):
     
@@ -342,6 +575,7 @@ class FilterchainNetworkSource(IFilterchainSource):
         self._input_stream = input_stream
         
         self._main_fork = None
+        self._shared_livethread = None
         self._create_filterchain()
     
     @property
@@ -352,16 +586,33 @@ class FilterchainNetworkSource(IFilterchainSource):
     def root_fork(self):
         return self._main_fork
 
+    # Valkka slot of the connection (allocated when not given)
+    @property
+    def slot_id(self) -> int:
+        return self._slot_id
+
     def start(self):
         self.enable_receiver()
     
     def stop(self):
         self.disable_receiver()
 
+    def delete(self):
+        self.stop_receiver()
+
+        if self._shared_livethread is not None:
+            self._shared_livethread.deregister(self._con_ctx, self._slot_id)
+            self._shared_livethread = None
+        else:
+            self._src_livethread.deregisterStreamCall(self._con_ctx)
+            self.disable_receiver()
+
     def enable_receiver(self, start_receiving: bool = True):
         import multiprocessing
 
-        if not getattr(self, '_src_livethread_running', False):
+        # the shared thread runs while it has connections
+        own_thread = self._shared_livethread is None
+        if own_thread and not getattr(self, '_src_livethread_running', False):
             print(
                 f' <{multiprocessing.current_process().name}> START INPUT THREAD <{id(self._src_livethread)}> <{id(self._con_ctx)}>')
             self._src_livethread.startCall()
@@ -386,7 +637,8 @@ class FilterchainNetworkSource(IFilterchainSource):
             self._src_livethread.stopStreamCall(self._con_ctx)
             self._src_livethread_playing = False
 
-        if getattr(self, '_src_livethread_running', False) and disable_thread:
+        own_thread = self._shared_livethread is None
+        if own_thread and getattr(self, '_src_livethread_running', False) and disable_thread:
             print(
                 f' <{multiprocessing.current_process().name}> STOP INPUT THREAD <{id(self._src_livethread)}> <{id(self._con_ctx)}>')
             self._src_livethread.stopCall()
@@ -404,15 +656,23 @@ class FilterchainNetworkSource(IFilterchainSource):
         setLiveOutPacketBuffermaxSize(95000)
 
         # LiveThread
-        self._src_livethread = LiveThread(
-            self.input_stream.source_livethread_name)
+        if self.input_stream.shared_livethread:
+            self._shared_livethread = SharedLiveThread.get(self.input_stream.source_livethread_name)
+            self._src_livethread = self._shared_livethread.livethread
+            self._slot_id = self._shared_livethread.allocate_slot(self.input_stream.source_slot_id)
+        else:
+            self._src_livethread = LiveThread(
+                self.input_stream.source_livethread_name)
+            self._slot_id = self.input_stream.source_slot_id
+            if self._slot_id is None:
+                self._slot_id = SharedLiveThread.FIRST_SLOT
 
         # Connection + Fork
         self._main_fork = ForkFrameFilterN(self.input_stream.root_fork_name)
 
         self._con_ctx = LiveConnectionContext(LiveConnectionType_rtsp,
                                               self.input_stream.stream_url,
-                                              self.input_stream.source_slot_id,
+                                              self._slot_id,
                                               self._main_fork)
 
         print(
@@ -424,7 +684,10 @@ class FilterchainNetworkSource(IFilterchainSource):
             self._con_ctx.mstimeout = self.input_stream.source_timeout_ms
 
         # Add/set ConnectionContext
-        self._src_livethread.registerStreamCall(self._con_ctx)
+        if self._shared_livethread is not None:
+            self._shared_livethread.register(self._con_ctx)
+        else:
+            self._src_livethread.registerStreamCall(self._con_ctx)
 
         print(
             f'========================== FILTERCHAIN SETUP DONE <{id(self._src_livethread)}> <{id(self._con_ctx)}> =================')
@@ -444,53 +707,176 @@ class FilterchainNetworkSource(IFilterchainSource):
         return False
 
 
-# class FilterchainPlaybackSource(IFilterchainSource):
+# Recorded (Matroska) files fed to the root fork like a camera stream:
+#  the same decoders/terminals/recorders behind it
+class FilterchainPlaybackSource(IFilterchainSource):
+    FILE_EXTENSIONS = ('.mkv',)
+    # file length when the FileContext does not report it
+    DEFAULT_DURATION_MS = 10000
     
-#     def __init__(self, input_dir: RecordDirSpec) -> None:
-#         self._input_dir = input_dir
+    def __init__(self, input_dir: RecordDirSpec) -> None:
+        if PlaybackMode(input_dir.playback_mode) is PlaybackMode.MAX_SPEED:
+            raise ValueError('FileThread plays at the recorded rate, use playback.VideoFileAdapter for max speed')
+        
+        self._input_dir = input_dir
+        self._files = list_playback_files(input_dir.input_dir_path, self.FILE_EXTENSIONS)
+        if not self._files:
+            raise ValueError(f"No recording in {input_dir.input_dir_path}")
+        
+        self._slot_id = input_dir.source_slot_id
+        if self._slot_id is None:
+            self._slot_id = SharedLiveThread.FIRST_SLOT
         
-#         self._main_fork = None
-#         self._recording_objects = {}
-#         self._create_filterchain()
+        self._playing = threading.Event()
+        self._deleted = threading.Event()
+        self._control_thread = None
+        
+        self._main_fork = None
+        self._create_filterchain()
     
-#     @property
-#     def root_fork(self):
-#         return self._main_fork
+    @property
+    def input_dir(self) -> RecordDirSpec:
+        return self._input_dir
     
-#     ############################################## NOT WORKING!
-#     def _create_filterchain(self):
-#         import multiprocessing
-#         print(
-#             f"========================== FILTERCHAIN SETUP <{multiprocessing.current_process().name}> =================")
+    @property
+    def root_fork(self):
+        return self._main_fork
+    
+    @property
+    def slot_id(self) -> int:
+        return self._slot_id
+    
+    # REALTIME: the last file ended
+    @property
+    def finished(self) -> bool:
+        return self._control_thread is not None and not self._control_thread.is_alive()
+    
+    def start(self):
+        if self._deleted.is_set():
+            return
+        
+        self._playing.set()
+        if self._control_thread is None:
+            self._control_thread = threading.Thread(target=self._play_files, daemon=True)
+            self._control_thread.start()
+    
+    # the current file is stopped, start() plays the next one
+    def stop(self):
+        self._playing.clear()
+    
+    def delete(self):
+        self._deleted.set()
+        self._playing.set()
+        
+        if self._control_thread is not None:
+            self._control_thread.join()
+            self._control_thread = None
+        
+        self._src_filethread.stopCall()
+    
+    def _play_files(self):
+        file_index = 0
+        
+        while not self._deleted.is_set():
+            self._playing.wait()
+            if self._deleted.is_set():
+                break
+            
+            if file_index == len(self._files):
+                if PlaybackMode(self.input_dir.playback_mode) is not PlaybackMode.LOOP:
+                    break
+                file_index = 0
+            
+            self._play_file(self._files[file_index])
+            file_index += 1
+    
+    def _play_file(self, path: str):
+        ctx = FileContext(path, self._slot_id, self._main_fork)
+        
+        self._src_filethread.openFileStreamCall(ctx)
+        if ctx.status == FileState_error:
+            print(f"PLAYBACK: cannot open {path}")
+            return
+        
+        ctx.seektime_ = 0
+        self._src_filethread.seekFileStreamCall(ctx)
+        self._src_filethread.playFileStreamCall(ctx)
+        
+        # returns early on stop/delete
+        duration_ms = ctx.duration or self._probe_duration_ms(path)
+        deadline = time.monotonic() + duration_ms / 1000
+        while not self._deleted.is_set() and self._playing.is_set():
+            wait_sec = deadline - time.monotonic()
+            if wait_sec <= 0:
+                break
+            self._deleted.wait(min(wait_sec, 0.5))
+        
+        self._src_filethread.stopFileStreamCall(ctx)
+        self._src_filethread.closeFileStreamCall(ctx)
+    
+    def _probe_duration_ms(self, path: str) -> int:
+        import cv2
+        
+        capture = cv2.VideoCapture(path)
+        frames, fps = capture.get(cv2.CAP_PROP_FRAME_COUNT), capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+        
+        if frames > 0 and fps > 0:
+            return int(1000 * frames / fps)
+        return self.DEFAULT_DURATION_MS
+    
+    def _create_filterchain(self):
+        import multiprocessing
+        print(
+            f"========================== FILTERCHAIN SETUP <{multiprocessing.current_process().name}> =================")
+        
+        self._main_fork = ForkFrameFilterN(self.input_dir.root_fork_name)
+        
+        self._src_filethread = FileThread(self.input_dir.source_livethread_name)
+        self._src_filethread.startCall()
+        
+        print(f"IN:  {len(self._files)} file(s) from {self.input_dir.input_dir_path}")
+        print(
+            f'========================== FILTERCHAIN SETUP DONE <{id(self._src_filethread)}> =================')
 
-#         # test
-#         setLiveOutPacketBuffermaxSize(95000)
 
-#         # LiveThread
-#         self._src_livethread = LiveThread(
-#             self.input_stream.source_livethread_name)
+# Signals the decoded frames of a fork (through a tiny RGB shmem ring's eventfd)
+class DecodedFrameProbe:
+    WIDTH = 64
+    HEIGHT = 36
 
-#         # Connection + Fork
-#         self._main_fork = ForkFrameFilterN(self.input_stream.root_fork_name)
+    def __init__(self, name: str, fork: ForkFrameFilterN) -> None:
+        self._name = name
+        self._fork = fork
 
-#         self._con_ctx = LiveConnectionContext(LiveConnectionType_rtsp,
-#                                               self.input_stream.input_address,
-#                                               self.input_stream.source_slot_id,
-#                                               self._main_fork)
+        self._sync_fd = EventFd()
+        self._events = messenger.EventFdSocket(self._sync_fd.getFd())
 
-#         print(
-#             f"IN:  {LiveConnectionType_rtsp} {str(self.input_stream.input_address)} {int(self.input_stream.input_address)}")
-#         # NAT or Internet-streaming?:
-#         # self._con_ctx.request_tcp = True
-#         # Timeout
-#         if self.input_stream.source_timeout_ms is not None:
-#             self._con_ctx.mstimeout = self.input_stream.source_timeout_ms
+        # keep reference
+        self._shmem_filter = RGBShmemFrameFilter(name + '_shmem', 2, self.WIDTH, self.HEIGHT, 1000)
+        self._shmem_filter.useFd(self._sync_fd)
+        self._swscale_filter = SwScaleFrameFilter(name + '_swscale', self.WIDTH, self.HEIGHT, self._shmem_filter)
 
-#         # Add/set ConnectionContext
-#         self._src_livethread.registerStreamCall(self._con_ctx)
+        self._connected = False
 
-#         print(
-#             f'========================== FILTERCHAIN SETUP DONE <{id(self._src_livethread)}> <{id(self._con_ctx)}> =================')
+    def connect(self):
+        if not self._connected:
+            self._fork.connect(self._name, self._swscale_filter)
+            self._connected = True
+
+    def disconnect(self):
+        if self._connected:
+            self._fork.disconnect(self._name)
+            self._connected = False
+
+    # drop the signals of the earlier frames
+    def clear(self):
+        while self._events.recv_message_blocking(0) is not None:
+            pass
+
+    # True when a frame was decoded
+    def wait(self, timeout_sec: float) -> bool:
+        return self._events.recv_message_blocking(timeout_sec) is not None
 
 
 class FilterchainDecoder:
@@ -501,6 +887,16 @@ class FilterchainDecoder:
         self._create_decoder()
         self._decoder_enabled = False
         self._decoder_running = False
+
+        self._decode_mode = decoder_spec.decode_mode
+        self._keyframe_interval_sec = decoder_spec.keyframe_interval_sec
+        self._window_thread = None
+        self._window_stop = threading.Event()
+        self._frame_probe = None
+    
+    @property
+    def decode_mode(self) -> DecodeMode:
+        return self._decode_mode
     
     @property
     def output_fork(self) -> ForkFrameFilterN:
@@ -516,11 +912,12 @@ class FilterchainDecoder:
             self._decoder_enabled = True
         
         if not self._decoder_running and start_decoding:
-            self._avthread.decodingOnCall()
             self._decoder_running = True
+            self._apply_decode_mode()
 
     def stop_decoding(self, stop_thread: bool = False):
         if self._decoder_running and stop_thread:
+            self._stop_windows()
             self._avthread.decodingOffCall()
             self._decoder_running = False
         
@@ -530,16 +927,171 @@ class FilterchainDecoder:
 
     def kill_decoder(self):
         return self.stop_decoding(True)
+
+    # switch at runtime, e.g. to full decode when the camera is focused or recording
+    def set_decode_mode(self, mode: DecodeMode, keyframe_interval_sec: Optional[float] = None):
+        if keyframe_interval_sec is not None:
+            self._keyframe_interval_sec = keyframe_interval_sec
+
+        if mode == self._decode_mode and keyframe_interval_sec is None:
+            return
+        self._decode_mode = mode
+
+        if self._decoder_running:
+            self._stop_windows()
+            self._apply_decode_mode()
+
+    def _apply_decode_mode(self):
+        if self._decode_mode is DecodeMode.FULL:
+            self._avthread.decodingOnCall()
+            return
+
+        if self._frame_probe is None:
+            self._frame_probe = DecodedFrameProbe(self._decoder_spec.child_fork_name + '_keyframe_probe',
+                                                  self._output_fork)
+        self._frame_probe.connect()
+
+        self._window_stop.clear()
+        self._window_thread = threading.Thread(target=self._run_windows, daemon=True)
+        self._window_thread.start()
+
+    def _stop_windows(self):
+        if self._window_thread is None:
+            return
+
+        self._window_stop.set()
+        self._window_thread.join()
+        self._window_thread = None
+
+        self._frame_probe.disconnect()
+
+    def _run_windows(self):
+        max_window_sec = self._decoder_spec.keyframe_window_ms / 1000.0
+        probe = self._frame_probe
+
+        while True:
+            window_start = time.monotonic()
+
+            probe.clear()
+            self._avthread.decodingOnCall()
+
+            # until the first decoded frame, polled for the stop request
+            while not probe.wait(0.1):
+                if self._window_stop.is_set():
+                    return
+                if time.monotonic() - window_start >= max_window_sec:
+                    break
+
+            self._avthread.decodingOffCall()
+
+            next_window_sec = self._keyframe_interval_sec - (time.monotonic() - window_start)
+            if self._window_stop.wait(max(next_window_sec, 0.0)):
+                return
     
     # return (input-FrameFilter, decoded-ForkFrameFilterN)
     def _create_decoder(self) -> FrameFilter:
-        avthread_name = self._decoder_spec.avthread_name
+        spec = self._decoder_spec
         #slot_id = self._decoder_spec.slot_id
 
-        self._avthread = AVThread(avthread_name, self.output_fork)
+        # keep reference
+        self._fifo_ctx = FrameFifoContext()
+        self._fifo_ctx.n_basic = spec.fifo_basic
+        self._fifo_ctx.n_setup = spec.fifo_setup
+        self._fifo_ctx.n_signal = spec.fifo_signal
+        self._fifo_ctx.flush_when_full = spec.flush_when_full
+
+        self._avthread = AVThread(spec.avthread_name, self.output_fork, self._fifo_ctx)
+        if spec.n_threads > 1:
+            self._avthread.setNumberOfThreads(spec.n_threads)
         self._avthread_filter = self._avthread.getFrameFilter()
 
 
+@dataclass
+class PassthroughRecorderSpec:
+    mux_filter_name: str
+    shmem_name: str
+    shmem_cells: int = 50
+    # largest fragment (a keyframe of a high bitrate stream fits)
+    shmem_cell_size: int = 4 * 1024 * 1024
+    shmem_timeout_ms: int = 1000
+
+
+# Taps the compressed stream (no decoder) and muxes it into fragmented MP4,
+#  the recorder control decides which fragments go to which file
+class FilterchainPassthroughRecorder:
+    def __init__(self,
+                 spec: PassthroughRecorderSpec,
+                 input_fork: ForkFrameFilterN,
+                 control: PassthroughRecorderControl) -> None:
+        self._spec = spec
+        self._input_fork = input_fork
+        self._control = control
+
+        self._shmem_filter = FragMP4ShmemFrameFilter(
+            spec.shmem_name,
+            spec.shmem_cells,
+            spec.shmem_cell_size
+        )
+        self._mux_filter = FragMP4MuxFrameFilter(spec.mux_filter_name, self._shmem_filter)
+
+        self._input_fork.connect(spec.mux_filter_name, self._mux_filter)
+
+        self._running = False
+        self._reader_thread = None
+
+    @property
+    def control(self) -> PassthroughRecorderControl:
+        return self._control
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+
+        self._mux_filter.activate()
+        # init segment for the reader (the muxer may have started before)
+        self._mux_filter.sendMeta()
+
+        self._reader_thread = threading.Thread(target=self._read_fragments)
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
+
+    # the recording ends at the next keyframe, closed by the reader thread
+    #  (see control.closed_channel); the muxer keeps running, so the next
+    #  recording starts with the last keyframe
+    def stop(self):
+        self._control.deactivate()
+
+    # a fragmented MP4 is complete at every fragment, the file is closed
+    #  without waiting for the keyframe
+    def delete(self):
+        if self._running:
+            self._running = False
+
+            self._mux_filter.deActivate()
+            self._reader_thread.join()
+
+        self._control.close()
+        self._input_fork.disconnect(self._spec.mux_filter_name)
+
+    def _read_fragments(self):
+        client = FragMP4ShmemClient(
+            name=self._spec.shmem_name,
+            n_ringbuffer=self._spec.shmem_cells,
+            n_size=self._spec.shmem_cell_size,
+            mstimeout=self._spec.shmem_timeout_ms,
+            verbose=False
+        )
+
+        while self._running:
+            index, meta = client.pullFrame()
+            if index is None:
+                self._control.check_timeout()
+                continue
+
+            self._control.feed(bytes(client.shmem_list[index][0:meta.size]))
+
+
 # class FilterchainRecorder:
     
 #     @property
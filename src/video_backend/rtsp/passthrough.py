@@ -0,0 +1,295 @@
+from typing import Iterator, List, Optional, Tuple
+import os
+import struct
+import threading
+import time
+
+import notifier
+
+# Records the compressed stream as fragmented MP4 without decoding:
+#  the muxer (FragMP4MuxFrameFilter) sends the boxes in stream order,
+#  ftyp+moov (init segment) first, then a moof+mdat pair per fragment.
+# Files start with the init segment and the most recent keyframe fragment,
+#  so the recording begins with a decodable frame; stopping waits for the
+#  next keyframe, so the following recording continues without a gap.
+# deactivate() returns immediately, the feeding thread closes the file and
+#  publishes its path on closed_channel.
+
+# sample_is_non_sync_sample bit of the ISO BMFF sample flags
+_NON_SYNC_SAMPLE = 0x00010000
+
+_CONTAINER_BOXES = {b'moov', b'mvex', b'moof', b'traf'}
+
+
+# yield (box type, payload start, box end) of the top-level boxes in data[start:end]
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    end = len(data) if end is None else end
+    offset = start
+
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+
+        if size < header or offset + size > end:
+            return
+
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def find_box(data: bytes, path: List[bytes], start: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    for box_type, payload, box_end in iter_boxes(data, start, end):
+        if box_type != path[0]:
+            continue
+        if len(path) == 1:
+            return payload, box_end
+        if box_type in _CONTAINER_BOXES:
+            return find_box(data, path[1:], payload, box_end)
+    return None
+
+
+# trex default_sample_flags of the init segment (None if not present)
+def default_sample_flags(init_segment: bytes) -> Optional[int]:
+    trex = find_box(init_segment, [b'moov', b'mvex', b'trex'])
+    if trex is None:
+        return None
+
+    # version+flags, track_ID, description index, duration, size, flags
+    return struct.unpack_from('>I', init_segment, trex[0] + 20)[0]
+
+
+def first_sample_flags(moof: bytes, trex_flags: Optional[int] = None) -> Optional[int]:
+    tfhd = find_box(moof, [b'moof', b'traf', b'tfhd'])
+    trun = find_box(moof, [b'moof', b'traf', b'trun'])
+    if trun is None:
+        return None
+
+    start, _ = trun
+    flags = struct.unpack_from('>I', moof, start)[0] & 0xFFFFFF
+    offset = start + 8  # version+flags, sample_count
+
+    if flags & 0x1:  # data_offset
+        offset += 4
+    if flags & 0x4:  # first_sample_flags
+        return struct.unpack_from('>I', moof, offset)[0]
+    if flags & 0x400:  # per-sample flags
+        offset += 4 * bool(flags & 0x100) + 4 * bool(flags & 0x200)
+        return struct.unpack_from('>I', moof, offset)[0]
+
+    if tfhd is not None:
+        start, _ = tfhd
+        flags = struct.unpack_from('>I', moof, start)[0] & 0xFFFFFF
+        if flags & 0x20:  # default_sample_flags
+            offset = start + 8
+            offset += 8 * bool(flags & 0x1) + 4 * bool(flags & 0x2)
+            offset += 4 * bool(flags & 0x8) + 4 * bool(flags & 0x10)
+            return struct.unpack_from('>I', moof, offset)[0]
+
+    return trex_flags
+
+
+# unknown flags are treated as keyframe
+def is_keyframe_fragment(moof: bytes, trex_flags: Optional[int] = None) -> bool:
+    flags = first_sample_flags(moof, trex_flags)
+    return flags is None or not flags & _NON_SYNC_SAMPLE
+
+
+# Same activate/deactivate interface as consumer.RecorderControl,
+#  so the recorder remote logic can drive either of them
+class PassthroughRecorderControl:
+    # stop anyway when no keyframe arrives
+    STOP_TIMEOUT_SEC = 10.0
+
+    # fixed file
+    @property
+    def filename_extension(self) -> str:
+        return 'mp4'
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    @property
+    def filepath(self) -> Optional[str]:
+        return self._filepath
+
+    def __init__(self, recording_dir: Optional[str] = None, recording_basename: str = 'video') -> None:
+        self.recording_dir = recording_dir
+        self.recording_basename = recording_basename
+
+        self._lock = threading.Lock()
+        # filepath of every closed file, sent outside of the lock
+        self.closed_channel = notifier.UpdateChannel()
+        self._closed_files: List[str] = []
+
+        self._init_segment = b''
+        self._trex_flags = None
+        # fragments since the last keyframe (moof+mdat each)
+        self._gop: List[bytes] = []
+        self._moof = None
+
+        self._filepath = None
+        self._file = None
+        self._active = False
+        self._stop_requested_at = None
+
+        self.bytes_written = 0
+
+    def activate(self, set_filepath: Optional[str] = None):
+        with self._lock:
+            self._close_file()
+
+            self._filepath = set_filepath or self._filepath
+            if self._filepath is None:
+                raise RuntimeError('Filepath not set')
+
+            self._active = True
+            self._stop_requested_at = None
+
+            # start with the last keyframe if the stream is already running
+            if self._init_segment and self._gop:
+                self._open_file()
+
+        self._notify_closed()
+
+    def deactivate(self, set_filepath: Optional[str] = None):
+        with self._lock:
+            if self._file is None:
+                self._active = False
+                return
+            self._stop_requested_at = time.monotonic()
+
+    # STOP_TIMEOUT_SEC is checked with the fragments,
+    #  the feeding thread calls it when none arrives (stalled stream)
+    def check_timeout(self):
+        with self._lock:
+            self._check_stop_timeout()
+
+        self._notify_closed()
+
+    # called by the muxer's reader thread with every box
+    def feed(self, box: bytes):
+        box_type = box[4:8]
+
+        with self._lock:
+            if box_type == b'ftyp':
+                self._init_segment = box
+                self._gop = []
+            elif box_type == b'moov':
+                self._init_segment += box
+                self._trex_flags = default_sample_flags(self._init_segment)
+            elif box_type == b'moof':
+                self._moof = box
+            elif box_type == b'mdat' and self._moof is not None:
+                self._feed_fragment(self._moof + box, is_keyframe_fragment(self._moof, self._trex_flags))
+                self._moof = None
+
+        self._notify_closed()
+
+    def close(self):
+        with self._lock:
+            self._active = False
+            self._close_file()
+
+        self._notify_closed()
+
+    def _feed_fragment(self, fragment: bytes, is_keyframe: bool):
+        if is_keyframe:
+            self._gop = []
+
+            if self._stop_requested_at is not None:
+                # the next recording starts with this keyframe
+                self._active = False
+                self._stop_requested_at = None
+                self._close_file()
+
+        self._gop.append(fragment)
+
+        if not self._active:
+            return
+
+        if self._file is None:
+            if is_keyframe and self._init_segment:
+                self._open_file()
+            return
+
+        self._write(fragment)
+        self._check_stop_timeout()
+
+    def _check_stop_timeout(self):
+        timed_out = (self._stop_requested_at is not None
+                     and time.monotonic() - self._stop_requested_at > self.STOP_TIMEOUT_SEC)
+        if timed_out:
+            self._active = False
+            self._stop_requested_at = None
+            self._close_file()
+
+    def _open_file(self):
+        dirname = os.path.dirname(self._filepath)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self._file = open(self._filepath, 'wb')
+        self._write(self._init_segment)
+        for fragment in self._gop:
+            self._write(fragment)
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._closed_files.append(self._filepath)
+
+    def _notify_closed(self):
+        with self._lock:
+            closed_files, self._closed_files = self._closed_files, []
+
+        for filepath in closed_files:
+            self.closed_channel.send(notifier.Update(key=PassthroughRecorderControl, value=filepath))
+
+
+# Stand-in for the muxer: feeds the boxes of a fragmented MP4 file
+#  (e.g. ffmpeg -movflags frag_keyframe+empty_moov) to a recorder control
+class FragmentedMP4FileFeeder:
+    def __init__(self, filepath: str, control: PassthroughRecorderControl) -> None:
+        self._filepath = filepath
+        self._control = control
+
+    # fragment_interval_sec: sleep between the fragments (real-time feeding)
+    def run(self, fragment_interval_sec: float = 0.0):
+        with open(self._filepath, 'rb') as f:
+            data = f.read()
+
+        # top-level boxes are contiguous
+        box_start = 0
+        for box_type, _, box_end in iter_boxes(data):
+            self._control.feed(data[box_start:box_end])
+            box_start = box_end
+
+            if box_type == b'mdat' and fragment_interval_sec:
+                time.sleep(fragment_interval_sec)
+
+
+if __name__ == '__main__':
+    # python -m video_backend.rtsp.passthrough <fragmented.mp4> <output dir>
+    import sys
+
+    input_path, output_dir = sys.argv[1:3]
+
+    control = PassthroughRecorderControl(output_dir)
+    control.activate(os.path.join(output_dir, 'passthrough_test.mp4'))
+
+    FragmentedMP4FileFeeder(input_path, control).run()
+    control.close()
+
+    print(control.filepath, control.bytes_written, 'bytes')
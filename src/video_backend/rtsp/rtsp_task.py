@@ -1,9 +1,12 @@
 from dataclasses import dataclass, field
-from typing import Any, Optional, Union
+from typing import Any, List, Optional, Union
+import datetime
+import os
 
-from valkka.core import ForkFrameFilterN
+from valkka.core import ForkFrameFilterN, EventFd
 
-from video_backend.rtsp.filterchain import FilterchainNetworkSource, IFilterchainSource, RTSPStreamSpec, FilterchainDecoder, DecoderSpec, RGBDecodingTerminalData, RGBDecodingTerminalComponents, RGBDecodingTerminal, SourceSpec#, FilterchainRecorder
+from video_backend.rtsp.filterchain import FilterchainNetworkSource, IFilterchainSource, RTSPStreamSpec, FilterchainDecoder, DecoderSpec, DecodeMode, RGBDecodingTerminalData, RGBDecodingTerminalComponents, RGBDecodingTerminal, SourceSpec, FilterchainPassthroughRecorder, PassthroughRecorderSpec#, FilterchainRecorder
+from video_backend.rtsp.passthrough import PassthroughRecorderControl
 
 from messaging.topic import TopicMessaging, MessageThreadRegistry, ReplyControl, SentMessage
 from backend_context import ProcessBoundTask, BackendProcessContext, BackendProcess, TaskProcess, GeneratedProcessTask
@@ -31,47 +34,74 @@ class ReceiverDerivativeControl(ProcessBoundTask):
         return self.process_id
 
 
+# Sources of the process by source id: the bootstrapping receiver's one is
+#  None, a shared-receiver process hosts more of them (SharedReceiver_Create),
+#  all on one LiveThread (RTSPStreamSpec.shared_livethread)
+def get_source(context: BackendProcessContext, source_id: Any = None) -> IFilterchainSource:
+    return context[ReceiverControlBase][source_id]
+
+
 class ReceiverControlBase(generic_resource.ControlTask):
     def allocate(self, context: BackendProcessContext) -> ResultVector:
-        receiver = context[ReceiverControlBase] = self.source.create()
-        context['filter_forks'] = {}
+        sources = context.setdefault(ReceiverControlBase, {})
+        if self.source_id in sources:
+            return generic_resource.Result(
+                status=generic_resource.Status.FAILED,
+                resource_change=False,
+                additional_data=f"Source {self.source_id} already exists"
+            )
+
+        sources[self.source_id] = self.source.create()
+        context.setdefault('filter_forks', {})
         return True
     
     def start(self, context: BackendProcessContext) -> ResultVector:
-        receiver: IFilterchainSource = context[ReceiverControlBase]
+        receiver = get_source(context, self.source_id)
         
         receiver.start()
         return True
     
     def stop(self, context: BackendProcessContext) -> ResultVector:
-        receiver: IFilterchainSource = context[ReceiverControlBase]
+        receiver = get_source(context, self.source_id)
 
         receiver.stop()
         return True
     
     def delete(self, context: BackendProcessContext) -> ResultVector:
-        del context[ReceiverControlBase]
+        # the other sources' streams are not disturbed
+        receiver = context[ReceiverControlBase].pop(self.source_id)
+
+        receiver.delete()
         return True
     
     @property
     def backend__resource_id(self) -> Any:
-        return ReceiverControlBase
+        if self.source_id is None:
+            return ReceiverControlBase
+        return tuple([ReceiverControlBase, self.source_id])
 
 @dataclass
 class Receiver_Create(CreateCommand, ReceiverControlBase, ReceiverBootstrapControl):
     source: SourceSpec = CommandField(CommandType.REQUIRED)
+    source_id: Any = CommandField(CommandType.OPTIONAL, default=None)
+
+# adds a source to a running receiver process
+@dataclass
+class SharedReceiver_Create(CreateCommand, ReceiverControlBase, ReceiverDerivativeControl):
+    source: SourceSpec = CommandField(CommandType.REQUIRED)
+    source_id: Any = CommandField(CommandType.REQUIRED)
 
 @dataclass
 class Receiver_Start(StartCommand, ReceiverControlBase, ReceiverDerivativeControl):
-    pass
+    source_id: Any = CommandField(CommandType.INHERITED, default=None)
 
 @dataclass
 class Receiver_Stop(StopCommand, ReceiverControlBase, ReceiverDerivativeControl):
-    pass
+    source_id: Any = CommandField(CommandType.INHERITED, default=None)
 
 @dataclass
 class Receiver_Delete(DeleteCommand, ReceiverControlBase, ReceiverDerivativeControl):
-    pass
+    source_id: Any = CommandField(CommandType.INHERITED, default=None)
 
 
 class DecoderControlBase(generic_resource.ControlTask):
@@ -80,7 +110,7 @@ class DecoderControlBase(generic_resource.ControlTask):
 
         decoder = self.decoder.create()
         
-        source: IFilterchainSource = context[ReceiverControlBase]
+        source = get_source(context, self.source_id)
         input_fork = source.root_fork
         if self.input_filter_id is not None:
             input_fork = context['filter_forks'][self.input_filter_id]
@@ -116,6 +146,7 @@ class Decoder_Create(CreateCommand, DecoderControlBase, ReceiverDerivativeContro
     decoder: DecoderSpec = CommandField(CommandType.REQUIRED)
     input_filter_id: Any = CommandField(CommandType.REQUIRED) # None = root filter
     decoder_id: Any = CommandField(CommandType.GENERATED, init=False)
+    source_id: Any = CommandField(CommandType.OPTIONAL, default=None)
     
     def __post_init__(self):
         super().__post_init__()
@@ -134,11 +165,44 @@ class Decoder_Delete(DeleteCommand, DecoderControlBase, ReceiverDerivativeContro
     decoder_id: Any = CommandField(CommandType.INHERITED)
 
 
+# Switches a running decoder between the monitor (keyframe) profile and full decode
+@dataclass
+class DecoderModeCommand(ReceiverDerivativeControl, signalling.Command):
+    decoder_id: Any = CommandField(CommandType.REQUIRED)
+    decode_mode: DecodeMode = CommandField(CommandType.REQUIRED)
+    keyframe_interval_sec: Optional[float] = CommandField(CommandType.OPTIONAL, default=None)
+
+    def command(self) -> signalling.Tag:
+        return signalling.Tag('process', 'decoder_mode')
+
+    def task_completed(self, reply, reply_history: List[Any]) -> bool:
+        return reply
+
+    def run(self, control: ReplyControl, process: BackendProcess) -> Any:
+        decoder: FilterchainDecoder = process.backend__context[self.decoder_id]
+
+        decoder.set_decode_mode(self.decode_mode, self.keyframe_interval_sec)
+
+        control.reply_to_message = True
+        return True
+
+
+# Terminals by decoder and terminal id: context[decoder][terminal_id]
+# Every terminal has its own SwScale/TimeInterval chain and shmem ring,
+#  all of them fed by the decoder's output fork
 class RGBTerminalControlBase(generic_resource.ControlTask):
     def allocate(self, context: BackendProcessContext) -> ResultVector:
         assert isinstance(self.terminal_data, RGBDecodingTerminalData)
         
         decoder: FilterchainDecoder = context[self.decoder_id]
+        terminals = context.setdefault(decoder, {})
+
+        if self.terminal_id in terminals:
+            return generic_resource.Result(
+                status=generic_resource.Status.FAILED,
+                resource_change=False,
+                additional_data=f"Terminal {self.terminal_id} already exists"
+            )
 
         data = self.terminal_data
         components = RGBDecodingTerminalComponents(
@@ -156,10 +220,12 @@ class RGBTerminalControlBase(generic_resource.ControlTask):
         
         decoder_terminal = RGBDecodingTerminal(components)
         
-        rgb_link_data = decoder_terminal.add_output('')
-        # rgb_link_data = decoder_terminal.add_output(sync_fd, '')
+        # unique fork tag and shmem name per terminal
+        output_suffix = '' if self.terminal_id is None else str(self.terminal_id)
+        # wakes up the consumer process when a frame is written
+        rgb_link_data = decoder_terminal.add_output(output_suffix, EventFd())
 
-        context[decoder] = decoder_terminal
+        terminals[self.terminal_id] = decoder_terminal
 
         return generic_resource.Result(
             status=generic_resource.Status.OK,
@@ -168,47 +234,131 @@ class RGBTerminalControlBase(generic_resource.ControlTask):
         )
 
     def start(self, context: BackendProcessContext) -> ResultVector:
-        decoder: FilterchainDecoder = context[self.decoder_id]
+        terminal = self._terminal(context)
 
-        terminal: RGBDecodingTerminal = context[decoder]
-        # ...
-        #raise NotImplementedError
+        terminal.connect()
         return True
 
     def stop(self, context: BackendProcessContext) -> ResultVector:
-        # ...
-        raise NotImplementedError
+        terminal = self._terminal(context)
+
+        # the other terminals of the decoder keep running
+        terminal.disconnect()
         return True
 
     def delete(self, context: BackendProcessContext) -> ResultVector:
         decoder: FilterchainDecoder = context[self.decoder_id]
+        terminals = context[decoder]
 
-        del context[decoder]
-        # ...
+        terminals.pop(self.terminal_id).disconnect()
+        if not terminals:
+            del context[decoder]
         return True
+
+    def _terminal(self, context: BackendProcessContext) -> RGBDecodingTerminal:
+        decoder: FilterchainDecoder = context[self.decoder_id]
+        return context[decoder][self.terminal_id]
     
     @property
     def backend__resource_id(self) -> Any:
-        return tuple([RGBTerminalControlBase, self.decoder_id])
+        return tuple([RGBTerminalControlBase, self.decoder_id, self.terminal_id])
 
 
 @dataclass
 class RGBTerminal_Create(CreateCommand, RGBTerminalControlBase, ReceiverDerivativeControl):
     decoder_id: Any = CommandField(CommandType.REQUIRED)
     terminal_data: RGBDecodingTerminalData = CommandField(CommandType.REQUIRED)
+    terminal_id: Any = CommandField(CommandType.OPTIONAL, default=None) # None = default terminal
 
 @dataclass
 class RGBTerminal_Start(StartCommand, RGBTerminalControlBase, ReceiverDerivativeControl):
     decoder_id: Any = CommandField(CommandType.INHERITED)
+    terminal_id: Any = CommandField(CommandType.INHERITED, default=None)
 
 @dataclass
 class RGBTerminal_Stop(StopCommand, RGBTerminalControlBase, ReceiverDerivativeControl):
     decoder_id: Any = CommandField(CommandType.INHERITED)
+    terminal_id: Any = CommandField(CommandType.INHERITED, default=None)
 
 @dataclass
 class RGBTerminal_Delete(DeleteCommand, RGBTerminalControlBase, ReceiverDerivativeControl):
     decoder_id: Any = CommandField(CommandType.INHERITED)
+    terminal_id: Any = CommandField(CommandType.INHERITED, default=None)
+
 
+# Records the compressed stream (no decoder needed), the files start at a keyframe
+class PassthroughRecorderControlBase(generic_resource.ControlTask):
+    def allocate(self, context: BackendProcessContext) -> ResultVector:
+        source = get_source(context, self.source_id)
+        input_fork = source.root_fork
+        if self.input_filter_id is not None:
+            input_fork = context['filter_forks'][self.input_filter_id]
+
+        control = PassthroughRecorderControl(self.recording_dir, self.recording_basename)
+
+        spec = PassthroughRecorderSpec(
+            mux_filter_name=f"passthrough_mux_{self.recorder_id}",
+            shmem_name=f"passthrough_{id(source)}_{self.recorder_id}"
+        )
+
+        base = context.setdefault(PassthroughRecorderControlBase, {})
+        base[self.recorder_id] = FilterchainPassthroughRecorder(spec, input_fork, control)
+        return True
+
+    def start(self, context: BackendProcessContext) -> ResultVector:
+        recorder: FilterchainPassthroughRecorder = context[PassthroughRecorderControlBase][self.recorder_id]
+
+        recorder.start()
+        if self.start_recording:
+            recorder.control.activate(self.filepath or self._generate_filepath(recorder.control))
+        return True
+
+    # returns immediately, the file is closed at the next keyframe
+    def stop(self, context: BackendProcessContext) -> ResultVector:
+        recorder: FilterchainPassthroughRecorder = context[PassthroughRecorderControlBase][self.recorder_id]
+
+        recorder.stop()
+        return True
+
+    def delete(self, context: BackendProcessContext) -> ResultVector:
+        recorder: FilterchainPassthroughRecorder = context[PassthroughRecorderControlBase].pop(self.recorder_id)
+
+        recorder.delete()
+        return True
+
+    def _generate_filepath(self, control: PassthroughRecorderControl) -> str:
+        timestamp = datetime.datetime.today().strftime('%Y-%m-%d_%H-%M-%S')
+        filename = f"{control.recording_basename}_{timestamp}.{control.filename_extension}"
+
+        return os.path.join(str(control.recording_dir), filename)
+
+    @property
+    def backend__resource_id(self) -> Any:
+        return tuple([PassthroughRecorderControlBase, self.recorder_id])
+
+
+@dataclass
+class PassthroughRecorder_Create(CreateCommand, PassthroughRecorderControlBase, ReceiverDerivativeControl):
+    recorder_id: Any = CommandField(CommandType.REQUIRED)
+    recording_dir: str = CommandField(CommandType.REQUIRED)
+    input_filter_id: Any = CommandField(CommandType.OPTIONAL, default=None) # None = root filter
+    recording_basename: str = CommandField(CommandType.OPTIONAL, default='video')
+    source_id: Any = CommandField(CommandType.OPTIONAL, default=None)
+
+@dataclass
+class PassthroughRecorder_Start(StartCommand, PassthroughRecorderControlBase, ReceiverDerivativeControl):
+    recorder_id: Any = CommandField(CommandType.INHERITED)
+    start_recording: bool = True
+    # None: <recording_basename>_<date>.mp4
+    filepath: Optional[str] = None
+
+@dataclass
+class PassthroughRecorder_Stop(StopCommand, PassthroughRecorderControlBase, ReceiverDerivativeControl):
+    recorder_id: Any = CommandField(CommandType.INHERITED)
+
+@dataclass
+class PassthroughRecorder_Delete(DeleteCommand, PassthroughRecorderControlBase, ReceiverDerivativeControl):
+    recorder_id: Any = CommandField(CommandType.INHERITED)
 
 
 @dataclass
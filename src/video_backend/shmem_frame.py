@@ -0,0 +1,329 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+import time
+
+import cv2
+import numpy as np
+
+# Shared memory layout of a filter output:
+#  [segment header][slot headers][slot 0 frame][slot 1 frame]..
+#
+# The slots are sized for a capacity (slot_nbytes), so frames may change
+#  their size in place: the slot header tells the actual width/height and
+#  the generation is increased on every size change.
+#
+# The writer fills the slots round-robin, every slot is guarded by a seqlock
+#  (odd 'lock' while writing). The reader copies the latest slot and
+#  retries/gives up when the lock changed under the copy (torn frame).
+# There are no memory fences in Python: the single writer's plain stores
+#  are ordered on x86, on weakly ordered CPUs a torn frame may slip through.
+
+SEGMENT_HEADER = np.dtype([
+    ('latest_seq', '<u8'),
+    ('slot_count', '<u4'),
+    ('slot_nbytes', '<u4'),
+])
+
+SLOT_HEADER = np.dtype([
+    ('lock', '<u8'),
+    ('seq', '<u8'),
+    ('timestamp', '<f8'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('generation', '<u4'),
+    ('_padding', '<u4'),
+    # latency stages (wall clock, 0 = unknown): input frame read, output written
+    ('grab_timestamp', '<f8'),
+    ('write_timestamp', '<f8'),
+])
+
+DEFAULT_SLOT_COUNT = 3
+
+# keep the frames cache line aligned
+_ALIGNMENT = 64
+
+
+def _aligned(nbytes: int) -> int:
+    return (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _headers_nbytes(slot_count: int) -> int:
+    return _aligned(SEGMENT_HEADER.itemsize) + _aligned(SLOT_HEADER.itemsize * slot_count)
+
+
+def segment_nbytes(slot_nbytes: int, slot_count: int = DEFAULT_SLOT_COUNT) -> int:
+    return _headers_nbytes(slot_count) + _aligned(slot_nbytes) * slot_count
+
+
+@dataclass
+class FrameHeader:
+    seq: int
+    timestamp: float
+    width: int
+    height: int
+    generation: int
+    grab_timestamp: float = 0.0
+    write_timestamp: float = 0.0
+
+
+class _SharedFrameSlots:
+    def __init__(self, buffer, slot_nbytes: int, slot_count: int) -> None:
+        self._slot_count = slot_count
+        self._slot_nbytes = slot_nbytes
+
+        self._header = np.ndarray((), SEGMENT_HEADER, buffer=buffer)
+        self._slots = np.ndarray((slot_count,), SLOT_HEADER, buffer=buffer,
+                                 offset=_aligned(SEGMENT_HEADER.itemsize))
+
+        frames_offset = _headers_nbytes(slot_count)
+        self._frames = [
+            np.ndarray((slot_nbytes,), np.uint8, buffer=buffer,
+                       offset=frames_offset + i * _aligned(slot_nbytes))
+            for i in range(slot_count)
+        ]
+
+    # drop the buffer exports, so the SharedMemory can be closed
+    def release(self):
+        self._header = None
+        self._slots = None
+        self._frames = []
+
+
+class SharedFrameWriter(_SharedFrameSlots):
+    def __init__(self, buffer, slot_nbytes: int, slot_count: int = DEFAULT_SLOT_COUNT) -> None:
+        super().__init__(buffer, slot_nbytes, slot_count)
+
+        self._header['latest_seq'] = 0
+        self._header['slot_count'] = slot_count
+        self._header['slot_nbytes'] = slot_nbytes
+        self._slots[:] = 0
+
+        self._seq = 0
+        self._shape = None
+        self._generation = 0
+
+    # return False when the image does not fit into the slots
+    # timestamp: source frame's capture time (default: now)
+    # grab_timestamp: when the source frame was read by the consumer
+    def write(self,
+              img: np.ndarray,
+              timestamp: Optional[float] = None,
+              grab_timestamp: Optional[float] = None) -> bool:
+        if img.nbytes > self._slot_nbytes:
+            return False
+
+        now = time.time()
+
+        if img.shape != self._shape:
+            self._shape = img.shape
+            self._generation += 1
+
+        seq = self._seq + 1
+        slot_i = seq % self._slot_count
+        slot = self._slots[slot_i]
+
+        slot['lock'] += 1
+        np.copyto(self._frames[slot_i][:img.nbytes].view(img.dtype).reshape(img.shape), img)
+        slot['seq'] = seq
+        slot['timestamp'] = now if timestamp is None else timestamp
+        slot['grab_timestamp'] = grab_timestamp or 0.0
+        slot['write_timestamp'] = now
+        slot['height'], slot['width'] = img.shape[:2]
+        slot['generation'] = self._generation
+        slot['lock'] += 1
+
+        self._header['latest_seq'] = seq
+        self._seq = seq
+
+        return True
+
+
+class SharedFrameReader(_SharedFrameSlots):
+    READ_RETRIES = 2
+
+    # pixel_shape: shape of a pixel, e.g. (3,) for RGB
+    def __init__(self,
+                 buffer,
+                 slot_nbytes: int,
+                 frame_dtype,
+                 pixel_shape: Tuple = (),
+                 slot_count: int = DEFAULT_SLOT_COUNT) -> None:
+        super().__init__(buffer, slot_nbytes, slot_count)
+
+        self._dtype = np.dtype(frame_dtype)
+        self._pixel_shape = tuple(pixel_shape)
+
+        self._frame = None
+        self._last_seq = 0
+        self.generation = 0
+
+        self.dropped_frames = 0
+        self.duplicate_reads = 0
+        self.torn_reads = 0
+
+    def fits(self, width: int, height: int) -> bool:
+        pixel_nbytes = int(np.prod(self._pixel_shape)) * self._dtype.itemsize
+        return width * height * pixel_nbytes <= self._slot_nbytes
+
+    # return the private copy of the latest complete frame, None if no new frame is available
+    def read(self) -> Optional[Tuple[np.ndarray, FrameHeader]]:
+        for _ in range(self.READ_RETRIES + 1):
+            latest_seq = int(self._header['latest_seq'])
+
+            if latest_seq == self._last_seq:
+                self.duplicate_reads += 1
+                return None
+
+            slot_i = latest_seq % self._slot_count
+            slot = self._slots[slot_i]
+
+            lock = int(slot['lock'])
+            if lock % 2:
+                self.torn_reads += 1
+                continue
+
+            header = FrameHeader(int(slot['seq']), float(slot['timestamp']),
+                                 int(slot['width']), int(slot['height']),
+                                 int(slot['generation']),
+                                 float(slot['grab_timestamp']),
+                                 float(slot['write_timestamp']))
+
+            shape = (header.height, header.width, *self._pixel_shape)
+            if self._frame is None or self._frame.shape != shape:
+                if not self.fits(header.width, header.height):
+                    # inconsistent header, we are in the middle of a write
+                    self.torn_reads += 1
+                    continue
+                self._frame = np.empty(shape, self._dtype)
+
+            frame_nbytes = self._frame.nbytes
+            np.copyto(self._frame, self._frames[slot_i][:frame_nbytes].view(self._dtype).reshape(shape))
+
+            if int(slot['lock']) != lock or header.seq != latest_seq:
+                # overwritten during the copy
+                self.torn_reads += 1
+                continue
+
+            if self._last_seq:
+                self.dropped_frames += max(header.seq - self._last_seq - 1, 0)
+            self._last_seq = header.seq
+            self.generation = header.generation
+
+            return self._frame, header
+
+        return None
+
+
+# Pyramid output: one segment with a level table, followed by a
+#  complete frame segment (header + slots) per level:
+#  [pyramid header][level table][level 0 segment][level 1 segment]..
+
+PYRAMID_HEADER = np.dtype([
+    ('level_count', '<u4'),
+    ('_padding', '<u4'),
+])
+
+PYRAMID_LEVEL = np.dtype([
+    ('offset', '<u8'),
+    ('nbytes', '<u8'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+])
+
+
+def _pyramid_table_nbytes(level_count: int) -> int:
+    return _aligned(PYRAMID_HEADER.itemsize) + _aligned(PYRAMID_LEVEL.itemsize * level_count)
+
+
+# scales are relative to the input, in decreasing order
+def pyramid_level_sizes(width: int, height: int, scales: Sequence[float]) -> List[Tuple[int, int]]:
+    return [(max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+            for scale in scales]
+
+
+def pyramid_nbytes(level_sizes: Sequence[Tuple[int, int]],
+                   pixel_nbytes: int,
+                   slot_count: int = DEFAULT_SLOT_COUNT) -> int:
+    return _pyramid_table_nbytes(len(level_sizes)) + sum(
+        _aligned(segment_nbytes(w * h * pixel_nbytes, slot_count))
+        for w, h in level_sizes)
+
+
+# return the level's own frame segment (for SharedFrameReader) and its size
+def pyramid_level(buffer, level: int) -> Tuple[memoryview, int, int]:
+    header = np.ndarray((), PYRAMID_HEADER, buffer=buffer)
+    level_count = int(header['level_count'])
+
+    if not 0 <= level < level_count:
+        raise IndexError(f"Pyramid level {level} not exists")
+
+    table = np.ndarray((level_count,), PYRAMID_LEVEL, buffer=buffer,
+                       offset=_aligned(PYRAMID_HEADER.itemsize))
+    offset, nbytes = int(table[level]['offset']), int(table[level]['nbytes'])
+    width, height = int(table[level]['width']), int(table[level]['height'])
+
+    return memoryview(buffer)[offset:offset + nbytes], width, height
+
+
+# Every level is downscaled from the previous one:
+#  cv2.pyrDown for exact halving, INTER_AREA otherwise
+class SharedPyramidWriter:
+    def __init__(self,
+                 buffer,
+                 level_sizes: Sequence[Tuple[int, int]],
+                 pixel_nbytes: int,
+                 slot_count: int = DEFAULT_SLOT_COUNT) -> None:
+        self._level_sizes = list(level_sizes)
+
+        header = np.ndarray((), PYRAMID_HEADER, buffer=buffer)
+        header['level_count'] = len(self._level_sizes)
+
+        table = np.ndarray((len(self._level_sizes),), PYRAMID_LEVEL, buffer=buffer,
+                           offset=_aligned(PYRAMID_HEADER.itemsize))
+
+        self._level_buffers = []
+        self._writers = []
+
+        offset = _pyramid_table_nbytes(len(self._level_sizes))
+        for i, (w, h) in enumerate(self._level_sizes):
+            slot_nbytes = w * h * pixel_nbytes
+            nbytes = segment_nbytes(slot_nbytes, slot_count)
+
+            table[i] = (offset, nbytes, w, h)
+
+            level_buffer = memoryview(buffer)[offset:offset + nbytes]
+            self._level_buffers.append(level_buffer)
+            self._writers.append(SharedFrameWriter(level_buffer, slot_nbytes, slot_count))
+
+            offset += _aligned(nbytes)
+
+    def write(self,
+              img: np.ndarray,
+              timestamp: Optional[float] = None,
+              grab_timestamp: Optional[float] = None) -> bool:
+        timestamp = time.time() if timestamp is None else timestamp
+
+        level_img = img
+        for (w, h), writer in zip(self._level_sizes, self._writers):
+            prev_h, prev_w = level_img.shape[:2]
+
+            if (w, h) == (prev_w, prev_h):
+                pass
+            elif (w, h) == ((prev_w + 1) // 2, (prev_h + 1) // 2):
+                level_img = cv2.pyrDown(level_img)
+            else:
+                level_img = cv2.resize(level_img, (w, h), interpolation=cv2.INTER_AREA)
+
+            if not writer.write(level_img, timestamp, grab_timestamp):
+                return False
+
+        return True
+
+    def release(self):
+        for writer in self._writers:
+            writer.release()
+        for level_buffer in self._level_buffers:
+            level_buffer.release()
+
+        self._writers = []
+        self._level_buffers = []
@@ -1,3 +1,9 @@
 
 DEBUG = False
-GUI_DEBUG = False
\ No newline at end of file
+GUI_DEBUG = False
+
+# recorders encode in a shared pool of worker processes
+#  (started by the main process) instead of their own consumer process
+ENCODER_FARM = False
+# None: half of the CPU count
+ENCODER_FARM_WORKERS = None
\ No newline at end of file